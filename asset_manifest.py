@@ -0,0 +1,118 @@
+import os
+import json
+import threading
+# Pillow is imported inside the functions that use it, so importing main.py stays fast
+from cache import hash_file
+from static_files import HASHED_NAME, SHARED_DIR, hashed_name, publish_shared, precompress, copy_atomic, write_atomic
+
+MANIFEST_NAME = 'asset_manifest.json'
+# Stock sounds, identical in every game: published once to shared/ instead of copied
+SHARED_ASSETS = ('walk.mp3', 'hit.wav', 'level.mp3', 'default_BGM.mp3')
+PLAYER_ASSETS = ('temp_down.png', 'temp_up.png', 'temp_right.png', 'player_avatar.png')
+IMAGE_EXTENSIONS = ('.png', '.webp', '.jpg', '.jpeg')
+
+def loaded_assets(scenes):
+    """
+    Logical keys of the files game.js loads for a game, in load order: player
+    images, backgrounds, NPC and minion images (minus those packed in the texture
+    atlas), the atlas itself and the sounds.
+    """
+    atlas = scenes[0].get('atlas') if scenes else None
+    in_atlas = set(atlas['frames']) if atlas else set()
+    keys = list(PLAYER_ASSETS)
+    for scene in scenes:
+        keys.append(scene.get('background_image'))
+        for npc in scene.get('npc', []):
+            keys += [npc.get('sprite'), npc.get('avatar')]
+        for m in scene.get('minions', []):
+            keys.append(m.get('sprite'))
+    if atlas:
+        keys += [atlas['image'], atlas['data']]
+    keys += list(SHARED_ASSETS) + ['bgm.mp3']
+    return [k for k in dict.fromkeys(keys) if k and k not in in_atlas]
+
+class AssetManifest:
+    """
+    asset_manifest.json of one game. It maps each logical key (the stable name
+    game_data.json uses, e.g. "npc_XiaoYan.png") to a content-hashed copy, with
+    its size, sha256 and, for images, its dimensions. Hashed names never change
+    content, so server.py sends them as immutable. The pipeline keeps working on
+    the stable names. Stock sounds are published once to shared/ for all games.
+    Methods may be called from several threads (the BGM thread adds bgm.mp3);
+    one lock serializes them.
+    """
+    def __init__(self, game_dir, base_dir):
+        self.game_dir = game_dir
+        self.base_dir = base_dir
+        self.assets_dir = os.path.join(game_dir, 'assets')
+        self.path = os.path.join(game_dir, MANIFEST_NAME)
+        self.assets = {}
+        self._lock = threading.RLock()
+
+    def publish(self, key):
+        """
+        Publishes one asset under its content hash and records it. Returns the
+        entry, or None if the file does not exist (yet).
+        """
+        from PIL import Image
+        with self._lock:
+            if key in SHARED_ASSETS:
+                src = os.path.join(self.base_dir, key)
+            else:
+                src = os.path.join(self.assets_dir, key)
+            if not os.path.isfile(src):
+                return None
+            digest = hash_file(src)
+            if key in SHARED_ASSETS:
+                url = f"../{SHARED_DIR}/{publish_shared(self.base_dir, src, digest)}"
+            else:
+                name = hashed_name(key, digest)
+                dest = os.path.join(self.assets_dir, name)
+                if not os.path.exists(dest):
+                    # A copy, not a link: the pipeline rewrites the stable name in place
+                    copy_atomic(src, dest)
+                url = f"assets/{name}"
+            entry = {'file': url, 'bytes': os.path.getsize(src), 'sha256': digest}
+            if key.lower().endswith(IMAGE_EXTENSIONS):
+                with Image.open(src) as img:
+                    entry['width'], entry['height'] = img.size
+            self.assets[key] = entry
+            return entry
+
+    def alias(self, key, target):
+        """
+        Records key as the same file as target (e.g. bgm.mp3 -> default_BGM.mp3 in
+        shared/ after the BGM fell back to it) instead of publishing another copy.
+        """
+        with self._lock:
+            entry = self.assets.get(target) or self.publish(target)
+            if entry is None:
+                return None
+            self.assets[key] = dict(entry)
+            return self.assets[key]
+
+    def publish_all(self, scenes):
+        with self._lock:
+            for key in loaded_assets(scenes):
+                self.publish(key)
+            self.save()
+            self.remove_stale()
+
+    def save(self):
+        with self._lock:
+            data = {'version': 1, 'assets': dict(sorted(self.assets.items()))}
+            body = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+            write_atomic(self.path, lambda f: f.write(body))
+            precompress(self.path)
+
+    def remove_stale(self):
+        """
+        Deletes hashed copies in assets/ (and their compressed variants) that no
+        entry points to any more: older versions of regenerated assets.
+        """
+        with self._lock:
+            used = {os.path.basename(e['file']) for e in self.assets.values()}
+            for name in os.listdir(self.assets_dir):
+                base = name[:-3] if name.endswith(('.gz', '.br')) else name
+                if HASHED_NAME.search(base) and base not in used:
+                    os.remove(os.path.join(self.assets_dir, name))
@@ -0,0 +1,275 @@
+import os
+import json
+import asyncio
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from urllib.parse import urlparse, unquote
+
+import server
+from uploads import CHUNK_SIZE, UploadError
+from static_files import static_response
+
+STATUS_TEXT = {
+    200: 'OK',
+    202: 'Accepted',
+    206: 'Partial Content',
+    301: 'Moved Permanently',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    409: 'Conflict',
+    411: 'Length Required',
+    413: 'Content Too Large',
+    415: 'Unsupported Media Type',
+    416: 'Range Not Satisfiable',
+    500: 'Internal Server Error',
+}
+# Threads for blocking file work (upload writes, stats and opens, catalog rescans,
+# event log loads), so a slow disk never stalls the event loop
+IO_THREADS = 32
+
+class AsyncRPGServer:
+    """
+    Single event-loop HTTP/1.1 server with the same routes as server.RPGRequestHandler.
+    Static files go out with loop.sendfile (zero-copy where the OS supports it) and
+    event streams wait for a notification, so neither ties up an OS thread. Blocking
+    file system calls run in the loop's default executor (asyncio.to_thread).
+    """
+    def __init__(self, base_dir=server.BASE_DIR):
+        self.base_dir = base_dir
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self.send(writer, 400, body=b'Bad request line', keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                if method == 'POST' and urlparse(target).path == '/api/generate':
+                    keep_alive = await self.receive_story(reader, writer, headers, urlparse(target), keep_alive)
+                else:
+                    # No other route takes a body; skip it without buffering
+                    remaining = int(headers.get('content-length') or 0)
+                    while remaining > 0:
+                        remaining -= len(await reader.readexactly(min(CHUNK_SIZE, remaining)))
+                    keep_alive = await self.dispatch(method, target, headers, writer, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            print(f"Error handling request: {e}")
+        finally:
+            writer.close()
+
+    async def send(self, writer, status, headers=None, body=b'', keep_alive=True):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+        headers = dict(headers or {})
+        headers.setdefault('Content-Length', str(len(body)))
+        headers['Date'] = formatdate(usegmt=True)
+        headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        for k, v in headers.items():
+            lines.append(f"{k}: {v}")
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def send_json(self, writer, obj, status=200, keep_alive=True):
+        await self.send(writer, status, {'Content-type': 'application/json'}, json.dumps(obj).encode(), keep_alive)
+        return keep_alive
+
+    async def receive_story(self, reader, writer, headers, url, keep_alive):
+        """
+        Streams a story upload to disk as it arrives (see server.new_upload) and
+        queues its job.
+        """
+        upload = None
+        try:
+            upload = await asyncio.to_thread(server.new_upload, headers, url)
+            remaining = upload.content_length
+            while remaining > 0:
+                data = await reader.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    raise UploadError(400, "Connection closed during upload")
+                await asyncio.to_thread(upload.feed, data)
+                remaining -= len(data)
+            name, path = await asyncio.to_thread(upload.finish)
+            status, payload = await asyncio.to_thread(server.submit_generation, name, path)
+        except (UploadError, OSError) as e:
+            status, payload = await asyncio.to_thread(server.upload_failed, upload, e)
+            # The rest of the body was not read, so the connection can't be reused
+            keep_alive = False
+        return await self.send_json(writer, payload, status, keep_alive)
+
+    async def dispatch(self, method, target, headers, writer, keep_alive):
+        url = urlparse(target)
+
+        if method == 'POST':
+            await self.send(writer, 405, keep_alive=keep_alive)
+            return keep_alive
+
+        if method not in ('GET', 'HEAD'):
+            await self.send(writer, 405, keep_alive=keep_alive)
+            return keep_alive
+
+        if url.path == '/api/games':
+            status, resp_headers, resp_body = await asyncio.to_thread(
+                server.games_response, url, headers.get('if-none-match'))
+            await self.send(writer, status, resp_headers, resp_body, keep_alive)
+            return keep_alive
+
+        if url.path == '/api/jobs' or url.path.startswith('/api/jobs/'):
+            route, status, payload = await asyncio.to_thread(server.route_jobs, url)
+            if route == 'stream':
+                await self.stream_job(writer, payload['id'])
+                return False
+            if route == 'events':
+                await self.stream_events(writer, payload['id'], server.last_event_id(url, headers.get('last-event-id')))
+                return False
+            return await self.send_json(writer, payload, status, keep_alive)
+
+        path = '/home.html' if url.path == '/' else url.path
+        return await self.send_static(writer, path, headers, method == 'HEAD', keep_alive)
+
+    def translate_path(self, path):
+        # Same rules as SimpleHTTPRequestHandler: no escaping the served directory
+        path = posixpath.normpath(unquote(path))
+        parts = [p for p in path.split('/') if p and p not in (os.curdir, os.pardir)]
+        return os.path.join(self.base_dir, *parts)
+
+    def resolve_static(self, url_path, headers):
+        """
+        Blocking part of send_static, run in a worker thread. Returns (status,
+        headers, body, file, offset, length); file is an open file for the body or None.
+        """
+        fs_path = self.translate_path(url_path)
+        if os.path.isdir(fs_path):
+            if not url_path.endswith('/'):
+                return 301, {'Location': url_path + '/'}, b'', None, 0, 0
+            fs_path = os.path.join(fs_path, 'index.html')
+        if not os.path.isfile(fs_path):
+            return 404, {}, b'File not found', None, 0, 0
+        # Same policy as the threaded server: precompressed variants, cache headers,
+        # 304s and byte ranges
+        status, resp_headers, path, offset, length = static_response(fs_path, headers)
+        f = open(path, 'rb') if path is not None else None
+        return status, resp_headers, b'', f, offset, length
+
+    async def send_static(self, writer, url_path, headers, head_only, keep_alive):
+        try:
+            status, resp_headers, body, f, offset, length = await asyncio.to_thread(self.resolve_static, url_path, headers)
+        except OSError:
+            # Removed between the checks and the open
+            await self.send(writer, 404, body=b'File not found', keep_alive=keep_alive)
+            return keep_alive
+        if f is None:
+            await self.send(writer, status, resp_headers, body, keep_alive)
+            return keep_alive
+        with f:
+            await self.send(writer, status, resp_headers, keep_alive=keep_alive)
+            if not head_only:
+                # The body goes out with loop.sendfile
+                await asyncio.get_running_loop().sendfile(writer.transport, f, offset, length)
+        return keep_alive
+
+    async def stream_job(self, writer, job_id):
+        """
+        Async version of RPGRequestHandler.stream_job; ends the connection when done.
+        """
+        writer.write((
+            "HTTP/1.1 200 OK\r\n"
+            "Content-type: text/plain; charset=utf-8\r\n"
+            "Transfer-Encoding: chunked\r\n"
+            "X-Content-Type-Options: nosniff\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode('latin-1'))
+
+        async def send_chunk(text):
+            if not text: return
+            b = text.encode('utf-8')
+            writer.write(f"{len(b):X}\r\n".encode('utf-8') + b + b"\r\n")
+            await writer.drain()
+
+        # Padding to force browser buffer flush (some browsers wait for 1KB)
+        await send_chunk(" " * 1024 + "\n")
+        offset = 0
+        while True:
+            job = server.job_manager.get(job_id)
+            log, offset = await asyncio.to_thread(server.job_manager.read_log, job_id, offset)
+            await send_chunk(log)
+            if job['status'] in ('succeeded', 'failed') and not log:
+                break
+            if not log:
+                await asyncio.sleep(0.5)
+
+        await send_chunk(server.job_result(job))
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def stream_events(self, writer, job_id, last_id):
+        """
+        Async version of RPGRequestHandler.stream_events. A listener on the job's
+        event log wakes the stream when an event is appended; no polling.
+        """
+        loop = asyncio.get_running_loop()
+        # Loaded from disk on first use
+        events = await asyncio.to_thread(server.job_manager.events, job_id)
+        changed = asyncio.Event()
+        def wake():
+            loop.call_soon_threadsafe(changed.set)
+        writer.write((
+            "HTTP/1.1 200 OK\r\n"
+            "Content-type: text/event-stream; charset=utf-8\r\n"
+            "Cache-Control: no-cache\r\n"
+            "X-Accel-Buffering: no\r\n"
+            "Connection: close\r\n\r\n"
+            "retry: 2000\n\n"
+        ).encode('utf-8'))
+        events.add_listener(wake)
+        try:
+            while True:
+                # Cleared before reading so an event appended meanwhile is not missed
+                changed.clear()
+                data, last_id, done = server.job_events(job_id, last_id)
+                if data:
+                    writer.write(data)
+                await writer.drain()
+                if done:
+                    break
+                try:
+                    await asyncio.wait_for(changed.wait(), server.SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    writer.write(b": keepalive\n\n")
+        finally:
+            events.remove_listener(wake)
+
+async def serve(port=server.PORT):
+    app = AsyncRPGServer()
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=IO_THREADS))
+    srv = await asyncio.start_server(app.handle, host='', port=port, reuse_address=True, backlog=1024)
+    print(f"Serving RPG Maker (async) at http://localhost:{port}")
+    print(f"Serving from {app.base_dir}")
+    async with srv:
+        await srv.serve_forever()
+
+def run_async_server(port=server.PORT):
+    server.start_jobs()
+    try:
+        asyncio.run(serve(port))
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
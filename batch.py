@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+from image_edit import ImagePool
+from instrument import tracer
+from static_files import publish_template, publish_shared
+from asset_manifest import SHARED_ASSETS
+
+def find_stories(source):
+    """
+    Returns [(name, story_path)] from a directory of *.txt files, a JSON manifest
+    (a list of paths or {"story": path, "name": name} objects) or a text manifest
+    with one path per line. Relative paths are resolved against the manifest.
+    """
+    if os.path.isdir(source):
+        return [(os.path.splitext(f)[0], os.path.join(source, f))
+                for f in sorted(os.listdir(source)) if f.endswith('.txt')]
+
+    root = os.path.dirname(os.path.abspath(source))
+    with open(source, 'r', encoding='utf-8') as f:
+        if source.endswith('.json'):
+            entries = json.load(f)
+        else:
+            entries = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+    stories = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {'story': entry}
+        path = os.path.join(root, entry['story'])
+        stories.append((entry.get('name') or os.path.splitext(os.path.basename(path))[0], path))
+    return stories
+
+def run_batch(stories, args):
+    """
+    Generates every story in this process with one GeminiClient (and its cache and
+    request governor), one image process pool and one limit on concurrent model
+    requests. Up to args.parallel stories are in flight at once. Returns the list
+    of per-story results.
+    """
+    client = main.GeminiClient(use_cache=not args.no_cache)
+    api_slots = threading.Semaphore(args.workers)
+    results = []
+
+    def run(name, path):
+        start = time.perf_counter()
+        result = {'story': name, 'assets_built': 0, 'assets_skipped': 0, 'seconds': 0.0}
+        if not os.path.exists(path):
+            # Checked here so no empty game folder is created for it
+            print(f"Error: Story file '{path}' not found.")
+            result['error'] = 'story file not found'
+            return result
+        try:
+            counts = main.generate_game(name, client, image_pool, api_slots, args, story_path=path, save_trace=False)
+            if counts is None:
+                result['error'] = 'story file not found'
+            else:
+                result.update(counts)
+        except Exception as e:
+            print(f"Story {name} failed: {e}")
+            result['error'] = str(e)
+        result['seconds'] = round(time.perf_counter() - start, 2)
+        return result
+
+    # game.js and the stock sounds are published to shared/ once here rather than
+    # by every story at the same moment on a first run
+    base_dir = os.path.dirname(os.path.abspath(main.__file__))
+    publish_template(base_dir)
+    for name in SHARED_ASSETS:
+        if os.path.exists(os.path.join(base_dir, name)):
+            publish_shared(base_dir, os.path.join(base_dir, name))
+
+    with ImagePool(args.image_workers) as image_pool:
+        with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as pool:
+            futures = [pool.submit(run, name, path) for name, path in stories]
+            for future in futures:
+                results.append(future.result())
+    return results
+
+def print_report(results, elapsed):
+    ok = [r for r in results if 'error' not in r]
+    built = sum(r['assets_built'] for r in results)
+    skipped = sum(r['assets_skipped'] for r in results)
+    print(f"\nBatch: {len(results)} stories ({len(ok)} ok, {len(results) - len(ok)} failed) in {elapsed:.1f}s")
+    print(f"  stories/hour: {len(ok) / elapsed * 3600:.1f}   assets/minute: {built / elapsed * 60:.1f} "
+          f"({built} built, {skipped} up to date)")
+    print(f"  {'story':24s} {'seconds':>8s} {'built':>6s} {'skipped':>8s}  status")
+    for r in results:
+        status = f"failed: {r['error'][:60]}" if 'error' in r else 'ok'
+        print(f"  {r['story'][:24]:24s} {r['seconds']:8.1f} {r['assets_built']:6d} {r['assets_skipped']:8d}  {status}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description='Generate games for a directory or manifest of stories in one process.',
+        parents=[main.build_parser(add_help=False)],
+    )
+    parser.add_argument('source', help='Directory of *.txt stories, or a manifest (.json list or one path per line).')
+    parser.add_argument('--parallel', type=int, default=2, help='Stories generated at the same time (they share --workers request slots).')
+    parser.add_argument('--report', type=str, help='Write the per-story results and totals to this JSON file.')
+    parser.add_argument('--trace', type=str, help='Write one Chrome trace for the whole batch to this file.')
+    return parser
+
+def batch_main():
+    args = build_parser().parse_args()
+    stories = find_stories(args.source)
+    if not stories:
+        print(f"No stories found in {args.source}")
+        return 1
+    print(f"Generating {len(stories)} stories: {', '.join(name for name, _ in stories)}")
+
+    tracer.reset()
+    start = time.perf_counter()
+    results = run_batch(stories, args)
+    elapsed = time.perf_counter() - start
+    print_report(results, elapsed)
+
+    if args.trace:
+        tracer.save(args.trace, metadata={'stories': [name for name, _ in stories]})
+        print(f"Trace written to {args.trace}")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'seconds': round(elapsed, 2), 'stories': results}, f, ensure_ascii=False, indent=4)
+    return 1 if any('error' in r for r in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(batch_main())
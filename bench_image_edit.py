@@ -0,0 +1,72 @@
+import os
+import sys
+import glob
+import time
+import tempfile
+import argparse
+from PIL import Image
+from image_edit import remove_background, remove_background_reference
+
+def prepare_inputs(src_paths, work_dir):
+    """
+    Flattens each asset onto a white canvas so it looks like a raw Gemini output
+    (opaque, white background) before remove_background runs on it.
+    """
+    inputs = []
+    for path in src_paths:
+        img = Image.open(path).convert("RGBA")
+        canvas = Image.new("RGBA", img.size, (255, 255, 255, 255))
+        canvas.alpha_composite(img)
+        out = os.path.join(work_dir, os.path.basename(path))
+        canvas.save(out)
+        inputs.append(out)
+    return inputs
+
+def run(func, src, dst):
+    start = time.perf_counter()
+    func(src, dst)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Parity check and benchmark for remove_background.')
+    parser.add_argument('--assets', type=str, default=os.path.join('game', 'assets'), help='Folder of PNG assets to use as inputs.')
+    parser.add_argument('--skip-reference', action='store_true', help='Only time the fast path (no parity check).')
+    args = parser.parse_args()
+
+    src_paths = sorted(glob.glob(os.path.join(args.assets, '*.png')))
+    if not src_paths:
+        print(f"No PNG files found in {args.assets}")
+        return 1
+
+    failures = 0
+    total_ref = 0.0
+    total_fast = 0.0
+    with tempfile.TemporaryDirectory() as work_dir:
+        inputs = prepare_inputs(src_paths, work_dir)
+        for path in inputs:
+            name = os.path.basename(path)
+            fast_out = os.path.join(work_dir, 'fast_' + name)
+            t_fast = run(remove_background, path, fast_out)
+            total_fast += t_fast
+            if args.skip_reference:
+                print(f"{name:32s} fast {t_fast:7.3f}s")
+                continue
+
+            ref_out = os.path.join(work_dir, 'ref_' + name)
+            t_ref = run(remove_background_reference, path, ref_out)
+            total_ref += t_ref
+
+            same = Image.open(fast_out).tobytes() == Image.open(ref_out).tobytes()
+            if not same:
+                failures += 1
+            print(f"{name:32s} ref {t_ref:7.3f}s  fast {t_fast:7.3f}s  x{t_ref / max(t_fast, 1e-9):6.1f}  {'OK' if same else 'MISMATCH'}")
+
+    if args.skip_reference:
+        print(f"Total fast: {total_fast:.3f}s")
+    else:
+        print(f"Total ref: {total_ref:.3f}s  fast: {total_fast:.3f}s  speedup x{total_ref / max(total_fast, 1e-9):.1f}")
+        print("Parity: OK" if failures == 0 else f"Parity: {failures} mismatching image(s)")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
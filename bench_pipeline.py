@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import glob
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULT_MARKER = '__BENCH_RESULT__'
+DEFAULT_STORIES = ('game', 'harry_potter', 'test01')
+# Files main.py reads from its own directory besides the story
+SHARED_FILES = ('walk.mp3', 'hit.wav', 'level.mp3', 'default_BGM.mp3', 'npc_ref.webp')
+
+# Differences below these are noise, whatever the relative change
+ABS_FLOOR = {'seconds': 0.1, 'peak_rss_mb': 10, 'output_bytes': 16 * 1024}
+
+def prepare_workdir(workdir, story):
+    """
+    Copies the code, the story and the game template into an empty directory so
+    main.py generates into it instead of the repo.
+    """
+    for path in glob.glob(os.path.join(BASE_DIR, '*.py')):
+        shutil.copy(path, workdir)
+    for name in SHARED_FILES + (f'{story}.txt',):
+        src = os.path.join(BASE_DIR, name)
+        if os.path.exists(src):
+            shutil.copy(src, workdir)
+    template_dir = os.path.join(workdir, 'game')
+    os.makedirs(template_dir, exist_ok=True)
+    for name in ('game.js', 'index.html'):
+        shutil.copy(os.path.join(BASE_DIR, 'game', name), template_dir)
+
+def dir_bytes(path):
+    total = 0
+    by_ext = {}
+    for root, _, files in os.walk(path):
+        for name in files:
+            size = os.path.getsize(os.path.join(root, name))
+            ext = os.path.splitext(name)[1].lower() or name
+            by_ext[ext] = by_ext.get(ext, 0) + size
+            total += size
+    return total, by_ext
+
+def peak_rss_mb(children=False):
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_one(args):
+    """
+    Child process: one end-to-end main.main() run against the fakes. Prints the
+    result as a JSON line after RESULT_MARKER.
+    """
+    sys.path.insert(0, args.workdir)
+    os.chdir(args.workdir)
+    import main
+    import fake_api
+    from instrument import tracer
+
+    fixtures = fake_api.Fixtures(base_dir=BASE_DIR)
+    fake_api.install(main, args.run_one, text_latency=args.text_latency,
+                     image_latency=args.image_latency, bgm_latency=args.bgm_latency, fixtures=fixtures)
+
+    sys.argv = ['main.py', '--storyname', args.run_one, '--workers', str(args.workers), '--no-cache']
+    if args.image_workers is not None:
+        sys.argv += ['--image-workers', str(args.image_workers)]
+    if args.no_optimize:
+        sys.argv.append('--no-optimize')
+    start = time.perf_counter()
+    main.main()
+    wall = time.perf_counter() - start
+
+    stages = {}
+    categories = {}
+    api_calls = 0
+    for (cat, name), row in tracer.summary().items():
+        if cat in ('stage', 'audio'):
+            stages[name] = round(row['seconds'], 3)
+        categories[cat] = round(categories.get(cat, 0) + row['seconds'], 3)
+        if cat == 'gemini':
+            api_calls += row['count']
+    output_bytes, by_ext = dir_bytes(os.path.join(args.workdir, args.run_one))
+    result = {
+        'story': args.run_one,
+        'wall_seconds': round(wall, 3),
+        'stages': stages,
+        'categories': categories,
+        'api_calls': api_calls,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        # Largest image pool worker process
+        'peak_worker_rss_mb': round(peak_rss_mb(children=True), 1),
+        'output_bytes': output_bytes,
+        'output_bytes_by_ext': by_ext,
+    }
+    print(RESULT_MARKER + json.dumps(result))
+
+def run_story(story, args):
+    workdir = tempfile.mkdtemp(prefix=f'bench_{story}_')
+    try:
+        prepare_workdir(workdir, story)
+        cmd = [sys.executable, os.path.abspath(__file__), '--run-one', story, '--workdir', workdir,
+               '--workers', str(args.workers), '--text-latency', str(args.text_latency),
+               '--image-latency', str(args.image_latency), '--bgm-latency', str(args.bgm_latency)]
+        if args.image_workers is not None:
+            cmd += ['--image-workers', str(args.image_workers)]
+        if args.no_optimize:
+            cmd.append('--no-optimize')
+        env = dict(os.environ, GEMINI_API_KEY=os.environ.get('GEMINI_API_KEY', 'offline'))
+        proc = subprocess.run(cmd, capture_output=True, text=True, env=env)
+        if args.verbose:
+            print(proc.stdout)
+        for line in proc.stdout.splitlines():
+            if line.startswith(RESULT_MARKER):
+                return json.loads(line[len(RESULT_MARKER):])
+        print(proc.stdout[-2000:])
+        print(proc.stderr[-2000:])
+        raise RuntimeError(f"Benchmark run for '{story}' failed (exit code {proc.returncode})")
+    finally:
+        if args.keep:
+            print(f"Kept work directory {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def print_result(r):
+    print(f"{r['story']}: {r['wall_seconds']:.2f}s total, {r['api_calls']} API calls, "
+          f"peak RSS {r['peak_rss_mb']:.0f} MB (workers {r.get('peak_worker_rss_mb', 0):.0f} MB), output {r['output_bytes'] / (1024 * 1024):.2f} MB")
+    for name, seconds in sorted(r['stages'].items(), key=lambda kv: -kv[1]):
+        print(f"    stage    {name:24s} {seconds:8.2f}s")
+    for cat, seconds in sorted(r['categories'].items(), key=lambda kv: -kv[1]):
+        if cat not in ('stage', 'audio'):
+            print(f"    busy     {cat:24s} {seconds:8.2f}s")
+    exts = ', '.join(f"{ext} {size // 1024} KB" for ext, size in sorted(r['output_bytes_by_ext'].items(), key=lambda kv: -kv[1]))
+    print(f"    bytes    {exts}")
+
+def metrics(r):
+    """
+    Flat {metric: (value, kind)} view of one result used for baseline comparison.
+    """
+    out = {'wall_seconds': (r['wall_seconds'], 'seconds'),
+           'peak_rss_mb': (r['peak_rss_mb'], 'peak_rss_mb'),
+           'output_bytes': (r['output_bytes'], 'output_bytes')}
+    for name, seconds in r['stages'].items():
+        out[f'stage:{name}'] = (seconds, 'seconds')
+    return out
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change against the baseline for every metric. Returns the list of
+    regressions: slower/larger by more than tolerance and the metric's noise floor.
+    """
+    regressions = []
+    print(f"\nComparison with baseline (tolerance {tolerance:.0%}):")
+    for r in results:
+        base = baseline.get(r['story'])
+        if base is None:
+            print(f"  {r['story']}: not in baseline")
+            continue
+        base_metrics = metrics(base)
+        for key, (value, kind) in metrics(r).items():
+            if key not in base_metrics:
+                continue
+            old = base_metrics[key][0]
+            change = (value - old) / old if old else 0.0
+            flag = ''
+            if value - old > ABS_FLOOR[kind] and change > tolerance:
+                flag = '  REGRESSION'
+                regressions.append((r['story'], key, old, value))
+            print(f"  {r['story']:14s} {key:32s} {old:>12} -> {value:>12} ({change:+.1%}){flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark of main.py with fake Gemini/ElevenLabs clients.')
+    parser.add_argument('--stories', nargs='+', default=list(DEFAULT_STORIES), help='Story names (<name>.txt) to run.')
+    parser.add_argument('--workers', type=int, default=4, help='Passed to main.py --workers.')
+    parser.add_argument('--text-latency', type=float, default=0.2, help='Seconds per fake text call (generate_json, describe_image).')
+    parser.add_argument('--image-latency', type=float, default=0.5, help='Seconds per fake image call.')
+    parser.add_argument('--bgm-latency', type=float, default=1.0, help='Seconds per fake BGM generation.')
+    parser.add_argument('--image-workers', type=int, default=None, help='Passed to main.py --image-workers.')
+    parser.add_argument('--no-optimize', action='store_true', help='Passed to main.py.')
+    parser.add_argument('--baseline', type=str, default=os.path.join(BASE_DIR, 'bench_baseline.json'), help='Baseline results file.')
+    parser.add_argument('--save-baseline', action='store_true', help='Write this run as the new baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Relative slowdown/growth reported as a regression.')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated work directories.')
+    parser.add_argument('--verbose', action='store_true', help="Print main.py's output.")
+    parser.add_argument('--run-one', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(args)
+        return 0
+
+    print(f"Latency: text {args.text_latency}s, image {args.image_latency}s, bgm {args.bgm_latency}s; workers {args.workers}")
+    results = []
+    for story in args.stories:
+        result = run_story(story, args)
+        print_result(result)
+        results.append(result)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        print(f"{len(regressions)} regression(s)")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({r['story']: r for r in results}, f, ensure_ascii=False, indent=4)
+        print(f"Saved baseline to {args.baseline}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
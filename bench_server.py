@@ -0,0 +1,156 @@
+import os
+import re
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import posixpath
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def game_urls(game):
+    """
+    The files a browser fetches to load one game (mirrors preload() in game.js).
+    """
+    urls = [f'/{game}/index.html', f'/{game}/game_data.json']
+    # game.js: a copy in the game folder (older games) or the shared template
+    with open(os.path.join(BASE_DIR, game, 'index.html'), 'r', encoding='utf-8') as f:
+        for src in re.findall(r'<script src="(?!https?:)([^"?]+)', f.read()):
+            urls.append(posixpath.normpath(f'/{game}/{src}'))
+    manifest_path = os.path.join(BASE_DIR, game, 'asset_manifest.json')
+    if os.path.exists(manifest_path):
+        # Content-hashed files listed in the manifest
+        urls.append(f'/{game}/asset_manifest.json')
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            for entry in json.load(f)['assets'].values():
+                urls.append(posixpath.normpath(f"/{game}/{entry['file']}"))
+        return [u for u in urls if os.path.exists(os.path.join(BASE_DIR, u.lstrip('/')))]
+    for name in ('temp_down.png', 'temp_up.png', 'temp_right.png', 'player_avatar.png',
+                 'walk.mp3', 'hit.wav', 'level.mp3', 'bgm.mp3', 'default_BGM.mp3'):
+        urls.append(f'/{game}/assets/{name}')
+    with open(os.path.join(BASE_DIR, game, 'game_data.json'), 'r', encoding='utf-8') as f:
+        scenes = json.load(f)
+    seen = set()
+    for scene in scenes:
+        names = [scene.get('background_image')]
+        for npc in scene.get('npc', []):
+            names += [npc.get('sprite'), npc.get('avatar')]
+        for m in scene.get('minions', []):
+            names.append(m.get('sprite'))
+        for name in names:
+            if name and name not in seen:
+                seen.add(name)
+                urls.append(f'/{game}/assets/{name}')
+    # Only count files that exist so errors reflect the server, not the game folder
+    return [u for u in urls if os.path.exists(os.path.join(BASE_DIR, u.lstrip('/')))]
+
+async def fetch(reader, writer, host, url):
+    writer.write(f"GET {url} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n".encode('latin-1'))
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    version, status = status_line.split()[:2]
+    status = int(status)
+    length = 0
+    # HTTP/1.0 responses (SimpleHTTPRequestHandler) close unless told otherwise
+    close = version != b'HTTP/1.1'
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value.strip())
+        elif name == 'connection':
+            close = value.strip().lower() == 'close'
+    await reader.readexactly(length)
+    return status, length, close
+
+async def load_game(host, port, urls):
+    """
+    Loads every file of a game over one keep-alive connection (reconnecting if the
+    server closes it). Returns (seconds, bytes, errors).
+    """
+    start = time.perf_counter()
+    total = 0
+    errors = 0
+    reader = writer = None
+    try:
+        for url in urls:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            status, length, close = await fetch(reader, writer, host, url)
+            if status != 200:
+                errors += 1
+            total += length
+            if close:
+                writer.close()
+                writer = None
+    except (OSError, asyncio.IncompleteReadError, ValueError):
+        errors += 1
+    finally:
+        if writer is not None:
+            writer.close()
+    return time.perf_counter() - start, total, errors
+
+async def run_load(host, port, urls, clients):
+    start = time.perf_counter()
+    results = await asyncio.gather(*(load_game(host, port, urls) for _ in range(clients)))
+    return time.perf_counter() - start, results
+
+def wait_for_port(host, port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent game-load benchmark for server.py.')
+    parser.add_argument('--mode', choices=['threaded', 'async', 'external'], default='async',
+                        help='Start server.py in this mode, or use an already running server (external).')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--game', type=str, default='game', help='Generated game folder to load.')
+    parser.add_argument('--clients', type=int, default=200, help='Number of concurrent game loads.')
+    args = parser.parse_args()
+
+    host = '127.0.0.1'
+    urls = game_urls(args.game)
+    proc = None
+    if args.mode != 'external':
+        cmd = [sys.executable, 'server.py', '--port', str(args.port)]
+        if args.mode == 'async':
+            cmd.append('--async')
+        proc = subprocess.Popen(cmd, cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if not wait_for_port(host, args.port):
+            proc.kill()
+            print("Server did not start")
+            return 1
+
+    try:
+        elapsed, results = asyncio.run(run_load(host, args.port, urls, args.clients))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    times = sorted(r[0] for r in results)
+    total_bytes = sum(r[1] for r in results)
+    errors = sum(r[2] for r in results)
+    requests = len(urls) * args.clients
+    print(f"Mode: {args.mode}  game: {args.game}  clients: {args.clients}  files/game: {len(urls)}")
+    print(f"Wall time: {elapsed:.2f}s  requests/s: {requests / elapsed:.0f}  MB/s: {total_bytes / elapsed / (1024 * 1024):.1f}")
+    print(f"Game load p50: {times[len(times) // 2]:.2f}s  p95: {times[int(len(times) * 0.95) - 1]:.2f}s  max: {times[-1]:.2f}s")
+    print(f"Errors: {errors}")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
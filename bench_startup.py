@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from bench_pipeline import BASE_DIR, prepare_workdir
+
+# Modules whose import time is checked, with their budget in milliseconds
+DEFAULT_BUDGETS = {'main': 250, 'server': 150, 'batch': 250}
+# SDKs, array and image libraries that must only be imported when they are used
+HEAVY_MODULES = ('google.genai', 'elevenlabs', 'numpy', 'scipy', 'httpx', 'PIL')
+
+def import_time_ms(module):
+    """
+    Cumulative import time of module in a fresh interpreter, from -X importtime.
+    Returns (milliseconds, [(self_us, cumulative_us, name)] for every imported module).
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          capture_output=True, text=True, cwd=BASE_DIR)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    rows = []
+    total = None
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(self_us), int(cumulative_us), name.strip()))
+        if name.rstrip() == f' {module}':
+            total = int(cumulative_us) / 1000
+    return total, rows
+
+def heavy_imports(module):
+    """
+    HEAVY_MODULES that importing module pulls in.
+    """
+    code = (f"import sys, {module}\n"
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=BASE_DIR)
+    return [m for m in proc.stdout.strip().split(',') if m]
+
+def resume_seconds(story, repeat):
+    """
+    Generates story once against the fakes in a scratch directory, then times plain
+    `python main.py` reruns where every asset is up to date. No fakes are installed
+    for the reruns, so any request that reaches the API fails them.
+    """
+    workdir = tempfile.mkdtemp(prefix=f'startup_{story}_')
+    try:
+        prepare_workdir(workdir, story)
+        env = dict(os.environ, GEMINI_API_KEY='offline')
+        env.pop('ELEVENLABS_API_KEY', None)
+        subprocess.run([sys.executable, os.path.join(BASE_DIR, 'bench_pipeline.py'), '--run-one', story,
+                        '--workdir', workdir, '--text-latency', '0', '--image-latency', '0', '--bgm-latency', '0'],
+                       check=True, capture_output=True, env=env)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            proc = subprocess.run([sys.executable, 'main.py', '--storyname', story, '--no-optimize'],
+                                  capture_output=True, text=True, cwd=workdir, env=env)
+            times.append(time.perf_counter() - start)
+            if proc.returncode != 0 or 'Generating' in proc.stdout.replace(f"Generating game for story '{story}'", ''):
+                print(proc.stdout[-2000:])
+                print(proc.stderr[-2000:])
+                raise RuntimeError("Resume run was not up to date or failed")
+        return min(times)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Checks import time of the entry points (-X importtime) against a budget.')
+    parser.add_argument('--modules', nargs='+', default=list(DEFAULT_BUDGETS), help='Modules to import.')
+    parser.add_argument('--budget-ms', type=float, default=None, help='Budget for every module (default: per-module budgets).')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement; the fastest counts.')
+    parser.add_argument('--top', type=int, default=8, help='Show this many slowest imports per module.')
+    parser.add_argument('--resume', type=str, default=None, help='Also time a fully up-to-date main.py run for this story.')
+    parser.add_argument('--resume-budget', type=float, default=1.0, help='Budget in seconds for --resume.')
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        budget = args.budget_ms or DEFAULT_BUDGETS.get(module, 250)
+        runs = [import_time_ms(module) for _ in range(args.repeat)]
+        total, rows = min(runs, key=lambda r: r[0])
+        status = 'ok' if total <= budget else 'OVER BUDGET'
+        print(f"import {module}: {total:.1f} ms (budget {budget:.0f} ms) {status}")
+        for self_us, cumulative_us, name in sorted(rows, reverse=True)[:args.top]:
+            print(f"    {name.strip():40s} self {self_us / 1000:7.1f} ms  cumulative {cumulative_us / 1000:7.1f} ms")
+        if total > budget:
+            failures.append(f"import {module} took {total:.1f} ms")
+        heavy = heavy_imports(module)
+        if heavy:
+            print(f"    loaded eagerly: {', '.join(heavy)}")
+            failures.append(f"import {module} loads {', '.join(heavy)}")
+
+    if args.resume:
+        seconds = resume_seconds(args.resume, args.repeat)
+        status = 'ok' if seconds <= args.resume_budget else 'OVER BUDGET'
+        print(f"resume run for {args.resume}: {seconds:.2f}s (budget {args.resume_budget:.1f}s) {status}")
+        if seconds > args.resume_budget:
+            failures.append(f"resume run took {seconds:.2f}s")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
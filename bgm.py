@@ -1,6 +1,8 @@
 import os
+import shutil
+import threading
 from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
+from instrument import span
 
 load_dotenv()
 
@@ -10,20 +12,104 @@ def generate_bgm(prompt, output_path, length_ms=60000):
         print("Warning: ELEVENLABS_API_KEY not set. Skipping BGM generation.")
         return False
 
+    # Imported here so importing main.py doesn't load the ElevenLabs SDK
+    from elevenlabs.client import ElevenLabs
     elevenlabs = ElevenLabs(api_key=api_key)
     track = elevenlabs.music.compose(
         prompt=prompt,
         music_length_ms=length_ms,
     )
 
+    # Chunks are written as they arrive to a .part file that replaces output_path
+    # once the track is complete, so the game never loads a truncated file
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, "wb") as f:
-        for chunk in track:
-            f.write(chunk)
+    part_path = output_path + '.part'
+    try:
+        with open(part_path, "wb") as f:
+            for chunk in track:
+                f.write(chunk)
+                f.flush()
+        os.replace(part_path, output_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
 
     print(f"BGM saved to {output_path}")
     return True
 
+class BackgroundTrack:
+    """
+    Composes the BGM in its own thread so it runs alongside image generation instead
+    of in front of it. Until the track is in place game.js plays default_BGM.mp3;
+    wait(timeout) lets the caller stop waiting after a deadline while the thread
+    finishes and swaps the real track in. If generation fails, fallback_path is
+    copied to output_path.
+    """
+    def __init__(self, prompt, output_path, fallback_path=None, length_ms=60000, generate=None):
+        self.prompt = prompt
+        self.output_path = output_path
+        self.fallback_path = fallback_path
+        self.length_ms = length_ms
+        self.generate = generate or generate_bgm
+        self.ok = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        # Not a daemon: the process finishes the track even after the game is ready
+        self._thread = threading.Thread(target=self._run, name='bgm')
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            with span('generate_bgm', 'audio', file=os.path.basename(self.output_path)) as trace:
+                if not self.generate(self.prompt, self.output_path, self.length_ms):
+                    raise RuntimeError("BGM generation returned false")
+                trace['bytes'] = os.path.getsize(self.output_path)
+            self.ok = True
+        except Exception as e:
+            self.ok = False
+            print(f"Failed to generate BGM: {e}")
+            if self.fallback_path and os.path.exists(self.fallback_path):
+                os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+                shutil.copy(self.fallback_path, self.output_path)
+                print(f"Using {os.path.basename(self.fallback_path)} as fallback.")
+        finally:
+            with self._lock:
+                self._done.set()
+                callbacks = list(self._callbacks)
+            for callback in callbacks:
+                self._call(callback)
+
+    def _call(self, callback):
+        try:
+            callback(self)
+        except Exception as e:
+            print(f"BGM callback failed: {e}")
+
+    def add_done_callback(self, callback):
+        """
+        Calls callback(track) once the track (or the fallback) is in place, from
+        the BGM thread; right away if it already is.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        self._call(callback)
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits up to timeout seconds (None = until finished). Returns True if the track
+        (or the fallback after a failure) is in place.
+        """
+        return self._done.wait(timeout)
+
 if __name__ == "__main__":
     # Example usage
     generate_bgm(
@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'gemini')
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class GenerationCache:
+    """
+    On-disk content-addressed cache for model responses.
+    Entries are keyed on model, prompt, input-image hashes and request options, and
+    stored as <key>.json (text) plus an optional <key>.bin (image bytes).
+    The total size is bounded; least recently used entries are evicted first.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = None  # key -> size in bytes, oldest first; loaded on first use
+        self._total = 0
+
+    def _index(self):
+        # Called with the lock held. Scanning the cache directory is deferred so
+        # runs that never reach the model don't pay for it.
+        if self._entries is None:
+            self._entries = OrderedDict()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_index()
+        return self._entries
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, key + '.json'), os.path.join(self.cache_dir, key + '.bin')
+
+    def _load_index(self):
+        found = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-5]
+            meta_path, blob_path = self._paths(key)
+            try:
+                size = os.path.getsize(meta_path)
+                if os.path.exists(blob_path):
+                    size += os.path.getsize(blob_path)
+                found.append((os.path.getmtime(meta_path), key, size))
+            except OSError:
+                continue
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total += size
+
+    @staticmethod
+    def make_key(model, prompt, image_paths=(), options=None):
+        h = hashlib.sha256()
+        h.update(model.encode('utf-8'))
+        h.update(b'\0')
+        h.update(prompt.encode('utf-8'))
+        for path in image_paths:
+            h.update(b'\0img:')
+            h.update(hash_file(path).encode('ascii'))
+        if options:
+            h.update(b'\0opt:')
+            h.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Returns (text, image_bytes) for a cached entry, or None on a miss.
+        """
+        meta_path, blob_path = self._paths(key)
+        with self._lock:
+            if key not in self._index():
+                self.misses += 1
+                return None
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                image_bytes = None
+                if meta.get('has_image'):
+                    with open(blob_path, 'rb') as f:
+                        image_bytes = f.read()
+            except (OSError, json.JSONDecodeError):
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            try:
+                os.utime(meta_path)
+            except OSError:
+                pass
+            self.hits += 1
+            return meta.get('text', ''), image_bytes
+
+    def put(self, key, text, image_bytes=None):
+        meta_path, blob_path = self._paths(key)
+        meta = json.dumps({'text': text or '', 'has_image': image_bytes is not None}, ensure_ascii=False).encode('utf-8')
+        size = len(meta) + (len(image_bytes) if image_bytes is not None else 0)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._index():
+                self._drop(key)
+            if image_bytes is not None:
+                self._write(blob_path, image_bytes)
+            # The .json file is written last; its presence marks a complete entry.
+            self._write(meta_path, meta)
+            self._entries[key] = size
+            self._total += size
+            while self._total > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _write(self, path, data):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _drop(self, key):
+        self._total -= self._entries.pop(key, 0)
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._index()),
+                'bytes': self._total,
+            }
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+class GameCatalog:
+    """
+    In-memory index of generated games (folders with an index.html) for /api/games.
+    Built once, then kept current by update_game() when a generation job finishes
+    and by a rescan whenever the base directory's mtime changes (checked at most
+    every check_interval seconds). The JSON body and ETag are cached per version.
+    """
+    def __init__(self, base_dir, check_interval=2.0, exclude=('game',)):
+        self.base_dir = base_dir
+        self.check_interval = check_interval
+        self.exclude = set(exclude)
+        self._lock = threading.Lock()
+        self._games = {}  # name -> entry
+        self._sorted = []
+        self._body = b'[]'
+        self._etag = '""'
+        self._dir_mtime = None
+        self._last_check = 0.0
+        self.refresh()
+
+    def _entry(self, name):
+        item_path = os.path.join(self.base_dir, name)
+        # Hidden folders or 'game' template
+        if name in self.exclude or name.startswith('.'):
+            return None
+        if not os.path.isdir(item_path) or not os.path.exists(os.path.join(item_path, 'index.html')):
+            return None
+        return {
+            'name': name,
+            'path': f'/{name}/index.html',
+            # Use modification time as a sort key
+            'mtime': os.path.getmtime(item_path)
+        }
+
+    def _rebuild(self):
+        # Sort by newest first
+        self._sorted = sorted(self._games.values(), key=lambda x: x['mtime'], reverse=True)
+        self._body = json.dumps(self._sorted).encode()
+        self._etag = '"' + hashlib.sha1(self._body).hexdigest()[:16] + '"'
+
+    def refresh(self):
+        """
+        Full rescan of the base directory.
+        """
+        games = {}
+        try:
+            dir_mtime = os.path.getmtime(self.base_dir)
+            for item in os.listdir(self.base_dir):
+                entry = self._entry(item)
+                if entry:
+                    games[item] = entry
+        except Exception as e:
+            print(f"Error listing games: {e}")
+            return
+        with self._lock:
+            self._games = games
+            self._dir_mtime = dir_mtime
+            self._last_check = time.time()
+            self._rebuild()
+
+    def update_game(self, name):
+        """
+        Re-reads a single game folder (added, changed or removed).
+        """
+        entry = self._entry(name)
+        with self._lock:
+            if entry:
+                self._games[name] = entry
+            else:
+                self._games.pop(name, None)
+            self._rebuild()
+
+    def _check(self):
+        now = time.time()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        try:
+            changed = os.path.getmtime(self.base_dir) != self._dir_mtime
+        except OSError:
+            return
+        if changed:
+            self.refresh()
+
+    def snapshot(self):
+        """
+        Returns (games, body, etag) for the current version of the catalog.
+        """
+        self._check()
+        with self._lock:
+            return self._sorted, self._body, self._etag
+
+    def response(self, offset=None, limit=None, if_none_match=None):
+        """
+        Builds the /api/games response. Returns (status, headers, body).
+        Without offset/limit the full cached list is returned as-is.
+        """
+        games, body, etag = self.snapshot()
+        if offset is not None or limit is not None:
+            try:
+                offset = max(0, int(offset or 0))
+                limit = max(0, int(limit)) if limit is not None else len(games)
+            except ValueError:
+                body = json.dumps({'error': 'offset and limit must be integers'}).encode()
+                return 400, {'Content-type': 'application/json'}, body
+            etag = f'{etag[:-1]}-{offset}-{limit}"'
+            body = json.dumps(games[offset:offset + limit]).encode()
+        headers = {
+            'Content-type': 'application/json',
+            'ETag': etag,
+            'Cache-Control': 'no-cache',
+            'X-Total-Count': str(len(games)),
+        }
+        if if_none_match and etag in [t.strip() for t in if_none_match.split(',')]:
+            return 304, headers, b''
+        return 200, headers, body
@@ -0,0 +1,170 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import threading
+import unicodedata
+from cache import hash_file
+
+DEFAULT_LIBRARY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'characters')
+# Words that say nothing about who a character is or what they wear
+STOPWORDS = {'a', 'an', 'the', 'of', 'and', 'with', 'in', 'on', 'at', 'to', 'his', 'her', 'their', 'its'}
+
+def normalize_name(text):
+    """
+    Case-folded, NFKC-normalized words of text joined by single spaces.
+    """
+    return ' '.join(re.findall(r'\w+', unicodedata.normalize('NFKC', text or '').casefold()))
+
+def tokens(text):
+    """
+    Set of comparison tokens: ASCII words minus stopwords, and character bigrams of
+    other words (Chinese names and outfits are not space-separated).
+    """
+    result = set()
+    for word in normalize_name(text).split():
+        if word.isascii():
+            if word not in STOPWORDS:
+                result.add(word)
+        else:
+            result.update(word[i:i + 2] for i in range(max(1, len(word) - 1)))
+    return result
+
+def similarity(name_a, outfit_a, name_b, outfit_b):
+    """
+    0..1 score of how likely two (name, outfit) descriptions are the same character.
+    Names weigh 0.6: equal normalized names score 1, one name contained in the other
+    ("Hagrid" / "Rubeus Hagrid") 0.9, otherwise token overlap. Outfits weigh 0.4
+    (Jaccard similarity of their tokens).
+    """
+    if normalize_name(name_a) == normalize_name(name_b):
+        name_score = 1.0
+    else:
+        ta, tb = tokens(name_a), tokens(name_b)
+        if not ta or not tb:
+            return 0.0
+        common = len(ta & tb)
+        name_score = max(common / len(ta | tb), 0.9 * common / min(len(ta), len(tb)))
+    oa, ob = tokens(outfit_a), tokens(outfit_b)
+    outfit_score = len(oa & ob) / len(oa | ob) if oa or ob else 1.0
+    return 0.6 * name_score + 0.4 * outfit_score
+
+class CharacterLibrary:
+    """
+    Shared store of generated character sprites/avatars across stories.
+    Each entry is <id>.json plus <id>_sprite.png and optionally <id>_avatar.png, where
+    id is derived from the normalized name, outfit and kind ('npc' or 'minion').
+    The .json file is written last and its presence marks a complete entry, so
+    several main.py processes can add characters at the same time.
+    Lookups go through an inverted index of name tokens.
+    """
+    def __init__(self, library_dir=DEFAULT_LIBRARY_DIR):
+        self.library_dir = library_dir
+        self.entries = None  # id -> entry; loaded on first use
+        self._by_token = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_id(name, outfit, kind):
+        key = '\0'.join((kind, normalize_name(name), normalize_name(outfit)))
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:20]
+
+    def _index(self, entry):
+        self.entries[entry['id']] = entry
+        for token in tokens(entry['name']):
+            self._by_token.setdefault(token, set()).add(entry['id'])
+
+    def _load(self):
+        # Called with the lock held
+        if self.entries is not None:
+            return
+        self.entries = {}
+        if not os.path.isdir(self.library_dir):
+            return
+        for filename in os.listdir(self.library_dir):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.library_dir, filename), 'r', encoding='utf-8') as f:
+                    self._index(json.load(f))
+            except (OSError, json.JSONDecodeError, KeyError):
+                continue
+
+    def path(self, filename):
+        return os.path.join(self.library_dir, filename)
+
+    def get(self, entry_id):
+        with self._lock:
+            self._load()
+            return self.entries.get(entry_id)
+
+    def lookup(self, name, outfit, kind, threshold=0.8, exclude_story=None):
+        """
+        Best entry of the same kind scoring at least threshold (see similarity), as
+        (entry, score), or (None, 0.0). Entries added by exclude_story are skipped.
+        """
+        with self._lock:
+            self._load()
+            candidates = set()
+            for token in tokens(name):
+                candidates |= self._by_token.get(token, set())
+            entries = [self.entries[i] for i in candidates]
+        best, best_score = None, 0.0
+        for entry in entries:
+            if entry['kind'] != kind or (exclude_story and entry.get('story') == exclude_story):
+                continue
+            if kind == 'npc' and not entry.get('avatar'):
+                continue
+            score = similarity(name, outfit, entry['name'], entry['outfit'])
+            if score >= threshold and (score > best_score or (score == best_score and entry['id'] < best['id'])):
+                best, best_score = entry, score
+        return best, best_score
+
+    def add(self, name, outfit, kind, sprite_path, avatar_path=None, story=None):
+        """
+        Copies a generated sprite (and avatar) into the library. An existing entry for
+        the same name/outfit/kind is only updated by the story that created it.
+        Returns the entry, or None if the sprite does not exist.
+        """
+        if not os.path.exists(sprite_path) or (avatar_path and not os.path.exists(avatar_path)):
+            return None
+        entry_id = self.make_id(name, outfit, kind)
+        sprite_hash = hash_file(sprite_path)
+        with self._lock:
+            self._load()
+            existing = self.entries.get(entry_id)
+            if existing and (existing.get('story') != story or existing.get('sprite_hash') == sprite_hash):
+                return existing
+            os.makedirs(self.library_dir, exist_ok=True)
+            entry = {
+                'id': entry_id,
+                'name': name,
+                'outfit': outfit,
+                'kind': kind,
+                'story': story,
+                'sprite': f'{entry_id}_sprite.png',
+                'avatar': f'{entry_id}_avatar.png' if avatar_path else None,
+                'sprite_hash': sprite_hash,
+                'created': time.time(),
+            }
+            self._copy(sprite_path, self.path(entry['sprite']))
+            if avatar_path:
+                self._copy(avatar_path, self.path(entry['avatar']))
+            meta_path = self.path(f'{entry_id}.json')
+            with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False, indent=2)
+            os.replace(meta_path + '.tmp', meta_path)
+            self._index(entry)
+            return entry
+
+    def _copy(self, src, dst):
+        tmp_path = f"{dst}.{threading.get_ident()}.tmp"
+        shutil.copy(src, tmp_path)
+        os.replace(tmp_path, dst)
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self.entries)
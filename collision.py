@@ -0,0 +1,171 @@
+import json
+import base64
+
+WORLD_SIZE = (2560, 1440)
+# 80 x 45 tiles for the 2560x1440 world: 450 bytes per scene once bit-packed
+TILE_SIZE = 32
+# Cells of the rectangle index; a padded point touches at most 4 of them
+CELL_SIZE = 256
+# game.js keeps a lane this wide free along the left/right edges for the level arrows
+TELEPORT_CLEARANCE = 140
+
+def _entries(raw):
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError:
+            return []
+    if isinstance(raw, dict):
+        return [raw]
+    return raw if isinstance(raw, list) else []
+
+def parse_rectangles(raw):
+    """
+    Obstacles from a describe_image answer: a list (or JSON string of a list) of
+    {"x", "y", "w", "h"} objects or [x, y, w, h] lists. Entries that are not four
+    finite numbers are dropped. Returns a list of (x, y, w, h) int tuples.
+    """
+    rects = []
+    for item in _entries(raw):
+        if isinstance(item, dict):
+            values = [item.get('x'), item.get('y'), item.get('w', item.get('width')), item.get('h', item.get('height'))]
+        elif isinstance(item, (list, tuple)) and len(item) == 4:
+            values = list(item)
+        else:
+            continue
+        try:
+            x, y, w, h = (float(v) for v in values)
+        except (TypeError, ValueError):
+            continue
+        if any(v != v or v in (float('inf'), float('-inf')) for v in (x, y, w, h)):
+            continue
+        rects.append((round(x), round(y), round(w), round(h)))
+    return rects
+
+def clamp_rect(rect, world=WORLD_SIZE):
+    """
+    Normalizes negative sizes and clips to the world. Returns None if nothing is left.
+    """
+    x, y, w, h = rect
+    if w < 0:
+        x, w = x + w, -w
+    if h < 0:
+        y, h = y + h, -h
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(world[0], x + w), min(world[1], y + h)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return (x0, y0, x1 - x0, y1 - y0)
+
+def _union_if_exact(a, b):
+    """
+    Bounding box of a and b if it covers exactly their union (one contains the other,
+    or they share a full edge span and touch or overlap), else None.
+    """
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ux0, uy0 = min(ax, bx), min(ay, by)
+    ux1, uy1 = max(ax + aw, bx + bw), max(ay + ah, by + bh)
+    union = (ux0, uy0, ux1 - ux0, uy1 - uy0)
+    if union == a or union == b:
+        return union
+    if ay == by and ah == bh and ax <= bx + bw and bx <= ax + aw:
+        return union
+    if ax == bx and aw == bw and ay <= by + bh and by <= ay + ah:
+        return union
+    return None
+
+def merge_overlaps(rects):
+    """
+    Merges rectangles whose union is itself a rectangle (duplicates, contained boxes,
+    overlapping strips) until none are left. Other overlaps are kept as they are:
+    merging them into a bounding box would block walkable ground.
+    """
+    rects = list(dict.fromkeys(rects))
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                union = _union_if_exact(rects[i], rects[j])
+                if union is not None:
+                    rects[i] = union
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
+
+def tile_grid(rects, world=WORLD_SIZE, tile_size=TILE_SIZE):
+    """
+    Row-major bitmap with one bit per tile (most significant bit first), set where
+    any rectangle overlaps the tile. Returns (cols, rows, bytes).
+    """
+    cols = -(-world[0] // tile_size)
+    rows = -(-world[1] // tile_size)
+    bits = bytearray((cols * rows + 7) // 8)
+    for x, y, w, h in rects:
+        for row in range(y // tile_size, (y + h - 1) // tile_size + 1):
+            for col in range(x // tile_size, (x + w - 1) // tile_size + 1):
+                i = row * cols + col
+                bits[i >> 3] |= 0x80 >> (i & 7)
+    return cols, rows, bytes(bits)
+
+def cell_index(rects, world=WORLD_SIZE, cell_size=CELL_SIZE):
+    """
+    Uniform grid over the world: for each cell (row-major) the indices of the
+    rectangles overlapping it.
+    """
+    cols = -(-world[0] // cell_size)
+    rows = -(-world[1] // cell_size)
+    cells = [[] for _ in range(cols * rows)]
+    for n, (x, y, w, h) in enumerate(rects):
+        for row in range(y // cell_size, (y + h - 1) // cell_size + 1):
+            for col in range(x // cell_size, (x + w - 1) // cell_size + 1):
+                cells[row * cols + col].append(n)
+    return {'cell_size': cell_size, 'cols': cols, 'rows': rows, 'cells': cells}
+
+def build_collision(raw, world=WORLD_SIZE, tile_size=TILE_SIZE, cell_size=CELL_SIZE,
+                    clearance=TELEPORT_CLEARANCE):
+    """
+    Build-time cleanup of one scene's building_coordinates plus the precomputed
+    collision data game.js uses for O(1) lookups.
+    Returns (buildings, collision, stats): buildings is the cleaned list of
+    {"x", "y", "w", "h"}; collision holds the base64 tile bitmap and the cell index
+    into buildings; stats counts what was dropped, clamped and merged.
+    """
+    parsed = parse_rectangles(raw)
+    count = len(_entries(raw))
+    stats = {'input': count, 'invalid': count - len(parsed), 'clamped': 0, 'teleport_lane': 0, 'merged': 0}
+
+    rects = []
+    for rect in parsed:
+        clamped = clamp_rect(rect, world)
+        if clamped is None:
+            stats['invalid'] += 1
+            continue
+        if clamped != rect:
+            stats['clamped'] += 1
+        x, y, w, h = clamped
+        # Same rule as blocksTeleport() in game.js: such obstacles are never built
+        if x < clearance or x + w > world[0] - clearance:
+            stats['teleport_lane'] += 1
+            continue
+        rects.append(clamped)
+
+    merged = merge_overlaps(rects)
+    stats['merged'] = len(rects) - len(merged)
+    merged.sort(key=lambda r: (r[1], r[0]))
+
+    cols, rows, bits = tile_grid(merged, world, tile_size)
+    collision = {
+        'world': {'w': world[0], 'h': world[1]},
+        'tile_size': tile_size,
+        'cols': cols,
+        'rows': rows,
+        'grid': base64.b64encode(bits).decode('ascii'),
+        'index': cell_index(merged, world, cell_size),
+    }
+    buildings = [{'x': x, 'y': y, 'w': w, 'h': h} for x, y, w, h in merged]
+    return buildings, collision, stats
@@ -0,0 +1,178 @@
+import io
+import os
+import json
+import time
+import zlib
+from PIL import Image
+from instrument import span
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_GAMES = ('game', 'harry_potter', 'test01')
+
+def _kind(filename):
+    name = os.path.splitext(os.path.basename(filename))[0]
+    if name.startswith('background'):
+        return 'background'
+    if name.endswith('_avatar'):
+        return 'avatar'
+    if name in ('temp_up', 'temp_down', 'temp_right'):
+        return 'strip'
+    if name == 'temp_stand':
+        return 'stand'
+    return 'sprite'
+
+def _model_output(path):
+    """
+    PNG bytes of a fixture as the model would return it: opaque, on white.
+    """
+    img = Image.open(path)
+    if img.mode != 'RGBA':
+        with open(path, 'rb') as f:
+            return f.read()
+    flat = Image.new('RGB', img.size, (255, 255, 255))
+    flat.paste(img, mask=img.split()[3])
+    buf = io.BytesIO()
+    flat.save(buf, 'PNG')
+    return buf.getvalue()
+
+class Fixtures:
+    """
+    Images, output.json and game_data.json of the generated games shipped with the
+    repo, used to answer fake API calls. Sprites are flattened onto white and
+    re-encoded once up front so the pipeline sees what the model returns (opaque
+    images with a white background) and still has to remove it.
+    """
+    def __init__(self, base_dir=BASE_DIR, games=FIXTURE_GAMES):
+        self.images = {}  # (game, filename) -> png bytes
+        self.by_kind = {}  # kind -> [(game, filename)]
+        self.outputs = {}  # game -> output.json text
+        self.scenes = {}  # game -> game_data.json scenes
+        self.bgm_path = os.path.join(base_dir, 'default_BGM.mp3')
+        for game in games:
+            game_dir = os.path.join(base_dir, game)
+            output_path = os.path.join(game_dir, 'output.json')
+            if os.path.exists(output_path):
+                with open(output_path, 'r', encoding='utf-8') as f:
+                    self.outputs[game] = f.read()
+            data_path = os.path.join(game_dir, 'game_data.json')
+            if os.path.exists(data_path):
+                with open(data_path, 'r', encoding='utf-8') as f:
+                    self.scenes[game] = json.load(f)
+            assets_dir = os.path.join(game_dir, 'assets')
+            if not os.path.isdir(assets_dir):
+                continue
+            if os.path.exists(os.path.join(assets_dir, 'bgm.mp3')):
+                self.bgm_path = os.path.join(assets_dir, 'bgm.mp3')
+            for filename in sorted(os.listdir(assets_dir)):
+                if filename.endswith('.png'):
+                    self.by_kind.setdefault(_kind(filename), []).append((game, filename))
+                    self.images[(game, filename)] = _model_output(os.path.join(assets_dir, filename))
+
+    def image_bytes(self, game, filename):
+        """
+        Fixture for an output file: the same file of the same game if there is one,
+        otherwise a deterministic pick among fixtures of the same kind.
+        """
+        key = (game, filename)
+        if key not in self.images:
+            pool = self.by_kind.get(_kind(filename)) or sorted(self.images)
+            key = pool[zlib.crc32(filename.encode('utf-8')) % len(pool)]
+        return self.images[key]
+
+    def output_json(self, game):
+        return self.outputs.get(game) or next(iter(self.outputs.values()))
+
+    def building_coordinates(self, game, scene_index):
+        scenes = self.scenes.get(game) or []
+        if scene_index < len(scenes):
+            return scenes[scene_index].get('building_coordinates', [])
+        return []
+
+class FakeGeminiClient:
+    """
+    Offline stand-in for llm.GeminiClient with the same methods and arguments.
+    Sleeps for a fixed latency per call, then replays fixtures for the configured
+    game, recording the same trace spans as the real client.
+    """
+    def __init__(self, config_path='config.json', cache=None, use_cache=True, fixtures=None, game='game',
+                 text_latency=0.2, image_latency=0.5):
+        self.fixtures = fixtures or Fixtures()
+        self.game = game
+        self.text_latency = text_latency
+        self.image_latency = image_latency
+        self.cache = None
+        self.calls = 0
+
+    def generate_json(self, story, prompt):
+        with span('generate_json', 'gemini', model='fake', request_bytes=len((prompt + story).encode('utf-8'))) as trace:
+            time.sleep(self.text_latency)
+            self.calls += 1
+            text = self.fixtures.output_json(self.game)
+            trace['response_bytes'] = len(text.encode('utf-8'))
+            return json.loads(text)
+
+    def generate_content(self, prompt, images_path=None, output_path=None, aspect_ratio=None, image_size=None):
+        data = self.generate_image(prompt, images_path, aspect_ratio, image_size, name=output_path)
+        if output_path:
+            with open(output_path, 'wb') as f:
+                f.write(data)
+        return ""
+
+    def generate_image(self, prompt, images_path=None, aspect_ratio=None, image_size=None, name=None):
+        with span('generate_content', 'gemini', model='fake', file=os.path.basename(name or '')) as trace:
+            time.sleep(self.image_latency)
+            self.calls += 1
+            data = self.fixtures.image_bytes(self.game, os.path.basename(name or 'image.png'))
+            trace['response_bytes'] = len(data)
+            return data
+
+    def describe_image(self, image_path, prompt):
+        with span('describe_image', 'gemini', model='fake', file=os.path.basename(image_path)) as trace:
+            time.sleep(self.text_latency)
+            self.calls += 1
+            name = os.path.splitext(os.path.basename(image_path))[0]
+            scene_index = int(name.rsplit('_', 1)[-1]) if name.rsplit('_', 1)[-1].isdigit() else 0
+            text = json.dumps(self.fixtures.building_coordinates(self.game, scene_index))
+            trace['response_bytes'] = len(text)
+            return text
+
+def make_fake_bgm(fixtures, latency=1.0, chunks=8):
+    """
+    Returns a bgm.generate_bgm replacement that streams a fixture track to
+    <output>.part in chunks spread over latency seconds, then moves it into place.
+    """
+    def generate_bgm(prompt, output_path, length_ms=60000):
+        with open(fixtures.bgm_path, 'rb') as f:
+            data = f.read()
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        part_path = output_path + '.part'
+        with open(part_path, 'wb') as f:
+            for i in range(chunks):
+                time.sleep(latency / chunks)
+                f.write(data[i * len(data) // chunks:(i + 1) * len(data) // chunks])
+                f.flush()
+        os.replace(part_path, output_path)
+        return True
+    return generate_bgm
+
+def install(main_module, game, text_latency=0.2, image_latency=0.5, bgm_latency=1.0, fixtures=None):
+    """
+    Points main (and llm/bgm) at the fakes for one run. Returns the Fixtures used.
+    """
+    import llm
+    fixtures = fixtures or Fixtures()
+
+    def client_factory(*args, **kwargs):
+        return FakeGeminiClient(*args, fixtures=fixtures, game=game,
+                                text_latency=text_latency, image_latency=image_latency, **kwargs)
+
+    fake_bgm = make_fake_bgm(fixtures, bgm_latency)
+    llm.GeminiClient = client_factory
+    main_module.GeminiClient = client_factory
+    main_module.generate_bgm = fake_bgm
+    try:
+        import bgm
+        bgm.generate_bgm = fake_bgm
+    except Exception:
+        pass
+    return fixtures
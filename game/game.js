@@ -42,6 +42,8 @@ let dialogueSpeaker;
 let keys;
 let profileKey;
 let obstacles;
+let collisionMap = null; // precomputed tile grid + cell index of the current scene
+let assetManifest = null; // asset_manifest.json: logical key -> content-hashed file
 const worldSize = { width: 2560, height: 1440 };
 const defaultBuildings = [];
 let bgSprite;
@@ -63,19 +65,20 @@ let battleNpcBarFg;
 let battlePlayerBarBg;
 let battleNpcBarBg;
 
+// URL of an asset by its logical key (the name game_data.json uses). Games without an
+// asset_manifest.json keep their files under the plain names in assets/; with one,
+// keys it does not list (e.g. a BGM still being composed) are not loaded.
+function assetUrl(key) {
+    if (!assetManifest) return `assets/${key}`;
+    const entry = assetManifest.assets[key];
+    return entry ? entry.file : null;
+}
+
 function preload() {
     this.load.json('gameData', 'game_data.json');
-    // Load individual directional strips instead of combined sheet
-    this.load.image('player_down_img', 'assets/temp_down.png');
-    this.load.image('player_up_img', 'assets/temp_up.png');
-    this.load.image('player_right_img', 'assets/temp_right.png');
-    this.load.image('player_avatar', 'assets/player_avatar.png');
-    // Audio
-    this.load.audio('walk_sfx', 'assets/walk.mp3');
-    this.load.audio('hit_sfx', 'assets/hit.wav');
-    this.load.audio('level_sfx', 'assets/level.mp3');
-    this.load.audio('bgm', 'assets/bgm.mp3');
-    this.load.audio('bgm_default', 'assets/default_BGM.mp3');
+    this.load.json('assetManifest', 'asset_manifest.json');
+    // Images and audio are queued in create() once the manifest is known; player
+    // strips and avatar may come from the texture atlas
 }
 
 function create() {
@@ -112,19 +115,43 @@ function create() {
             }];
         }
         gameData = Array.isArray(loadedData) ? loadedData : [loadedData];
+        assetManifest = this.cache.json.get('assetManifest') || null;
         logStep(`Step 2: Data Loaded (${gameData.length} scenes)`);
 
         // 4. Queue Dynamic Assets
-        let assetsToLoad = false;
+        // Optional texture atlas (optimize_assets.py); images not packed in it load individually
+        const atlasInfo = gameData[0]?.atlas;
+        const inAtlas = new Set(atlasInfo ? atlasInfo.frames : []);
+        const loadImage = (key, file) => {
+            const url = assetUrl(file);
+            if (!inAtlas.has(file) && url) this.load.image(key, url);
+        };
+        const loadAudio = (key, file) => {
+            const url = assetUrl(file);
+            if (url) this.load.audio(key, url);
+        };
+        if (atlasInfo) this.load.atlas('game_atlas', assetUrl(atlasInfo.image), assetUrl(atlasInfo.data));
+        // Audio
+        loadAudio('walk_sfx', 'walk.mp3');
+        loadAudio('hit_sfx', 'hit.wav');
+        loadAudio('level_sfx', 'level.mp3');
+        loadAudio('bgm', 'bgm.mp3');
+        loadAudio('bgm_default', 'default_BGM.mp3');
+        // Load individual directional strips instead of combined sheet
+        loadImage('player_down_img', 'temp_down.png');
+        loadImage('player_up_img', 'temp_up.png');
+        loadImage('player_right_img', 'temp_right.png');
+        loadImage('player_avatar', 'player_avatar.png');
+        let assetsToLoad = true;
         gameData.forEach((scene, sIdx) => {
             if (scene.background_image) {
-                this.load.image(`bg_${sIdx}`, `assets/${scene.background_image}`);
+                loadImage(`bg_${sIdx}`, scene.background_image);
                 assetsToLoad = true;
             }
             if (scene.npc) {
                 scene.npc.forEach((npc, nIdx) => {
-                    if (npc.sprite) this.load.image(`npc_${sIdx}_${nIdx}`, `assets/${npc.sprite}`);
-                    if (npc.avatar) this.load.image(`npc_${sIdx}_${nIdx}_avatar`, `assets/${npc.avatar}`);
+                    if (npc.sprite) loadImage(`npc_${sIdx}_${nIdx}`, npc.sprite);
+                    if (npc.avatar) loadImage(`npc_${sIdx}_${nIdx}_avatar`, npc.avatar);
                     assetsToLoad = true;
                 });
             }
@@ -134,7 +161,7 @@ function create() {
                     if (m.sprite) {
                         const key = m.sprite.replace('.png','');
                         if (!this.textures.exists(key)) {
-                            this.load.image(key, `assets/${m.sprite}`);
+                            loadImage(key, m.sprite);
                             assetsToLoad = true;
                         }
                     }
@@ -142,6 +169,35 @@ function create() {
             }
         });
 
+        // Give each atlas frame the texture key the rest of the game expects
+        const registerAtlasTextures = () => {
+            if (!atlasInfo || !this.textures.exists('game_atlas')) return;
+            const atlas = this.textures.get('game_atlas');
+            const fromAtlas = (key, file, columns = 1) => {
+                if (!file || this.textures.exists(key) || !atlas.has(file)) return;
+                const frame = atlas.get(file);
+                this.textures.addSpriteSheetFromAtlas(key, {
+                    atlas: 'game_atlas',
+                    frame: file,
+                    frameWidth: Math.floor(frame.realWidth / columns),
+                    frameHeight: frame.realHeight
+                });
+            };
+            fromAtlas('player_down_sheet', 'temp_down.png', 3);
+            fromAtlas('player_up_sheet', 'temp_up.png', 3);
+            fromAtlas('player_right_sheet', 'temp_right.png', 3);
+            fromAtlas('player_avatar', 'player_avatar.png');
+            gameData.forEach((scene, sIdx) => {
+                (scene.npc || []).forEach((npc, nIdx) => {
+                    fromAtlas(`npc_${sIdx}_${nIdx}`, npc.sprite);
+                    fromAtlas(`npc_${sIdx}_${nIdx}_avatar`, npc.avatar);
+                });
+                (scene.minions || []).forEach(m => {
+                    if (m.sprite) fromAtlas(m.sprite.replace('.png',''), m.sprite);
+                });
+            });
+        };
+
         // 5. Start Game Function
         const startGame = () => {
             try {
@@ -167,6 +223,7 @@ function create() {
             logStep("Step 3: Loading Assets...");
             this.load.once('complete', () => {
                 logStep("Step 3b: Load Complete");
+                registerAtlasTextures();
                 startGame();
             });
             this.load.start();
@@ -512,6 +569,10 @@ function initScene(index) {
     const buildings = sanitizeBuildings(rawBuildings);
     const teleportClearance = 140;
     const obstacleBuildings = buildings.filter(b => !blocksTeleport(b, teleportClearance));
+    // Built by collision.py; its cell index points into building_coordinates, so it
+    // is only used while every rectangle survived the checks above
+    collisionMap = (Array.isArray(rawBuildings) && obstacleBuildings.length === rawBuildings.length)
+        ? loadCollisionMap(sceneData.collision, obstacleBuildings) : null;
     const palette = [0x6f4a2f, 0x7a5534, 0x6a3f26, 0x7b4f30];
     obstacleBuildings.forEach((b, i) => {
         const building = this.add.rectangle(b.x, b.y, b.w, b.h, palette[i % palette.length]).setOrigin(0, 0);
@@ -684,7 +745,47 @@ function blocksTeleport(b, clearance) {
     return b.x < clearance || (b.x + b.w) > (worldSize.width - clearance);
 }
 
+function loadCollisionMap(collision, buildings) {
+    if (!collision || !collision.grid || !collision.index) return null;
+    const raw = atob(collision.grid);
+    const bits = new Uint8Array(raw.length);
+    for (let i = 0; i < raw.length; i++) bits[i] = raw.charCodeAt(i);
+    return { tileSize: collision.tile_size, cols: collision.cols, rows: collision.rows, bits, index: collision.index, buildings };
+}
+
+function isTileBlocked(map, col, row) {
+    if (col < 0 || row < 0 || col >= map.cols || row >= map.rows) return false;
+    const i = row * map.cols + col;
+    return (map.bits[i >> 3] & (0x80 >> (i & 7))) !== 0;
+}
+
+function hitsCollisionMap(map, x, y, padding) {
+    // Free tiles answer most queries without touching a rectangle (+1: edges are inclusive)
+    const ts = map.tileSize;
+    let blocked = false;
+    for (let row = Math.floor((y - padding - 1) / ts); row <= Math.floor((y + padding + 1) / ts) && !blocked; row++) {
+        for (let col = Math.floor((x - padding - 1) / ts); col <= Math.floor((x + padding + 1) / ts); col++) {
+            if (isTileBlocked(map, col, row)) { blocked = true; break; }
+        }
+    }
+    if (!blocked) return false;
+    // Exact test against the few rectangles indexed in the surrounding cells
+    const { cell_size: cs, cols, rows, cells } = map.index;
+    const c0 = Math.max(0, Math.floor((x - padding - 1) / cs)), c1 = Math.min(cols - 1, Math.floor((x + padding + 1) / cs));
+    const r0 = Math.max(0, Math.floor((y - padding - 1) / cs)), r1 = Math.min(rows - 1, Math.floor((y + padding + 1) / cs));
+    for (let row = r0; row <= r1; row++) {
+        for (let col = c0; col <= c1; col++) {
+            for (const n of cells[row * cols + col]) {
+                const b = map.buildings[n];
+                if (x >= b.x - padding && x <= b.x + b.w + padding && y >= b.y - padding && y <= b.y + b.h + padding) return true;
+            }
+        }
+    }
+    return false;
+}
+
 function isInsideBuilding(x, y, buildings, padding = 0) {
+    if (collisionMap && buildings === collisionMap.buildings) return hitsCollisionMap(collisionMap, x, y, padding);
     for (let b of buildings) {
         if (x >= b.x - padding && x <= b.x + b.w + padding && y >= b.y - padding && y <= b.y + b.h + padding) {
             return true;
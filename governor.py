@@ -0,0 +1,258 @@
+import sys
+import time
+import random
+import inspect
+import threading
+
+# Requests per minute per model; override with "rate_limits" in config.json.
+# On a 429 the bucket halves its rate and then climbs back to this ceiling.
+DEFAULT_RATE_LIMITS = {
+    'gemini-3-pro-preview': 60,
+    'gemini-3-pro-image-preview': 20,
+}
+RETRYABLE_CODES = (408, 429, 500, 502, 503, 504)
+
+class DeadlineExceeded(Exception):
+    pass
+
+class CircuitOpenError(Exception):
+    pass
+
+def error_code(error):
+    code = getattr(error, 'code', None)
+    return code if isinstance(code, int) else None
+
+def is_retryable(error):
+    """
+    429s, transient 5xx, timeouts and dropped connections are retried; other
+    errors (bad request, auth, safety blocks...) are not.
+    """
+    if error_code(error) in RETRYABLE_CODES:
+        return True
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # Only look at httpx if the SDK already loaded it; importing it here would
+    # slow down startup for nothing
+    httpx = sys.modules.get('httpx')
+    return httpx is not None and isinstance(error, httpx.TransportError)
+
+def retry_after(error):
+    """
+    Seconds from the response's Retry-After header, if the server sent one.
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """
+    Thread-safe token bucket with additive-increase/multiplicative-decrease:
+    penalize() halves the rate after a 429, reward() creeps back towards the
+    configured requests per minute after each success.
+    """
+    def __init__(self, rate_per_minute, burst=None):
+        self.max_rate = rate_per_minute / 60.0
+        self.min_rate = self.max_rate / 16
+        self.rate = self.max_rate
+        self.capacity = float(burst or max(1, rate_per_minute // 6))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.penalized = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, deadline=None):
+        """
+        Blocks until a request may be sent. Returns the seconds spent waiting.
+        """
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - start
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                raise DeadlineExceeded("Deadline reached while waiting for rate limit")
+            time.sleep(min(wait, 1.0))
+
+    def penalize(self):
+        with self._lock:
+            now = time.monotonic()
+            # 429s from requests that were already in flight count as one signal
+            if now - self.penalized < 1 / self.rate:
+                return
+            self.penalized = now
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+
+    def reward(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive retryable failures. While open,
+    callers wait for reset_timeout (or fail if their deadline is sooner); then a
+    single probe request is let through and its outcome closes or re-opens it.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self._cond = threading.Condition()
+
+    def before_call(self, deadline=None):
+        """
+        Waits until a call may go through. Returns True if the caller is the
+        half-open probe: it must then end with record_success, record_failure or
+        release_probe.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.failures < self.failure_threshold:
+                    return False
+                if now >= self.open_until and not self.probing:
+                    self.probing = True
+                    return True
+                wake = self.open_until if now < self.open_until else now + 1.0
+                if deadline is not None and wake > deadline:
+                    raise CircuitOpenError(f"Circuit open after {self.failures} consecutive failures")
+                self._cond.wait(timeout=wake - now)
+
+    def release_probe(self):
+        """
+        Gives the probe back without an outcome (its caller gave up before or
+        during the request), so another caller can probe.
+        """
+        with self._cond:
+            self.probing = False
+            self._cond.notify_all()
+
+    def record_success(self):
+        with self._cond:
+            self.failures = 0
+            self.probing = False
+            self._cond.notify_all()
+
+    def record_failure(self):
+        with self._cond:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.probing or self.failures == self.failure_threshold:
+                    print(f"Circuit breaker open for {self.reset_timeout:.0f}s after {self.failures} consecutive failures")
+                self.open_until = time.monotonic() + self.reset_timeout
+            self.probing = False
+            self._cond.notify_all()
+
+class RequestGovernor:
+    """
+    Shared throttle/retry policy for model requests: a token bucket per model,
+    exponential backoff with full jitter on retryable errors, a total deadline per
+    call (each attempt gets the time that is left, capped at attempt_timeout), and
+    a circuit breaker per model.
+    """
+    def __init__(self, rate_limits=None, max_retries=6, base_delay=2.0, max_delay=60.0,
+                 deadline=600.0, attempt_timeout=180.0, failure_threshold=5, reset_timeout=30.0):
+        self.rate_limits = dict(DEFAULT_RATE_LIMITS if rate_limits is None else rate_limits)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._buckets = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Builds a governor from the "governor" section of config.json, e.g.
+        {"rate_limits": {"gemini-3-pro-image-preview": 10}, "max_retries": 4, "deadline": 300}
+        """
+        section = dict(config.get('governor') or {})
+        known = set(inspect.signature(cls.__init__).parameters) - {'self'}
+        for key in sorted(set(section) - known):
+            print(f"Warning: ignoring unknown governor setting '{key}' in config.json "
+                  f"(known: {', '.join(sorted(known))})")
+            del section[key]
+        return cls(**section)
+
+    def _bucket(self, model):
+        with self._lock:
+            if model not in self._buckets:
+                rpm = self.rate_limits.get(model)
+                self._buckets[model] = TokenBucket(rpm) if rpm else None
+            return self._buckets[model]
+
+    def _breaker(self, model):
+        with self._lock:
+            if model not in self._breakers:
+                self._breakers[model] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[model]
+
+    def call(self, model, func):
+        """
+        Runs func(timeout_seconds) under the policy for model.
+        Returns (result, stats) where stats has 'retries' and 'throttled_seconds'.
+        """
+        bucket = self._bucket(model)
+        breaker = self._breaker(model)
+        deadline = time.monotonic() + self.deadline if self.deadline else None
+        stats = {'retries': 0, 'throttled_seconds': 0.0}
+        attempt = 0
+        while True:
+            probe = breaker.before_call(deadline)
+            try:
+                if bucket is not None:
+                    stats['throttled_seconds'] += bucket.acquire(deadline)
+                timeout = self.attempt_timeout
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.monotonic())
+                    if timeout <= 0:
+                        raise DeadlineExceeded(f"{model} call exceeded its {self.deadline:.0f}s deadline")
+            except BaseException:
+                if probe:
+                    breaker.release_probe()
+                raise
+            try:
+                result = func(timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    breaker.record_success()  # the service answered; not an outage
+                    raise
+                breaker.record_failure()
+                if error_code(e) == 429 and bucket is not None:
+                    bucket.penalize()
+                if attempt >= self.max_retries:
+                    raise
+                delay = retry_after(e) or random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    raise
+                attempt += 1
+                stats['retries'] = attempt
+                print(f"{model} request failed ({e.__class__.__name__}: {str(e)[:120]}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # KeyboardInterrupt, SystemExit...: no outcome to record
+                if probe:
+                    breaker.release_probe()
+                raise
+            breaker.record_success()
+            if bucket is not None:
+                bucket.reward()
+            stats['throttled_seconds'] = round(stats['throttled_seconds'], 3)
+            return result, stats
@@ -7,6 +7,8 @@ document.addEventListener('DOMContentLoaded', () => {
     const loadingOverlay = document.getElementById('loading-overlay');
     const logOutput = document.getElementById('log-output');
     const closeOverlayBtn = document.getElementById('close-overlay-btn');
+    const progressBar = document.getElementById('progress-bar');
+    const progressText = document.getElementById('progress-text');
 
     // Load games list
     fetchGames();
@@ -53,39 +55,26 @@ document.addEventListener('DOMContentLoaded', () => {
         // UI Update
         loadingOverlay.style.display = 'flex';
         logOutput.textContent = "Sending request to server...\n";
+        progressBar.value = 0;
+        progressText.textContent = "This may take a minute. Please wait.";
         generateBtn.disabled = true;
         closeOverlayBtn.style.display = 'none';
 
         try {
-            const response = await fetch('/api/generate', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ story, name })
-            });
-
-            const reader = response.body.getReader();
-            const decoder = new TextDecoder();
-            let finalResult = null;
-
-            while (true) {
-                const { done, value } = await reader.read();
-                if (done) break;
-                
-                const chunk = decoder.decode(value, { stream: true });
-                const lines = chunk.split('\n');
-                
-                for (const line of lines) {
-                    if (line.includes('__JSON_RESULT__')) {
-                        try {
-                            const jsonStr = line.split('__JSON_RESULT__')[1];
-                            finalResult = JSON.parse(jsonStr);
-                        } catch (e) { console.error("Error parsing result", e); }
-                    } else {
-                        logOutput.textContent += line + "\n";
-                        logOutput.scrollTop = logOutput.scrollHeight;
-                    }
-                }
+            // Sent as a file part so the server can stream it to disk
+            const form = new FormData();
+            form.append('name', name);
+            form.append('story', new Blob([story], { type: 'text/plain;charset=utf-8' }), 'story.txt');
+            const submit = await fetch('/api/generate', { method: 'POST', body: form });
+            const job = await submit.json();
+            if (!submit.ok) {
+                throw new Error(job.error || submit.statusText);
             }
+            logOutput.textContent += "Job " + job.job_id + " queued.\n";
+
+            // Generation runs in the server's job queue; this only follows its events.
+            // EventSource reconnects by itself and resumes after the last event it saw.
+            const finalResult = await followJob(job.events_url);
 
             if (finalResult && finalResult.success) {
                 logOutput.textContent += "Generation Successful!\n";
@@ -112,6 +101,41 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    function formatSeconds(seconds) {
+        const s = Math.round(seconds);
+        return s >= 60 ? Math.floor(s / 60) + "m " + (s % 60) + "s" : s + "s";
+    }
+
+    function showProgress(p) {
+        progressBar.value = p.percent || 0;
+        let text = p.stage.replace(/_/g, ' ') + " - " + Math.floor(p.percent || 0) + "%";
+        if (p.total) text += " (" + p.done + "/" + p.total + " assets)";
+        if (p.eta) text += " - about " + formatSeconds(p.eta) + " left";
+        if (p.bytes) text += " - " + (p.bytes / (1024 * 1024)).toFixed(1) + " MB";
+        progressText.textContent = text;
+    }
+
+    // Resolves with the job's result event, or null if the stream fails
+    function followJob(eventsUrl) {
+        return new Promise((resolve) => {
+            const source = new EventSource(eventsUrl);
+            source.addEventListener('log', (e) => {
+                logOutput.textContent += JSON.parse(e.data).text;
+                logOutput.scrollTop = logOutput.scrollHeight;
+            });
+            source.addEventListener('progress', (e) => showProgress(JSON.parse(e.data)));
+            source.addEventListener('result', (e) => {
+                source.close();
+                resolve(JSON.parse(e.data));
+            });
+            // A failed request (e.g. 404 for a job lost in a restart) closes the
+            // source for good; plain disconnects reconnect on their own
+            source.onerror = () => {
+                if (source.readyState === EventSource.CLOSED) resolve(null);
+            };
+        });
+    }
+
     async function fetchGames() {
         try {
             const res = await fetch('/api/games');
@@ -1,14 +1,302 @@
-from PIL import Image, ImageFilter
 from collections import deque
+import io
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from instrument import traced, annotate, span, tracer
+# numpy/scipy are imported by has_array_modules() the first time a mask is built,
+# and Pillow inside the functions that use it, so importing this module (main.py,
+# server jobs) stays fast
+np = None
+ndimage = None
+_array_modules_loaded = False
+
+def has_array_modules():
+    """
+    Imports numpy and scipy.ndimage on first call. Returns False if they are not installed.
+    """
+    global np, ndimage, _array_modules_loaded
+    if not _array_modules_loaded:
+        try:
+            import numpy as np
+            from scipy import ndimage
+        except Exception:
+            np = None
+            ndimage = None
+        _array_modules_loaded = True
+    return np is not None and ndimage is not None
+
+class ImagePipeline:
+    """
+    Chain of edits on one decoded image. Every step works on the image in memory and
+    save() encodes once at the end, so an asset is decoded and encoded a single time
+    however many steps it goes through:
+
+        ImagePipeline.from_bytes(data, 'npc_A.png').remove_background().crop_to_content().save(path)
+    """
+    def __init__(self, img, name=''):
+        self.img = img if img.mode == "RGBA" else img.convert("RGBA")
+        self.name = name
+
+    @classmethod
+    def open(cls, path):
+        from PIL import Image
+        return cls(Image.open(path), os.path.basename(path))
+
+    @classmethod
+    def from_bytes(cls, data, name=''):
+        from PIL import Image
+        if data is None:
+            raise ValueError(f"No image data for {name or 'image'}")
+        return cls(Image.open(io.BytesIO(data)), name)
+
+    def remove_background(self, white_threshold=235, low_contrast=10):
+        with span('remove_background', 'image', file=self.name):
+            self.img.putalpha(background_mask(self.img, white_threshold, low_contrast))
+        print(f"Background removed from {self.name}")
+        return self
+
+    def crop_to_content(self):
+        with span('crop_to_content', 'image', file=self.name):
+            bbox = self.img.getbbox()
+            if bbox:
+                self.img = self.img.crop(bbox)
+                print(f"Cropped {self.name} to content")
+            else:
+                print(f"No content found in {self.name}")
+        return self
+
+    def layout_strip(self, frames=3, frame_size=128):
+        """
+        Slices a directional strip into frames and centers each in a frame_size cell.
+        Leaves the image unchanged if it has no content.
+        """
+        with span('layout_strip', 'image', file=self.name):
+            strip = strip_frames(self.img, frames, frame_size)
+            if strip is None:
+                print(f"No content found in {self.name}")
+            else:
+                self.img = strip
+        return self
+
+    def resize(self, size, resample=None):
+        from PIL import Image
+        if self.img.size != tuple(size):
+            with span('resize', 'image', file=self.name):
+                self.img = self.img.resize(size, Image.NEAREST if resample is None else resample)
+        return self
+
+    def apply(self, steps):
+        """
+        Runs a list of steps given by method name, e.g.
+        ['remove_background', 'crop_to_content'] or [('resize', (2560, 1440))].
+        """
+        for step in steps:
+            name, *args = (step,) if isinstance(step, str) else step
+            getattr(self, name)(*args)
+        return self
+
+    def save(self, path):
+        with span('encode', 'image', file=os.path.basename(path)):
+            self.img.save(path)
+            annotate(bytes=os.path.getsize(path))
+        return path
+
+def process_image(data, output_path, steps, name='', trace_t0=None):
+    """
+    Decodes encoded image bytes, applies ImagePipeline steps and saves the result.
+    This is the unit of work ImagePool sends to worker processes; it returns the
+    spans recorded meanwhile so the parent can merge them into its trace.
+    """
+    if trace_t0 is not None:
+        tracer.t0 = trace_t0
+        tracer.drain()
+    ImagePipeline.from_bytes(data, name).apply(steps).save(output_path)
+    return tracer.drain() if trace_t0 is not None else []
+
+class ImagePool:
+    """
+    Process pool for the CPU-bound post-processing of generated images (decode,
+    background removal, cropping, strip layout, resize, PNG encode), so it scales
+    with cores instead of contending for the GIL in the scheduler's threads.
+    process() blocks the calling thread until its image is written.
+    max_workers=0 runs everything in the calling thread instead.
+    """
+    def __init__(self, max_workers=None):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self.max_workers = max(0, int(max_workers))
+        self._executor = None
+        if self.max_workers:
+            # spawn: the pool is used from worker threads, and forking a threaded
+            # process can copy locks held by other threads
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def process(self, data, output_path, steps, name=None):
+        name = name or os.path.basename(output_path)
+        if self._executor is None:
+            process_image(data, output_path, steps, name)
+            return output_path
+        with span('process_image', 'pool', file=name):
+            events = self._executor.submit(process_image, data, output_path, steps, name, tracer.t0).result()
+        tracer.merge(events)
+        return output_path
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def background_mask(img, white_threshold=235, low_contrast=10):
+    """
+    Final alpha channel of remove_background for an RGBA image: near-white regions
+    connected to the border and their halo cleared, then median-filtered.
+    Uses the array-backed mask when numpy/scipy are installed.
+    """
+    from PIL import ImageFilter
+    if not has_array_modules():
+        alpha = reference_alpha(img, white_threshold, low_contrast)
+    else:
+        alpha = background_alpha(img, white_threshold, low_contrast)
+    # Median filter removes isolated opaque dots around edges
+    return alpha.filter(ImageFilter.MedianFilter(size=3))
+
+def strip_frames(img, frames=3, frame_size=128):
+    """
+    Divides the content of a strip into equal columns and centers each frame in a
+    frame_size x frame_size cell (90% height). Returns None if the image is empty.
+    """
+    from PIL import Image
+    # Crop to content of the whole strip first
+    bbox_all = img.getbbox()
+    if not bbox_all:
+        return None
+    src_cropped = img.crop(bbox_all)
+    cw, ch = src_cropped.size
+    
+    # Divide the cropped content into frames horizontally
+    f_w = cw / frames
+    
+    # Create a new strip for this direction
+    strip = Image.new("RGBA", (frame_size * frames, frame_size), (0, 0, 0, 0))
+    
+    for col in range(frames):
+        frame = src_cropped.crop((int(col * f_w), 0, int((col + 1) * f_w), ch))
+        # Center this frame in its cell
+        f_bbox = frame.getbbox()
+        if f_bbox:
+            char = frame.crop(f_bbox)
+            th = int(frame_size * 0.9)
+            ratio = th / char.height
+            tw = int(char.width * ratio)
+            char = char.resize((tw, th), Image.NEAREST)
+            strip.paste(char, (col * frame_size + (frame_size - tw) // 2, (frame_size - th) // 2), char)
+    return strip
 
 def remove_background(image_path, output_path=None, white_threshold=235, low_contrast=10):
     """
     Removes white/near-white background from an image and reduces white speckle noise.
+    File wrapper around ImagePipeline.remove_background.
+    """
+    if output_path is None:
+        output_path = image_path
+    ImagePipeline.open(image_path).remove_background(white_threshold, low_contrast).save(output_path)
+
+def paste_column(source_path, strip_path):
+    """
+    Slices a directional strip into 3 frames and centers each in a 128x128 cell.
+    """
+    if not os.path.exists(source_path):
+        print(f"Warning: Source path {source_path} not found.")
+        return
+    ImagePipeline.open(source_path).layout_strip().save(strip_path)
+    print(f"Processed strip saved to {strip_path}")
+
+def background_alpha(img, white_threshold=235, low_contrast=10):
+    """
+    Computes the pre-median alpha mask of remove_background_reference for an RGBA image.
+    Needs numpy and scipy.
+    """
+    from PIL import Image
+    if not has_array_modules():
+        raise ImportError("background_alpha needs numpy and scipy")
+    arr = np.asarray(img, dtype=np.int16)
+    r, g, b, a = arr[..., 0], arr[..., 1], arr[..., 2], arr[..., 3]
+    h, w = a.shape
+
+    # Vectorized is_near_white
+    mx = np.maximum(np.maximum(r, g), b)
+    mn = np.minimum(np.minimum(r, g), b)
+    near_white = (a != 0) & (
+        ((r >= white_threshold) & (g >= white_threshold) & (b >= white_threshold))
+        | (((r + g + b) >= 3 * white_threshold) & ((mx - mn) <= low_contrast))
+    )
+
+    # Border-connected near-white regions (4-connectivity, same as the flood fill)
+    labels, _ = ndimage.label(near_white)
+    border = np.concatenate((labels[0, :], labels[-1, :], labels[:, 0], labels[:, -1]))
+    border = np.unique(border[border != 0])
+    bg = np.isin(labels, border)
+
+    opaque = (a != 0) & ~bg
+
+    # Halo erosion. The reference clears pixels in raster order, so a cleared
+    # pixel counts as transparent for its E, SW, S and SE neighbours visited later.
+    # Reproduce that row by row: seed from the initial 3x3 transparency and the
+    # cleared pixels of the previous row, then propagate east along runs.
+    transparent_near = ndimage.maximum_filter(~opaque, size=3, mode='constant', cval=False)
+    candidate = opaque & near_white
+    cleared = np.zeros((h, w), dtype=bool)
+    idx = np.arange(w)
+    prev = np.zeros(w, dtype=bool)
+    for y in range(h):
+        row = candidate[y]
+        if not row.any():
+            prev = cleared[y]
+            continue
+        from_above = prev.copy()
+        from_above[1:] |= prev[:-1]
+        from_above[:-1] |= prev[1:]
+        seed = row & (transparent_near[y] | from_above)
+        last_break = np.maximum.accumulate(np.where(row, -1, idx))
+        last_seed = np.maximum.accumulate(np.where(seed, idx, -1))
+        cleared[y] = row & (last_seed > last_break)
+        prev = cleared[y]
+
+    opaque &= ~cleared
+    return Image.fromarray((opaque * 255).astype(np.uint8))
+
+@traced('image')
+def remove_background_reference(image_path, output_path=None, white_threshold=235, low_contrast=10):
+    """
+    Removes white/near-white background from an image and reduces white speckle noise.
+    Pure-Python reference implementation, kept for parity checks.
     """
+    from PIL import Image, ImageFilter
     if output_path is None:
         output_path = image_path
 
     img = Image.open(image_path).convert("RGBA")
+    alpha = reference_alpha(img, white_threshold, low_contrast)
+
+    # Median filter removes isolated opaque dots around edges
+    alpha = alpha.filter(ImageFilter.MedianFilter(size=3))
+
+    img.putalpha(alpha)
+    img.save(output_path)
+    print(f"Background removed from {image_path}")
+
+def reference_alpha(img, white_threshold=235, low_contrast=10):
+    """
+    Pure-Python pre-median alpha mask for an RGBA image (see remove_background_reference).
+    """
+    from PIL import Image
     pixels = img.load()
     w, h = img.size
 
@@ -86,12 +374,7 @@ def remove_background(image_path, output_path=None, white_threshold=235, low_con
             if has_transparent_neighbor:
                 edge_alpha[x, y] = 0
 
-    # Median filter removes isolated opaque dots around edges
-    alpha = alpha.filter(ImageFilter.MedianFilter(size=3))
-
-    img.putalpha(alpha)
-    img.save(output_path)
-    print(f"Background removed from {image_path}")
+    return alpha
 
 def crop_to_content(image_path, output_path=None):
     """
@@ -100,21 +383,20 @@ def crop_to_content(image_path, output_path=None):
     if output_path is None:
         output_path = image_path
         
-    img = Image.open(image_path).convert("RGBA")
-    bbox = img.getbbox()
-    if bbox:
-        img = img.crop(bbox)
-        img.save(output_path)
-        print(f"Cropped {image_path} to content")
+    pipeline = ImagePipeline.open(image_path)
+    if pipeline.img.getbbox():
+        pipeline.crop_to_content().save(output_path)
     else:
         print(f"No content found in {image_path}")
 
+@traced('image')
 def normalize_sprite_sheet(image_path, frames=9, frame_size=128, columns=3, rows=3, output_path=None):
     """
     Normalize a sprite sheet into a standard RPG format.
     - Divides the image into a grid.
     - For each cell, finds the character and centers it in a fixed-size frame.
     """
+    from PIL import Image
     if output_path is None:
         output_path = image_path
 
@@ -165,3 +447,115 @@ def normalize_sprite_sheet(image_path, frames=9, frame_size=128, columns=3, rows
 
     sheet.save(output_path)
     print(f"Robust normalized sprite sheet saved to {output_path}")
+
+# Local obstacle detection for scene backgrounds (see detect_obstacles)
+OBSTACLE_TILE = 32
+OBSTACLE_CLUSTERS = 4
+
+def _components(mask, cols, rows):
+    """
+    4-connected components of the True cells of a row-major mask, as lists of indices.
+    """
+    seen = [False] * len(mask)
+    components = []
+    for start in range(len(mask)):
+        if not mask[start] or seen[start]:
+            continue
+        seen[start] = True
+        component = []
+        q = deque([start])
+        while q:
+            i = q.popleft()
+            component.append(i)
+            r, c = divmod(i, cols)
+            for j in ((i - cols) if r > 0 else -1, (i + cols) if r < rows - 1 else -1,
+                      (i - 1) if c > 0 else -1, (i + 1) if c < cols - 1 else -1):
+                if j >= 0 and mask[j] and not seen[j]:
+                    seen[j] = True
+                    q.append(j)
+        components.append(component)
+    return components
+
+def _largest_rectangle(mask, cols, rows):
+    """
+    Largest all-True axis-aligned rectangle of a row-major mask (histogram method).
+    Returns (area, col, row, width, height) in cells.
+    """
+    best = (0, 0, 0, 0, 0)
+    heights = [0] * cols
+    for r in range(rows):
+        for c in range(cols):
+            heights[c] = heights[c] + 1 if mask[r * cols + c] else 0
+        stack = []
+        for c in range(cols + 1):
+            h = heights[c] if c < cols else 0
+            start = c
+            while stack and stack[-1][1] >= h:
+                start, sh = stack.pop()
+                if sh * (c - start) > best[0]:
+                    best = (sh * (c - start), start, r - sh + 1, c - start, sh)
+            stack.append((start, h))
+    return best
+
+def _pixels(img):
+    """Flat pixel sequence: get_flattened_data() on Pillow 12.1+, getdata() before."""
+    flattened = getattr(img, 'get_flattened_data', None)
+    return flattened() if flattened else img.getdata()
+
+@traced('image')
+def detect_obstacles(image_path, world_size=(2560, 1440), tile=OBSTACLE_TILE, clusters=OBSTACLE_CLUSTERS,
+                     max_obstacles=8, min_tiles=12, keep_clear=0):
+    """
+    Estimates non-walkable regions of a top-down background without a model call.
+    Tiles are clustered by (smoothed) mean colour; the largest cluster and the one
+    with the least edge detail are taken as walkable ground. The other tiles form the
+    obstacle mask: components smaller than min_tiles are dropped, small pockets of
+    ground inside obstacles are filled, and the mask is covered greedily by its
+    largest solid rectangles. Columns within keep_clear pixels of the left and right
+    edges are never blocked. Returns building_coordinates in world pixels.
+    """
+    from PIL import Image, ImageFilter
+    img = Image.open(image_path).convert("RGB")
+    cols, rows = world_size[0] // tile, world_size[1] // tile
+
+    # Mean colour per tile (blurred over neighbours so textures such as cobbles or
+    # roof lines don't split a surface) and mean edge strength per tile
+    small = img.resize((cols, rows), Image.BOX).filter(ImageFilter.BoxBlur(1))
+    labels = list(_pixels(small.quantize(colors=clusters, method=Image.Quantize.MEDIANCUT, kmeans=16)))
+    edges = img.convert("L").resize((cols * 4, rows * 4), Image.BOX).filter(ImageFilter.FIND_EDGES)
+    edge = list(_pixels(edges.resize((cols, rows), Image.BOX)))
+
+    counts = {}
+    edge_sums = {}
+    for label, e in zip(labels, edge):
+        counts[label] = counts.get(label, 0) + 1
+        edge_sums[label] = edge_sums.get(label, 0) + e
+    largest = max(counts, key=counts.get)
+    smoothest = min(counts, key=lambda label: edge_sums[label] / counts[label])
+    ground = {largest, smoothest}
+
+    blocked = [label not in ground for label in labels]
+    lane = -(-keep_clear // tile)
+    for i in range(len(blocked)):
+        if i % cols < lane or i % cols >= cols - lane:
+            blocked[i] = False
+    for component in _components(blocked, cols, rows):
+        if len(component) < min_tiles:
+            for i in component:
+                blocked[i] = False
+    for component in _components([not b for b in blocked], cols, rows):
+        if len(component) < min_tiles:
+            for i in component:
+                blocked[i] = True
+
+    rects = []
+    while len(rects) < max_obstacles:
+        area, c, r, w, h = _largest_rectangle(blocked, cols, rows)
+        if area < min_tiles:
+            break
+        for row in range(r, r + h):
+            for col in range(c, c + w):
+                blocked[row * cols + col] = False
+        rects.append({'x': c * tile, 'y': r * tile, 'w': w * tile, 'h': h * tile})
+    annotate(obstacles=len(rects))
+    return rects
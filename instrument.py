@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+class Tracer:
+    """
+    Records timed spans for the generation pipeline and writes them as a Chrome
+    trace-event file (open in chrome://tracing or https://ui.perfetto.dev).
+    Each span is a complete ('X') event with its category, thread and any args the
+    code attached (model, request/response bytes, tokens, retries, cache hits...).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.events = []
+            self.t0 = time.perf_counter()
+            self.wall_start = time.time()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, category, **args):
+        """
+        Times the enclosed block. Yields the span's args dict so the caller (or code
+        further down, via annotate()) can add fields before it is recorded.
+        """
+        stack = self._stack()
+        stack.append(args)
+        start = time.perf_counter()
+        try:
+            yield args
+        except Exception as e:
+            args['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': round((start - self.t0) * 1e6),
+                'dur': round((end - start) * 1e6),
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'args': args,
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def annotate(self, **fields):
+        """
+        Adds fields to the innermost open span on this thread (no-op outside a span).
+        """
+        stack = self._stack()
+        if stack:
+            stack[-1].update(fields)
+
+    def drain(self):
+        """
+        Returns the recorded events and clears them (used by worker processes to
+        hand their spans back to the parent).
+        """
+        with self._lock:
+            events, self.events = self.events, []
+        return events
+
+    def merge(self, events):
+        """
+        Adds events recorded by another process. Its spans line up with this trace
+        when that process used this tracer's t0 (perf_counter is system-wide).
+        """
+        with self._lock:
+            self.events.extend(events)
+
+    def summary(self):
+        """
+        Aggregates spans by (category, name): count, total/max seconds and the summed
+        numeric args (bytes, tokens, retries, ...). Per-asset task names such as
+        'sprite:npc_A.png' are grouped under their prefix ('sprite').
+        """
+        rows = {}
+        with self._lock:
+            events = list(self.events)
+        for e in events:
+            name = e['name'].split(':', 1)[0]
+            row = rows.setdefault((e['cat'], name), {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            seconds = e['dur'] / 1e6
+            row['count'] += 1
+            row['seconds'] += seconds
+            row['max_seconds'] = max(row['max_seconds'], seconds)
+            for k, v in e['args'].items():
+                if isinstance(v, (int, float)) and not isinstance(v, bool):
+                    row[k] = row.get(k, 0) + v
+                elif isinstance(v, bool) and v:
+                    row[k] = row.get(k, 0) + 1
+        return rows
+
+    def save(self, path, metadata=None):
+        with self._lock:
+            events = list(self.events)
+        trace = {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': dict(metadata or {}, started=self.wall_start, wall_seconds=round(time.perf_counter() - self.t0, 3)),
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(trace, f, ensure_ascii=False)
+
+    def print_summary(self):
+        rows = self.summary()
+        if not rows:
+            return
+        print(f"Run summary ({time.perf_counter() - self.t0:.1f}s wall):")
+        for (cat, name), row in sorted(rows.items(), key=lambda kv: kv[1]['seconds'], reverse=True):
+            extras = []
+            for key in ('request_bytes', 'response_bytes', 'bytes', 'total_tokens', 'retries', 'throttled_seconds', 'cache_hit'):
+                if row.get(key):
+                    value = row[key]
+                    extras.append(f"{key}={round(value, 2) if isinstance(value, float) else value}")
+            print(f"  {cat:8s} {name:28s} x{row['count']:<4d} {row['seconds']:8.2f}s (max {row['max_seconds']:.2f}s) {' '.join(extras)}")
+
+# Process-wide tracer used by llm, image_edit, scheduler and main
+tracer = Tracer()
+
+def span(name, category, **args):
+    return tracer.span(name, category, **args)
+
+def annotate(**fields):
+    tracer.annotate(**fields)
+
+def traced(category, name=None):
+    """
+    Decorator that records each call as a span. If the first argument is a file
+    path, its basename is recorded too.
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            fields = {}
+            if args and isinstance(args[0], str):
+                fields['file'] = os.path.basename(args[0])
+            with tracer.span(span_name, category, **fields):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
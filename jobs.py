@@ -0,0 +1,371 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import threading
+import subprocess
+from progress import PROGRESS_MARKER, READY_MARKER
+
+class JobConflict(Exception):
+    """
+    Raised by JobManager.submit when the project already has a job whose main.py
+    has not exited: two runs would write the same game folder.
+    """
+    def __init__(self, job_id, project_name):
+        super().__init__(f"Project '{project_name}' is already being generated (job {job_id})")
+        self.job_id = job_id
+        self.project_name = project_name
+
+def result_payload(job):
+    return {
+        'success': job['status'] == 'succeeded',
+        'game_path': job['game_path'],
+        'project_name': job['project_name'],
+        'job_id': job['id'],
+    }
+
+class JobEvents:
+    """
+    Append-only, numbered event log of one job (log lines, progress, status changes
+    and the final result), kept in memory as ready-to-send Server-Sent Events frames
+    and in <id>.events (one JSON object per line) so it survives a server restart.
+    Any number of watchers read it from the id they last saw.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.frames = []
+        self.result_id = None
+        self._cond = threading.Condition()
+        self._listeners = []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # torn last line after a crash
+                    self._add(record['event'], record['data'])
+        except OSError:
+            pass
+
+    def _add(self, event, data):
+        event_id = len(self.frames) + 1
+        payload = json.dumps(data, ensure_ascii=False)
+        self.frames.append(f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n".encode('utf-8'))
+        if event == 'result':
+            self.result_id = event_id
+        return event_id
+
+    def append(self, event, data):
+        with self._cond:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'event': event, 'data': data}, ensure_ascii=False) + "\n")
+            event_id = self._add(event, data)
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"Event listener failed: {e}")
+        return event_id
+
+    def add_listener(self, callback):
+        """
+        Registers callback(), called from the appending thread after every new event
+        (async_server wakes its watchers with it instead of polling).
+        """
+        with self._cond:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._cond:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def read(self, after=0):
+        """
+        Returns (frames, last_id): the SSE frames of the events after id after.
+        """
+        with self._cond:
+            return self.frames[after:], len(self.frames)
+
+    def wait(self, after, timeout):
+        """
+        Blocks until there is an event after id after, or timeout seconds passed.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self.frames) > after, timeout)
+
+class JobManager:
+    """
+    Persistent generation job queue with a bounded worker pool.
+    Each job is stored as <jobs_dir>/<id>.json (state) and <id>.log (main.py output),
+    so state and logs survive a server restart. Jobs that were queued or running
+    when the server stopped are queued again on startup; main.py skips assets that
+    already exist, so a restarted job resumes instead of starting over.
+    """
+    def __init__(self, base_dir, jobs_dir=None, max_workers=2):
+        self.base_dir = base_dir
+        self.jobs_dir = jobs_dir or os.path.join(base_dir, '.jobs')
+        self.max_workers = max(1, int(max_workers))
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._listeners = []
+        self._events = {}
+        # project_name -> id of its job that is queued, running or whose main.py is
+        # still finishing the BGM after the game was marked ready
+        self._active = {}
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+    def _state_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def log_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.log")
+
+    def story_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.txt")
+
+    def events(self, job_id):
+        """
+        The JobEvents of a job, loaded from disk on first use.
+        """
+        with self._lock:
+            if job_id not in self._events:
+                events = JobEvents(os.path.join(self.jobs_dir, f"{job_id}.events"))
+                job = self.jobs.get(job_id)
+                if events.result_id is None and job and job['status'] in ('succeeded', 'failed'):
+                    # Finished before event logs were kept
+                    events.append('result', result_payload(job))
+                self._events[job_id] = events
+            return self._events[job_id]
+
+    def _load(self):
+        pending = []
+        for name in os.listdir(self.jobs_dir):
+            if name.startswith('upload-') and name.endswith('.part'):
+                # Story upload interrupted by the restart
+                os.remove(os.path.join(self.jobs_dir, name))
+                continue
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.jobs_dir, name), 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            self.jobs[job['id']] = job
+            if job['status'] in ('queued', 'running'):
+                pending.append(job)
+        for job in sorted(pending, key=lambda j: j['created']):
+            if job['status'] == 'running':
+                self._append_log(job['id'], "\nServer restarted, resuming job...\n")
+            job['status'] = 'queued'
+            self._active.setdefault(job['project_name'], job['id'])
+            self.events(job['id']).append('status', {'status': 'queued'})
+            self._save(job)
+            self._queue.put(job['id'])
+
+    def _save(self, job):
+        path = self._state_path(job['id'])
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, path)
+
+    def _append_log(self, job_id, text):
+        with open(self.log_path(job_id), 'a', encoding='utf-8') as f:
+            f.write(text)
+        self.events(job_id).append('log', {'text': text})
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self.jobs[job_id]
+            changed = 'status' in fields and fields['status'] != job['status']
+            job.update(fields)
+            self._save(job)
+            snapshot = dict(job)
+        if changed:
+            events = self.events(job_id)
+            events.append('status', {'status': snapshot['status']})
+            if snapshot['status'] in ('succeeded', 'failed'):
+                events.append('result', result_payload(snapshot))
+        for listener in list(self._listeners):
+            try:
+                listener(snapshot)
+            except Exception as e:
+                print(f"Job listener failed: {e}")
+        return snapshot
+
+    def add_listener(self, callback):
+        """
+        Registers callback(job), called after every job state change.
+        """
+        self._listeners.append(callback)
+
+    def start(self):
+        """
+        Loads persisted jobs (re-queueing unfinished ones) and starts the workers.
+        """
+        self._load()
+        for i in range(self.max_workers):
+            t = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            t.start()
+
+    def submit(self, project_name, story_file=None):
+        """
+        Queues a job for project_name. story_file, if given, is moved into the jobs
+        directory as the job's story; otherwise main.py reads <project_name>.txt.
+        Raises JobConflict if the project already has an unfinished job.
+        """
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            if project_name in self._active:
+                raise JobConflict(self._active[project_name], project_name)
+            self._active[project_name] = job_id
+        if story_file:
+            os.replace(story_file, self.story_path(job_id))
+        job = {
+            'id': job_id,
+            'project_name': project_name,
+            'game_path': f'/{project_name}/index.html',
+            'status': 'queued',
+            'created': time.time(),
+            'started': None,
+            'finished': None,
+            'returncode': None,
+            'story_file': self.story_path(job_id) if story_file else None,
+        }
+        with self._lock:
+            self.jobs[job_id] = job
+            self._save(job)
+        self.events(job_id).append('status', {'status': 'queued'})
+        self._append_log(job_id, "Job queued.\n")
+        self._queue.put(job_id)
+        return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self):
+        with self._lock:
+            jobs = [dict(j) for j in self.jobs.values()]
+        jobs.sort(key=lambda j: j['created'], reverse=True)
+        return jobs
+
+    def read_log(self, job_id, offset=0):
+        """
+        Returns (text, new_offset) for the part of the job log after byte offset.
+        """
+        try:
+            with open(self.log_path(job_id), 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except OSError:
+            return '', offset
+        if not data.endswith(b'\n') and b'\n' in data:
+            # Keep a trailing partial line (and any split multi-byte char) for the next read
+            data = data[:data.rfind(b'\n') + 1]
+        return data.decode('utf-8', errors='replace'), offset + len(data)
+
+    def _release(self, job_id):
+        with self._lock:
+            project_name = self.jobs[job_id]['project_name']
+            if self._active.get(project_name) == job_id:
+                del self._active[project_name]
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            except Exception as e:
+                self._append_log(job_id, f"\nERROR: {e}\n")
+                self._update(job_id, status='failed', finished=time.time())
+                self._release(job_id)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        job = self._update(job_id, status='running', started=time.time())
+        print(f"Starting generation for {job['project_name']} (job {job_id})...")
+        self._append_log(job_id, "Initializing generation process...\n")
+
+        cmd = [sys.executable, '-u', 'main.py', '--storyname', job['project_name'], '--progress']
+        if job.get('story_file'):
+            cmd += ['--story-file', job['story_file']]
+        log = open(self.log_path(job_id), 'a', encoding='utf-8')
+        try:
+            # stderr is merged into stdout so a chatty stderr can't fill its pipe
+            # and stall the run while we are blocked reading stdout.
+            process = subprocess.Popen(
+                cmd,
+                cwd=self.base_dir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                encoding='utf-8',
+                bufsize=1,
+                universal_newlines=True
+            )
+        except BaseException:
+            log.close()
+            raise
+        if self._follow(job_id, process, log, until_ready=True):
+            # The game is playable; main.py may keep running to finish the BGM. Another
+            # thread follows it to the end so this worker can start the next job.
+            threading.Thread(target=self._finish, args=(job_id, process, log),
+                             name=f"job-finish-{job_id}", daemon=True).start()
+            return
+        self._finish(job_id, process, log)
+
+    def _follow(self, job_id, process, log, until_ready=False):
+        """
+        Copies main.py's output to the log and the job's events until it ends, or
+        until READY_MARKER (then marks the job succeeded and returns True).
+        """
+        events = self.events(job_id)
+        for line in process.stdout:
+            if line.startswith(READY_MARKER):
+                self._update(job_id, status='succeeded', finished=time.time())
+                if until_ready:
+                    return True
+                continue
+            if line.startswith(PROGRESS_MARKER):
+                try:
+                    events.append('progress', json.loads(line[len(PROGRESS_MARKER):]))
+                    continue
+                except json.JSONDecodeError:
+                    pass
+            print(line, end='') # Console
+            log.write(line)
+            log.flush()
+            events.append('log', {'text': line})
+        return False
+
+    def _finish(self, job_id, process, log):
+        """
+        Follows main.py until it exits, records its return code and frees the
+        project for new jobs.
+        """
+        try:
+            with log:
+                self._follow(job_id, process, log)
+                process.wait()
+            if self.get(job_id)['status'] == 'succeeded':
+                self._update(job_id, returncode=process.returncode)
+            else:
+                status = 'succeeded' if process.returncode == 0 else 'failed'
+                self._update(job_id, status=status, finished=time.time(), returncode=process.returncode)
+        except Exception as e:
+            self._append_log(job_id, f"\nERROR: {e}\n")
+            if self.get(job_id)['status'] != 'succeeded':
+                self._update(job_id, status='failed', finished=time.time())
+        finally:
+            self._release(job_id)
@@ -1,11 +1,30 @@
-from google import genai
-from google.genai import types
-from PIL import Image
 import json
 import os
+import mimetypes
+import threading
+from concurrent.futures import Future
+from cache import GenerationCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
+from instrument import span, annotate
+from governor import RequestGovernor
+
+def usage_fields(response):
+    """
+    Token counts from a response's usage metadata, for the run trace.
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return {}
+    return {
+        'prompt_tokens': usage.prompt_token_count or 0,
+        'output_tokens': usage.candidates_token_count or 0,
+        'total_tokens': usage.total_token_count or 0,
+    }
+
+def request_bytes(prompt, images_path=()):
+    return len(prompt.encode('utf-8')) + sum(os.path.getsize(p) for p in images_path if os.path.exists(p))
 
 class GeminiClient:
-    def __init__(self, config_path='config.json'):
+    def __init__(self, config_path='config.json', cache=None, use_cache=True, governor=None):
         config = {}
         if os.path.exists(config_path):
             try:
@@ -27,56 +46,210 @@ class GeminiClient:
 
         if not api_key:
             print("Warning: No Gemini API key found in environment variables or key.txt")
-            
-        self.client = genai.Client(api_key=api_key)
+
+        # The SDK (google.genai takes most of a cold start to import) and its client
+        # are only loaded once a request actually has to go to the API; resume runs
+        # that hit the cache or skip every asset never pay for them.
+        self.api_key = api_key
+        self._client = None
+        self._client_lock = threading.Lock()
+
+        # Input images (npc_ref.webp, temp_stand.png, backgrounds) become request parts
+        # once per file version and are reused by every request that sends them.
+        # "upload_references": true in config.json sends them through the File API
+        # instead, so requests only carry a URI.
+        self.upload_references = bool(config.get('upload_references', False))
+        self._parts = {}
+        self._parts_lock = threading.Lock()
+
+        # Content-addressed response cache shared by every call on this client
+        if cache is None and use_cache:
+            max_mb = config.get('cache_max_mb')
+            cache = GenerationCache(
+                cache_dir=config.get('cache_dir', DEFAULT_CACHE_DIR),
+                max_bytes=int(max_mb) * 1024 * 1024 if max_mb else DEFAULT_MAX_BYTES,
+            )
+        self.cache = cache
+
+        # Rate limits, retries, deadlines and circuit breaking for every request;
+        # pass one governor to several clients to share the quota between them
+        self.governor = governor or RequestGovernor.from_config(config)
+
+    @property
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                from google import genai
+                self._client = genai.Client(api_key=self.api_key)
+            return self._client
+
+    def image_part(self, path):
+        """
+        Request part for an input image. Built from the file's own bytes (the SDK would
+        otherwise decode a PIL image and re-encode it as PNG for every request) or from
+        a File API upload, then cached for the rest of the run. Only the first caller
+        for a file builds the part; others wait for that one file, not for every upload.
+        """
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._parts_lock:
+            future = self._parts.get(key)
+            building = future is None
+            if building:
+                future = self._parts[key] = Future()
+        if not building:
+            return future.result()
+        try:
+            part = self._build_part(path, stat.st_size)
+        except BaseException as e:
+            # Not cached: the next caller tries again
+            with self._parts_lock:
+                del self._parts[key]
+            future.set_exception(e)
+            raise
+        future.set_result(part)
+        return part
+
+    def _build_part(self, path, size):
+        from google.genai import types
+        mime_type = mimetypes.guess_type(path)[0] or 'image/png'
+        if self.upload_references:
+            try:
+                with span('upload_file', 'gemini', file=os.path.basename(path), request_bytes=size):
+                    uploaded = self.client.files.upload(file=path, config={'mime_type': mime_type})
+                return types.Part.from_uri(file_uri=uploaded.uri, mime_type=uploaded.mime_type or mime_type)
+            except Exception as e:
+                print(f"Upload of {os.path.basename(path)} failed ({e}); sending it inline")
+        with open(path, 'rb') as f:
+            return types.Part.from_bytes(data=f.read(), mime_type=mime_type)
+
+    def _cache_key(self, model, prompt, images_path=(), options=None):
+        if self.cache is None:
+            return None
+        return self.cache.make_key(model, prompt, images_path, options)
+
+    def _call(self, model, contents, config):
+        """
+        Single entry point for API requests. Goes through the request governor and
+        records retries, throttling and token usage on the current span.
+        """
+        from google.genai import types
+        def attempt(timeout):
+            return self.client.models.generate_content(
+                model=model,
+                contents=contents,
+                config=config.model_copy(update={'http_options': types.HttpOptions(timeout=int(timeout * 1000))})
+            )
+        response, stats = self.governor.call(model, attempt)
+        annotate(**stats, **usage_fields(response))
+        return response
 
     def generate_json(self, story, prompt):
-        response = self.client.models.generate_content(
-            model="gemini-3-pro-preview",
-            contents=[prompt + "\n\nStory:\n" + story],
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json"
+        model = "gemini-3-pro-preview"
+        contents = prompt + "\n\nStory:\n" + story
+        with span('generate_json', 'gemini', model=model, request_bytes=request_bytes(contents)) as trace:
+            key = self._cache_key(model, contents, options={'response_mime_type': 'application/json'})
+            if key and (cached := self.cache.get(key)) is not None:
+                trace.update(cache_hit=True, response_bytes=len(cached[0].encode('utf-8')))
+                return json.loads(cached[0])
+
+            from google.genai import types
+            response = self._call(
+                model,
+                [contents],
+                types.GenerateContentConfig(
+                    response_mime_type="application/json"
+                )
             )
-        )
-        return json.loads(response.text)
+            trace['response_bytes'] = len((response.text or '').encode('utf-8'))
+            result = json.loads(response.text)
+            if key:
+                self.cache.put(key, response.text)
+            return result
+
+    def generate_content(self, prompt, images_path=None, output_path=None, aspect_ratio=None, image_size=None):
+        text_return, image_bytes = self._generate(prompt, images_path, aspect_ratio, image_size, output_path)
+        if output_path and image_bytes is not None:
+            with open(output_path, 'wb') as f:
+                f.write(image_bytes)
+        return text_return
+
+    def generate_image(self, prompt, images_path=None, aspect_ratio=None, image_size=None, name=None):
+        """
+        Same request as generate_content, but returns the encoded image bytes (None if
+        the model sent no image) so the caller can decode them once in memory.
+        """
+        return self._generate(prompt, images_path, aspect_ratio, image_size, name)[1]
 
-    def generate_content(self, prompt, images_path=None, output_path=None):
+    def _generate(self, prompt, images_path, aspect_ratio, image_size, name=None):
         if images_path is None:
             images_path = []
-        images = []
-        for image_path in images_path:
-            images.append(Image.open(image_path))
-        
-        # We force the model to generate a 2560x1440 image via config if supported, 
-        # but primarily we rely on the prompt and the fact that we won't resize it in JS.
-        response = self.client.models.generate_content(
-            model="gemini-3-pro-image-preview",
-            config=types.GenerateContentConfig(
-                response_modalities=["TEXT", "IMAGE"],
-            ),
-            contents=[prompt, *images]
-        )
-        
-        text_return = ""
-        for part in response.parts:
-            if part.text:
-                text_return += part.text
-            if image := part.as_image():
-                if output_path:
-                    image.save(output_path)
-        #print(f"LLM Text Return: {text_return}")
-        return text_return
+        model = "gemini-3-pro-image-preview"
+        fields = {'model': model, 'request_bytes': request_bytes(prompt, images_path)}
+        if name:
+            fields['file'] = os.path.basename(name)
+        with span('generate_content', 'gemini', **fields) as trace:
+            options = {'response_modalities': ["TEXT", "IMAGE"], 'aspect_ratio': aspect_ratio, 'image_size': image_size}
+            key = self._cache_key(model, prompt, images_path, options)
+            if key and (cached := self.cache.get(key)) is not None:
+                text_return, image_bytes = cached
+                trace.update(cache_hit=True, response_bytes=len(image_bytes or b''))
+                return text_return, image_bytes
+
+            from google.genai import types
+            images = [self.image_part(image_path) for image_path in images_path]
+            
+            # We force the model to generate a 2560x1440 image via config if supported, 
+            # but primarily we rely on the prompt and the fact that we won't resize it in JS.
+            image_config = None
+            if aspect_ratio or image_size:
+                image_config = types.ImageConfig(aspect_ratio=aspect_ratio, image_size=image_size)
+            response = self._call(
+                model,
+                [prompt, *images],
+                types.GenerateContentConfig(
+                    response_modalities=["TEXT", "IMAGE"],
+                    image_config=image_config,
+                )
+            )
+            
+            text_return = ""
+            image_bytes = None
+            for part in response.parts:
+                if part.text:
+                    text_return += part.text
+                if part.as_image():
+                    # Encoded bytes as sent by the model (what part.as_image().save writes)
+                    image_bytes = part.inline_data.data
+            #print(f"LLM Text Return: {text_return}")
+            trace['response_bytes'] = len(text_return.encode('utf-8')) + len(image_bytes or b'')
+            # Only cache responses that actually produced an image
+            if key and image_bytes is not None:
+                self.cache.put(key, text_return, image_bytes)
+            return text_return, image_bytes
+
     def describe_image(self,image_path,prompt):
-        # Load the image using PIL
-        img = Image.open(image_path)
-        
-        # Generate content using a multimodal model (like gemini-2.0-flash)
-        response = self.client.models.generate_content(
-            model="gemini-3-pro-preview",
-            contents=[prompt, img],
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json"
+        model = "gemini-3-pro-preview"
+        fields = {'model': model, 'request_bytes': request_bytes(prompt, [image_path]), 'file': os.path.basename(image_path)}
+        with span('describe_image', 'gemini', **fields) as trace:
+            key = self._cache_key(model, prompt, [image_path], {'response_mime_type': 'application/json'})
+            if key and (cached := self.cache.get(key)) is not None:
+                trace.update(cache_hit=True, response_bytes=len(cached[0].encode('utf-8')))
+                return cached[0]
+
+            from google.genai import types
+            img = self.image_part(image_path)
+            
+            # Generate content using a multimodal model (like gemini-2.0-flash)
+            response = self._call(
+                model,
+                [prompt, img],
+                types.GenerateContentConfig(
+                    response_mime_type="application/json"
+                )
             )
-        )
-        #print(response.text)
-        return response.text
\ No newline at end of file
+            #print(response.text)
+            trace['response_bytes'] = len((response.text or '').encode('utf-8'))
+            if key and response.text:
+                self.cache.put(key, response.text)
+            return response.text
\ No newline at end of file
@@ -1,29 +1,81 @@
 import os
 import json
+import time
 import argparse
 import shutil
+import threading
 from llm import GeminiClient
-from image_edit import remove_background, crop_to_content, normalize_sprite_sheet
+from image_edit import ImagePool, normalize_sprite_sheet, detect_obstacles
 import prompt_hub
-from PIL import Image
-from google import genai
-from google.genai import types
+from scheduler import TaskGraph, BuildManifest
+from cache import hash_file
+from optimize_assets import optimize_game_assets
+from collision import build_collision, TELEPORT_CLEARANCE
+from character_library import CharacterLibrary
+from story_extract import extract_story, dedupe_scene_npcs, apply_npc_stats
+from instrument import tracer, span
+from progress import ProgressReporter, READY_MARKER
+from static_files import publish_template, write_index, precompress_game, SHARED_DIR
+from asset_manifest import AssetManifest
 try:
-    from bgm import generate_bgm
+    from bgm import generate_bgm, BackgroundTrack
 except Exception:
     generate_bgm = None
 
-def main():
-    parser = argparse.ArgumentParser(description='Generate RPG game assets from a story.')
+BACKGROUND_SIZE = (2560, 1440)
+# ImagePipeline steps applied to each kind of generated image
+SPRITE_STEPS = ['remove_background']
+STRIP_STEPS = ['remove_background', 'layout_strip']
+AVATAR_STEPS = ['remove_background', 'crop_to_content']
+BACKGROUND_STEPS = [('resize', BACKGROUND_SIZE)]
+# Outfits filled in when the story describes none. Every generic "Guard" or
+# "Merchant" gets them, so the character library never matches or stores on them.
+FALLBACK_NPC_OUTFIT = "Standard period appropriate clothing"
+PLACEHOLDER_OUTFITS = (FALLBACK_NPC_OUTFIT, 'Standard clothes', 'Monster', 'Basic')
+
+def file_hash(path):
+    return hash_file(path) if os.path.exists(path) else None
+
+def build_parser(add_help=True):
+    parser = argparse.ArgumentParser(description='Generate RPG game assets from a story.', add_help=add_help)
     parser.add_argument('--storyname', type=str, help='Name of the story file (without .txt) to generate a game for.',default='game')
-    args = parser.parse_args()
+    parser.add_argument('--story-file', type=str, default=None, help='Read the story from this file instead of <storyname>.txt next to main.py.')
+    parser.add_argument('--workers', type=int, default=4, help='Maximum number of asset generation requests to run concurrently.')
+    parser.add_argument('--image-workers', type=int, default=None, help='Processes for image post-processing (default: one per CPU core, 0 = in-process).')
+    parser.add_argument('--no-cache', action='store_true', help='Always call the model instead of reusing cached responses.')
+    parser.add_argument('--no-optimize', action='store_true', help='Skip the web optimization stage (WebP backgrounds, texture atlas).')
+    parser.add_argument('--bgm-deadline', type=float, default=0, help='Seconds after it started to wait for the BGM once everything else is done; after that the game uses default_BGM.mp3 until the track is ready.')
+    parser.add_argument('--obstacles', choices=('local', 'llm', 'refine'), default='local', help='Obstacle rectangles from local image analysis (fast, no API call), from describe_image, or local analysis refined by describe_image.')
+    parser.add_argument('--library', choices=('reuse', 'restyle', 'off'), default='reuse', help='For NPCs/minions matching a character generated for another story: copy its sprite and avatar, or redraw it from that sprite.')
+    parser.add_argument('--library-threshold', type=float, default=0.8, help='Minimum name/outfit similarity (0-1) for a character library match.')
+    parser.add_argument('--progress', action='store_true', help='Print structured progress events (stage, asset, percent, ETA, bytes) for the server to relay.')
+    parser.add_argument('--chunk-chars', type=int, default=12000, help='Stories longer than this are extracted in overlapping parts in parallel (0 = always one request).')
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    client = GeminiClient(use_cache=not args.no_cache)
+    with ImagePool(args.image_workers) as image_pool:
+        generate_game(args.storyname, client, image_pool, threading.Semaphore(args.workers), args, story_path=args.story_file)
+
+def generate_game(storyname, client, image_pool, api_slots, args, story_path=None, save_trace=True):
+    """
+    Generates (or incrementally updates) the game for one story. The client, image
+    pool and api_slots semaphore can be shared by several stories (see batch.py);
+    args carries the other command-line options. Writes trace.json unless save_trace
+    is False. Returns asset counts for throughput reports, or None if there is no story.
+    """
+    if save_trace:
+        tracer.reset()
+    progress = ProgressReporter(enabled=getattr(args, 'progress', False))
+    progress.stage('setup')
 
     # Setup folders
     base_dir = os.path.dirname(os.path.abspath(__file__))
     
-    if args.storyname:
-        story_filename = f"{args.storyname}.txt"
-        output_folder_name = args.storyname
+    if storyname:
+        story_filename = f"{storyname}.txt"
+        output_folder_name = storyname
         
         # Source game dir (template)
         game_dir_source = os.path.join(base_dir, 'game')
@@ -35,31 +87,18 @@ def main():
         # Create directories
         os.makedirs(assets_dir, exist_ok=True)
         
-        # Copy template files if they don't exist in target
-        if not os.path.exists(os.path.join(game_dir, 'game.js')):
-            shutil.copy(os.path.join(game_dir_source, 'game.js'), os.path.join(game_dir, 'game.js'))
-        if not os.path.exists(os.path.join(game_dir, 'index.html')):
-            shutil.copy(os.path.join(game_dir_source, 'index.html'), os.path.join(game_dir, 'index.html'))
-
-        # Copy audio assets if they exist
-        walk_src = os.path.join(base_dir, 'walk.mp3')
-        hit_src = os.path.join(base_dir, 'hit.wav')
-        level_src = os.path.join(base_dir, 'level.mp3')
-        default_bgm_src = os.path.join(base_dir, 'default_BGM.mp3')
-        walk_dst = os.path.join(assets_dir, 'walk.mp3')
-        hit_dst = os.path.join(assets_dir, 'hit.wav')
-        level_dst = os.path.join(assets_dir, 'level.mp3')
-        default_bgm_dst = os.path.join(assets_dir, 'default_BGM.mp3')
-        if os.path.exists(walk_src) and not os.path.exists(walk_dst):
-            shutil.copy(walk_src, walk_dst)
-        if os.path.exists(hit_src) and not os.path.exists(hit_dst):
-            shutil.copy(hit_src, hit_dst)
-        if os.path.exists(level_src) and not os.path.exists(level_dst):
-            shutil.copy(level_src, level_dst)
-        if os.path.exists(default_bgm_src) and not os.path.exists(default_bgm_dst):
-            shutil.copy(default_bgm_src, default_bgm_dst)
-            
-        print(f"Generating game for story '{args.storyname}' in {game_dir}")
+        # game.js is not copied: every game loads the template from shared/ under a
+        # content-hashed name, so browsers download it once for all games. The
+        # template folder itself (--storyname game) keeps loading its own game.js.
+        script_name = publish_template(base_dir)
+        if os.path.abspath(game_dir) != os.path.abspath(game_dir_source):
+            write_index(os.path.join(game_dir_source, 'index.html'), os.path.join(game_dir, 'index.html'),
+                        f'../{SHARED_DIR}/{script_name}')
+
+        # The stock sounds (walk.mp3, hit.wav, level.mp3, default_BGM.mp3) are not
+        # copied either; asset_manifest.json points to their copies in shared/
+
+        print(f"Generating game for story '{storyname}' in {game_dir}")
         output_json_path = os.path.join(game_dir, "output.json")
         
     else:
@@ -77,13 +116,12 @@ def main():
     if has_ref_image:
         print(f"Using reference image: {npc_ref_path}")
 
-    client = GeminiClient()
-    
     # 1. Read Story
-    story_path = os.path.join(base_dir, story_filename)
+    if story_path is None:
+        story_path = os.path.join(base_dir, story_filename)
     if not os.path.exists(story_path):
-        print(f"Error: Story file '{story_filename}' not found.")
-        return
+        print(f"Error: Story file '{story_path}' not found.")
+        return None
 
     with open(story_path, 'r', encoding='utf-8') as f:
         story = f.read()
@@ -91,7 +129,12 @@ def main():
     # 2. Extract Story Data to output.json
     if not os.path.exists(output_json_path) or os.path.getsize(output_json_path) == 0:
         print("Extracting story data...")
-        raw_data = client.generate_json(story, prompt_hub.prompt_npc)
+        progress.stage('extract_story')
+        with span('extract_story', 'stage', story_bytes=len(story.encode('utf-8'))):
+            raw_data = extract_story(
+                client, story, prompt_hub.prompt_npc,
+                chunk_chars=args.chunk_chars, max_workers=args.workers,
+            )
         with open(output_json_path, 'w', encoding='utf-8') as f:
             json.dump(raw_data, f, ensure_ascii=False, indent=4)
     else:
@@ -100,23 +143,22 @@ def main():
 
     # 3. Generate Assets
     
-    # BGM Generation (if prompt exists)
+    # BGM Generation (if prompt exists). Composed in the background while the images
+    # are generated; game.js plays default_BGM.mp3 until bgm.mp3 appears.
     bgm_prompt = raw_data.get('bgm')
     bgm_path = os.path.join(assets_dir, 'bgm.mp3')
     default_bgm_src = os.path.join(base_dir, 'default_BGM.mp3')
+    bgm_track = None
     if bgm_prompt and generate_bgm and not os.path.exists(bgm_path):
-        print("Generating BGM...")
-        try:
-            ok = generate_bgm("generate a bgm for rpg game ,smooth and beatiful" + bgm_prompt, bgm_path)
-            if not ok:
-                raise RuntimeError("BGM generation returned false")
-        except Exception as e:
-            print(f"Failed to generate BGM: {e}")
-            if os.path.exists(default_bgm_src):
-                shutil.copy(default_bgm_src, bgm_path)
-                print("Using default_BGM.mp3 as fallback.")
-    elif not os.path.exists(bgm_path) and os.path.exists(default_bgm_src):
-        shutil.copy(default_bgm_src, bgm_path)
+        print("Generating BGM in the background...")
+        bgm_track = BackgroundTrack(
+            "generate a bgm for rpg game ,smooth and beatiful" + bgm_prompt,
+            bgm_path, fallback_path=default_bgm_src, generate=generate_bgm,
+        )
+        bgm_started = time.monotonic()
+        bgm_track.start()
+    elif not os.path.exists(bgm_path):
+        # game.js plays default_BGM.mp3 when the game has no bgm.mp3
         print("Using default_BGM.mp3 (no prompt or generation skipped).")
     
     # --- GLOBAL CHARACTERS ---
@@ -133,48 +175,10 @@ def main():
         npc_list = [] 
 
     # Deduplicate NPCs within scenes (Merge dialogues)
-    for scene in scenes:
-        if 'npc' in scene:
-            merged_npcs = {}
-            new_npc_list = []
-            for npc in scene['npc']:
-                name = npc.get('name')
-                if not name:
-                    continue
-                
-                if name in merged_npcs:
-                    # Already exists, merge dialogue
-                    existing_npc = merged_npcs[name]
-                    if 'dialogue' in npc:
-                        existing_npc.setdefault('dialogue', []).extend(npc['dialogue'])
-                else:
-                    # New NPC for this scene
-                    merged_npcs[name] = npc
-                    new_npc_list.append(npc)
-            scene['npc'] = new_npc_list
+    dedupe_scene_npcs(scenes)
 
     # Apply NPC stats from npc_list to scene NPCs
-    npc_stats_map = {}
-    for npc_def in npc_list:
-        name = npc_def.get('name')
-        if name:
-            npc_stats_map[name] = {
-                'hp': npc_def.get('hp'),
-                'attack': npc_def.get('attack'),
-                'defense': npc_def.get('defense')
-            }
-
-    for scene in scenes:
-        for npc in scene.get('npc', []):
-            name = npc.get('name')
-            if name in npc_stats_map:
-                stats = npc_stats_map[name]
-                if stats.get('hp') is not None:
-                    npc['hp'] = stats['hp']
-                if stats.get('attack') is not None:
-                    npc['attack'] = stats['attack']
-                if stats.get('defense') is not None:
-                    npc['defense'] = stats['defense']
+    apply_npc_stats(scenes, npc_list)
 
     # Ensure all global NPCs appear somewhere
     if len(scenes) > 0:
@@ -219,200 +223,192 @@ def main():
                     })
     
     
+    # 3a-3c. Asset generation as a dependency graph.
+    # Independent Gemini calls run concurrently (up to --workers at a time); the only
+    # ordering is stand view -> directional views and sprite -> avatar.
+    # build_manifest.json records what every asset was built from (prompt, outfit,
+    # reference and upstream images), so a rerun rebuilds exactly the assets whose
+    # inputs changed plus their dependents, and skips the rest.
+    # Post-processing (background removal, crop, strip layout, resize, encode) runs in
+    # a process pool. The graph gets extra threads to keep that pool busy while
+    # api_slots still caps concurrent model requests at --workers.
+    manifest = BuildManifest(os.path.join(game_dir, 'build_manifest.json'))
+    graph = TaskGraph(max_workers=args.workers + image_pool.max_workers, manifest=manifest,
+                      on_finish=progress.task_finished)
+
     # 3a. Player Generation
     player_name = player_data.get('name', 'Hero')
+    player_outfit = player_data.get('outfit', 'Armor')
     player_path = os.path.join(assets_dir, 'temp_stand.png')
     #player_running_path = os.path.join(assets_dir, 'player_running.png')
-    
-    if not os.path.exists(player_path):
-        print(f"Generating multi-directional sprite sheet for {player_name}...")
-        
-        # 1. Generate STAND view (single pose) as base condition
-        prompt_stand = prompt_hub.player_sprite_prompt_template_stand.format(
-            name=player_name, outfit=player_data.get('outfit', 'Armor')
-        )
-        contents_stand = [prompt_stand]
-        if has_ref_image:
-            contents_stand.append(Image.open(npc_ref_path))
 
-        res_stand = client.client.models.generate_content(
-            model="gemini-3-pro-image-preview",
-            contents=contents_stand
-        )
-        path_stand = os.path.join(assets_dir, 'temp_stand.png')
-        for part in res_stand.parts:
-            if part.inline_data:
-                part.as_image().save(path_stand)
-        remove_background(path_stand)
-
-        # 2. Generate RIGHT view (3 frames) with STAND as condition
-        prompt_right = prompt_hub.player_sprite_prompt_template_right.format(
-            name=player_name, outfit=player_data.get('outfit', 'Armor')
-        )
-        res_right = client.client.models.generate_content(
-            model="gemini-3-pro-image-preview",
-            contents=[prompt_right, Image.open(path_stand)]
-        )
-        path_right = os.path.join(assets_dir, 'temp_right.png')
-        for part in res_right.parts:
-            if part.inline_data:
-                part.as_image().save(path_right)
-        remove_background(path_right)
-
-        # 3. Generate UP view (3 frames) with STAND as condition
-        prompt_up = prompt_hub.player_sprite_prompt_template_up.format(
-            name=player_name, outfit=player_data.get('outfit', 'Armor')
-        )
-        res_up = client.client.models.generate_content(
-            model="gemini-3-pro-image-preview",
-            contents=[prompt_up, Image.open(path_stand)]
-        )
-        path_up = os.path.join(assets_dir, 'temp_up.png')
-        for part in res_up.parts:
-            if part.inline_data:
-                part.as_image().save(path_up)
-        remove_background(path_up)
-
-        # 4. Generate DOWN view (3 frames) with STAND as condition
-        prompt_down = prompt_hub.player_sprite_prompt_template_down.format(
-            name=player_name, outfit=player_data.get('outfit', 'Armor')
-        )
-        res_down = client.client.models.generate_content(
-            model="gemini-3-pro-image-preview",
-            contents=[prompt_down, Image.open(path_stand)]
+    def generate_image(prompt, images_path, output_path, steps, **options):
+        # The model's bytes are decoded once in a pool process, edited by the
+        # ImagePipeline steps and encoded once to output_path
+        with api_slots:
+            data = client.generate_image(prompt, images_path=images_path, name=output_path, **options)
+        if data is None:
+            raise RuntimeError(f"No image returned for {os.path.basename(output_path)}")
+        image_pool.process(data, output_path, steps)
+
+    def image_inputs(prompt, images_path, steps, **options):
+        # Everything an image task's output depends on, for the build manifest.
+        # Upstream images are hashed when the task is ready, i.e. after they were rebuilt.
+        return {
+            'prompt': prompt,
+            'images': [file_hash(p) for p in images_path],
+            'steps': steps,
+            'options': options,
+        }
+
+    def add_image_task(name, prompt, images_path, output_path, steps, deps=(), message=None, result=None, **options):
+        def run():
+            if message:
+                print(message)
+            generate_image(prompt, images_path, output_path, steps, **options)
+            return result
+        return graph.add(
+            name, run, deps=deps, outputs=[output_path],
+            inputs=lambda: image_inputs(prompt, images_path, steps, **options),
         )
-        path_down = os.path.join(assets_dir, 'temp_down.png')
-        for part in res_down.parts:
-            if part.inline_data:
-                part.as_image().save(path_down)
-        remove_background(path_down)
-
-        # Combine into a 3x3 grid (Col 0: Down, Col 1: Up, Col 2: Right)
-        # Each temp image is 1x3 (or similar), we need to extract 3 frames from each
-        grid = Image.new("RGBA", (128 * 3, 128 * 3), (0, 0, 0, 0))
-        
-        def paste_column(source_path, col_idx, prefix):
-            if not os.path.exists(source_path):
-                print(f"Warning: Source path {source_path} not found.")
-                return
-            src = Image.open(source_path).convert("RGBA")
-            sw, sh = src.size
-            
-            # Use a more robust way to find frames: 
-            # 1. Remove background and crop to content of the whole strip first
-            bbox_all = src.getbbox()
-            if not bbox_all:
-                print(f"No content found in {source_path}")
-                return
-            src_cropped = src.crop(bbox_all)
-            cw, ch = src_cropped.size
-            
-            # 2. Divide the cropped content into 3 frames horizontally
-            f_w = cw / 3
-            
-            # Create a new strip for this direction (3 frames of 128x128)
-            strip = Image.new("RGBA", (128 * 3, 128), (0, 0, 0, 0))
-            
-            for col in range(3):
-                frame = src_cropped.crop((int(col * f_w), 0, int((col + 1) * f_w), ch))
-                # Center this frame in 128x128
-                f_bbox = frame.getbbox()
-                if f_bbox:
-                    char = frame.crop(f_bbox)
-                    # Scale to fit 128x128 (90% height)
-                    th = int(128 * 0.9)
-                    ratio = th / char.height
-                    tw = int(char.width * ratio)
-                    char = char.resize((tw, th), Image.NEAREST)
-                    # Paste centered in the strip cell
-                    strip.paste(char, (col * 128 + (128 - tw) // 2, (128 - th) // 2), char)
-            
-            strip_path = os.path.join(assets_dir, f'temp_{prefix}.png')
-            strip.save(strip_path)
-            print(f"Processed strip saved to {strip_path}")
 
-        paste_column(path_down, 0, 'down')
-        paste_column(path_up, 1, 'up')
-        paste_column(path_right, 2, 'right')
-        
-        # grid.save(player_running_path) # DELETED generation process
-        # Clean up - REMOVED os.remove(p) as requested
-        print(f"Individual strips saved: temp_right.png, temp_up.png, temp_down.png in {assets_dir}")
-        print(f"Skipped combined player_running.png generation.")
+    # Generate STAND view (single pose) as base condition
+    prompt_stand = prompt_hub.player_sprite_prompt_template_stand.format(
+        name=player_name, outfit=player_outfit
+    )
+    add_image_task('player_stand', prompt_stand, ref_images, player_path, SPRITE_STEPS,
+                   message=f"Generating stand view for {player_name}...")
 
-    player_avatar_path = os.path.join(assets_dir, 'player_avatar.png')
-    if not os.path.exists(player_avatar_path):
-        print(f"Generating avatar for {player_name}...")
-        prompt = prompt_hub.avatar_prompt_template.format(name=player_name)
-        # Use existing player sprite or ref image? Usually avatar uses sprite. 
-        # But if we have sprite sheet, use that.
-        ref_for_avatar = [player_path] if os.path.exists(player_path) else []
-        
-        client.generate_content(
-            prompt,
-            images_path=ref_for_avatar,
-            output_path=player_avatar_path,
+    # Directional views (3 frames each) with STAND as condition
+    for prefix, template in (
+        ('right', prompt_hub.player_sprite_prompt_template_right),
+        ('up', prompt_hub.player_sprite_prompt_template_up),
+        ('down', prompt_hub.player_sprite_prompt_template_down),
+    ):
+        add_image_task(
+            f'player_{prefix}',
+            template.format(name=player_name, outfit=player_outfit),
+            [player_path],
+            os.path.join(assets_dir, f'temp_{prefix}.png'),
+            STRIP_STEPS,
+            deps=['player_stand'],
+            message=f"Generating {prefix} view for {player_name}...",
         )
-        remove_background(player_avatar_path)
-        crop_to_content(player_avatar_path)
+
+    # Avatar from the stand view
+    player_avatar_path = os.path.join(assets_dir, 'player_avatar.png')
+    add_image_task(
+        'player_avatar',
+        prompt_hub.avatar_prompt_template.format(name=player_name),
+        [player_path],
+        player_avatar_path,
+        AVATAR_STEPS,
+        deps=['player_stand'],
+        message=f"Generating avatar for {player_name}...",
+    )
 
     # 3b. Global NPC & Minion Generation
     npc_assets = {} # Map name -> {sprite, avatar}
-    
-    # Process NPCs
-    for npc_def in npc_list:
-        name = npc_def['name']
-        safe_name = "".join(x for x in name if x.isalnum())
-        sprite_filename = f"npc_{safe_name}.png"
-        avatar_filename = f"npc_{safe_name}_avatar.png"
-        
+
+    # Characters generated for other stories (.cache/characters) are reused or
+    # restyled instead of generated from scratch; new ones are added after the run
+    library = CharacterLibrary() if args.library != 'off' else None
+    library_candidates = []  # (name, outfit, kind, sprite_path, avatar_path)
+    library_used = []
+
+    def library_match(task_name, name, outfit, kind, sprite_path):
+        if library is None or outfit in PLACEHOLDER_OUTFITS:
+            return None
+        # A character this story already has keeps its sprite, unless it came from the library
+        entry = manifest.get(task_name)
+        from_library = bool(entry and isinstance(entry.get('result'), dict) and entry['result'].get('library'))
+        if os.path.exists(sprite_path) and not from_library:
+            return None
+        match, score = library.lookup(name, outfit, kind, threshold=args.library_threshold, exclude_story=storyname)
+        if match:
+            library_used.append(name)
+            print(f"Character library: {name} matches {match['name']} from '{match['story']}' ({score:.2f}), {args.library}")
+        return match
+
+    def add_copy_task(task_name, src, output_path, match, deps=()):
+        def run():
+            shutil.copy(src, output_path)
+            return {'library': match['id']}
+        return graph.add(
+            task_name, run, deps=deps, outputs=[output_path],
+            inputs=lambda: {'library': match['id'], 'source': file_hash(src)},
+        )
+
+    def add_sprite_task(name, outfit, sprite_filename, label='', kind='npc', avatar_filename=None):
+        # Returns (task name, library entry used or None)
+        task_name = f'sprite:{sprite_filename}'
         sprite_path = os.path.join(assets_dir, sprite_filename)
+        match = library_match(task_name, name, outfit, kind, sprite_path)
+        if match and args.library == 'reuse':
+            return add_copy_task(task_name, library.path(match['sprite']), sprite_path, match), match
+        avatar_path = os.path.join(assets_dir, avatar_filename) if avatar_filename else None
+        if outfit not in PLACEHOLDER_OUTFITS:
+            library_candidates.append((name, outfit, kind, sprite_path, avatar_path))
+        if match:
+            return add_image_task(
+                task_name,
+                prompt_hub.npc_restyle_prompt_template.format(name=name, outfit=outfit),
+                [library.path(match['sprite'])],
+                sprite_path,
+                SPRITE_STEPS,
+                message=f"Restyling sprite for {label}{name}...",
+                result={'library': match['id'], 'restyle': True},
+            ), match
+        return add_image_task(
+            task_name,
+            prompt_hub.npc_sprite_prompt_template.format(name=name, outfit=outfit),
+            ref_images,
+            sprite_path,
+            SPRITE_STEPS,
+            message=f"Generating sprite for {label}{name}...",
+        ), None
+
+    def add_npc_tasks(name, outfit, sprite_filename, avatar_filename):
+        sprite_task, match = add_sprite_task(name, outfit, sprite_filename, avatar_filename=avatar_filename)
         avatar_path = os.path.join(assets_dir, avatar_filename)
-        
-        # Generate Sprite
-        if not os.path.exists(sprite_path):
-            print(f"Generating sprite for {name}...")
-            prompt = prompt_hub.npc_sprite_prompt_template.format(
-                name=name,
-                outfit=npc_def.get('outfit', 'Standard clothes')
+        if match and args.library == 'reuse':
+            add_copy_task(f'avatar:{avatar_filename}', library.path(match['avatar']), avatar_path, match, deps=[sprite_task])
+        else:
+            add_image_task(
+                f'avatar:{avatar_filename}',
+                prompt_hub.avatar_prompt_template.format(name=name),
+                [os.path.join(assets_dir, sprite_filename)],
+                avatar_path,
+                AVATAR_STEPS,
+                deps=[sprite_task],
+                message=f"Generating avatar for {name}...",
             )
-            client.generate_content(prompt, images_path=ref_images, output_path=sprite_path)
-            remove_background(sprite_path)
-            
-        # Generate Avatar
-        if not os.path.exists(avatar_path):
-            print(f"Generating avatar for {name}...")
-            prompt = prompt_hub.avatar_prompt_template.format(name=name)
-            client.generate_content(
-                prompt,
-                images_path=[sprite_path],
-                output_path=avatar_path,
-            )
-            remove_background(avatar_path)
-            crop_to_content(avatar_path)
-            
         npc_assets[name] = {
             'sprite': sprite_filename,
             'avatar': avatar_filename
         }
 
+    # Process NPCs
+    for npc_def in npc_list:
+        name = npc_def['name']
+        if name in npc_assets:
+            continue
+        safe_name = "".join(x for x in name if x.isalnum())
+        add_npc_tasks(
+            name,
+            npc_def.get('outfit', 'Standard clothes'),
+            f"npc_{safe_name}.png",
+            f"npc_{safe_name}_avatar.png",
+        )
+
     # Process Minions (Single asset for all minions of same type)
     if minion_list:
         m_def = minion_list[0]
         m_name = m_def.get('name', 'Minion')
         safe_m_name = "".join(x for x in m_name if x.isalnum())
         m_sprite_filename = f"minion_{safe_m_name}.png"
-        m_path = os.path.join(assets_dir, m_sprite_filename)
-        
-        if not os.path.exists(m_path):
-            print(f"Generating sprite for minion {m_name}...")
-            prompt = prompt_hub.npc_sprite_prompt_template.format(
-                name=m_name,
-                outfit=m_def.get('outfit', 'Monster')
-            )
-            client.generate_content(prompt, images_path=ref_images, output_path=m_path)
-            remove_background(m_path)
-        
+        add_sprite_task(m_name, m_def.get('outfit', 'Monster'), m_sprite_filename, label='minion ', kind='minion')
+
         # Assign this asset to all minions in scenes
         for scene in scenes:
             if 'minions' in scene:
@@ -423,6 +419,46 @@ def main():
 
 
     # 3c. Process Scenes & Assign Assets
+    def ensure_background_size(scene_index, bg_path):
+        # Backgrounds from earlier runs: ensure 2560x1440 BEFORE coordinate generation.
+        # Only the header is read unless the image actually needs resizing.
+        from PIL import Image
+        if os.path.exists(bg_path):
+            try:
+                with Image.open(bg_path) as bg_img:
+                    size = bg_img.size
+                if size != BACKGROUND_SIZE:
+                    with open(bg_path, 'rb') as f:
+                        image_pool.process(f.read(), bg_path, [('resize', BACKGROUND_SIZE)])
+                    print(f"Resized background to 2560x1440 for Scene {scene_index}")
+            except Exception as e:
+                print(f"Failed to resize background for Scene {scene_index}: {e}")
+
+    def coordinates_prompt(local):
+        if args.obstacles == 'refine':
+            return prompt_hub.building_coordinates_refine_prompt_template.format(candidates=json.dumps(local))
+        return prompt_hub.building_coordinates_prompt_template
+
+    def generate_coordinates(scene_index, scene, bg_path):
+        if os.path.exists(bg_path):
+            print(f"Generating coordinates for Scene {scene_index}...")
+            # Colour/edge segmentation of the background: milliseconds, no request
+            local = detect_obstacles(bg_path, world_size=BACKGROUND_SIZE, keep_clear=TELEPORT_CLEARANCE)
+            scene['building_coordinates'] = local
+            if args.obstacles == 'local':
+                return local
+            with api_slots:
+                building_coords_json = client.describe_image(bg_path, coordinates_prompt(local))
+            try:
+                text = building_coords_json.strip()
+                if text.startswith('```json'): text = text[7:]
+                if text.endswith('```'): text = text[:-3]
+                scene['building_coordinates'] = json.loads(text.strip())
+            except (AttributeError, ValueError):
+                print(f"Failed to parse building coordinates for scene {scene_index}; using the local detection.")
+            # Returned so the build manifest can restore it on reruns
+            return scene['building_coordinates']
+
     for scene_index, scene in enumerate(scenes):
         print(f"Processing Scene {scene_index + 1}...")
         
@@ -430,95 +466,140 @@ def main():
         for i, npc in enumerate(scene.get('npc', [])):
             npc_name = npc['name']
             
-            # If mapped globally, use that.
-            if npc_name in npc_assets:
-                npc['sprite'] = npc_assets[npc_name]['sprite']
-                npc['avatar'] = npc_assets[npc_name]['avatar']
-            else:
-                # Fallback generation for undefined NPCs
+            # Fallback generation for undefined NPCs (first scene they appear in)
+            if npc_name not in npc_assets:
                 safe_name = "".join(x for x in npc_name if x.isalnum())
-                sprite_filename = f"npc_{safe_name}_{scene_index}.png"
-                avatar_filename = f"npc_{safe_name}_{scene_index}_avatar.png"
-                sprite_path = os.path.join(assets_dir, sprite_filename)
-                avatar_path = os.path.join(assets_dir, avatar_filename)
-                
-                if not os.path.exists(sprite_path):
-                    print(f"Generating sprite for {npc_name} (Scene Specific)...")
-                    prompt = prompt_hub.npc_sprite_prompt_template.format(name=npc_name, outfit="Standard period appropriate clothing")
-                    # Pass ref_images here too
-                    client.generate_content(prompt, images_path=ref_images, output_path=sprite_path)
-                    remove_background(sprite_path)
-                
-                if not os.path.exists(avatar_path):
-                    print(f"Generating avatar for {npc_name}...")
-                    prompt = prompt_hub.avatar_prompt_template.format(name=npc_name)
-                    client.generate_content(prompt, images_path=[sprite_path], output_path=avatar_path)
-                    remove_background(avatar_path)
-                    crop_to_content(avatar_path)
-                
-                npc['sprite'] = sprite_filename
-                npc['avatar'] = avatar_filename
-                
-                # Add to local cache 
-                npc_assets[npc_name] = {'sprite': sprite_filename, 'avatar': avatar_filename}
+                add_npc_tasks(
+                    npc_name,
+                    FALLBACK_NPC_OUTFIT,
+                    f"npc_{safe_name}_{scene_index}.png",
+                    f"npc_{safe_name}_{scene_index}_avatar.png",
+                )
+
+            npc['sprite'] = npc_assets[npc_name]['sprite']
+            npc['avatar'] = npc_assets[npc_name]['avatar']
 
         # Location / Background for this scene
         bg_filename = f"background_scene_{scene_index}.png"
         bg_path = os.path.join(assets_dir, bg_filename)
         scene['background_image'] = bg_filename 
 
-        if not os.path.exists(bg_path):
-            print(f"Generating background for Scene {scene_index}...")
-            prompt = prompt_hub.floor_prompt_template.format(location_description=scene['location'])
-            
-            response = client.client.models.generate_content(
-                model="gemini-3-pro-image-preview",
-                config=types.GenerateContentConfig(
-                    response_modalities=["TEXT", "IMAGE"],
-                     image_config=types.ImageConfig(
-                        aspect_ratio="16:9",
-                        image_size="2K"
-                    )
-                ),
-                contents=[prompt]
+        # Resized to 2560x1440 before the single encode, ahead of coordinate generation
+        bg_task = add_image_task(
+            f'background:{scene_index}',
+            prompt_hub.floor_prompt_template.format(location_description=scene['location']),
+            [],
+            bg_path,
+            BACKGROUND_STEPS,
+            message=f"Generating background for Scene {scene_index}...",
+            aspect_ratio="16:9",
+            image_size="2K",
+        )
+        size_task = graph.add(
+            f'background_size:{scene_index}',
+            lambda scene_index=scene_index, bg_path=bg_path: ensure_background_size(scene_index, bg_path),
+            deps=[bg_task],
+        )
+        # Coordinate Generation (Always check if missing); reused while the background is unchanged
+        if 'building_coordinates' not in scene or not scene['building_coordinates']:
+            graph.add(
+                f'coordinates:{scene_index}',
+                lambda scene_index=scene_index, scene=scene, bg_path=bg_path: generate_coordinates(scene_index, scene, bg_path),
+                deps=[size_task],
+                inputs=lambda bg_path=bg_path: {
+                    'mode': args.obstacles,
+                    'prompt': None if args.obstacles == 'local' else coordinates_prompt([]),
+                    'images': [file_hash(bg_path)],
+                },
             )
-            
-            for part in response.parts:
-                if part.inline_data:
-                    image = part.as_image()
-                    image.save(bg_path)
 
-        # Ensure 2560x1440 BEFORE coordinate generation
-        if os.path.exists(bg_path):
-            try:
-                bg_img = Image.open(bg_path).convert("RGBA")
-                if bg_img.size != (2560, 1440):
-                    bg_img = bg_img.resize((2560, 1440), Image.NEAREST)
-                    bg_img.save(bg_path)
-                    print(f"Resized background to 2560x1440 for Scene {scene_index}")
-            except Exception as e:
-                print(f"Failed to resize background for Scene {scene_index}: {e}")
-            
-        # Coordinate Generation (Always check if missing)
-        if 'building_coordinates' not in scene or not scene['building_coordinates']:
-            if os.path.exists(bg_path):
-                print(f"Generating coordinates for Scene {scene_index}...")
-                building_coords_json = client.describe_image(bg_path, prompt_hub.building_coordinates_prompt_template)
-                try:
-                    text = building_coords_json.strip()
-                    if text.startswith('```json'): text = text[7:]
-                    if text.endswith('```'): text = text[:-3]
-                    scene['building_coordinates'] = json.loads(text.strip())
-                except:
-                    print(f"Failed to parse building coordinates for scene {scene_index}.")
-                    scene['building_coordinates'] = []
+    progress.stage('generate_assets')
+    with span('generate_assets', 'stage', tasks=len(graph.tasks)):
+        results = graph.run()
+
+    for scene_index, scene in enumerate(scenes):
+        if results.get(f'coordinates:{scene_index}') is not None:
+            scene['building_coordinates'] = results[f'coordinates:{scene_index}']
+
+    if library is not None:
+        for name, outfit, kind, sprite_path, avatar_path in library_candidates:
+            library.add(name, outfit, kind, sprite_path, avatar_path, story=storyname)
+        print(f"Character library: {len(library_used)} characters from other stories, {len(library)} in the library")
+
+    # Validated, clamped and merged obstacles plus the tile grid / cell index that
+    # game.js uses for collision and spawn checks
+    progress.stage('build_collision')
+    with span('build_collision', 'stage'):
+        for scene_index, scene in enumerate(scenes):
+            scene['building_coordinates'], scene['collision'], stats = build_collision(scene.get('building_coordinates'))
+            fixed = {k: v for k, v in stats.items() if k != 'input' and v}
+            if fixed:
+                print(f"Scene {scene_index} obstacles: {len(scene['building_coordinates'])} of {stats['input']} kept ({', '.join(f'{k} {v}' for k, v in fixed.items())})")
+
+    # 4. Web optimization: WebP backgrounds and one texture atlas for sprites/avatars
+    if not args.no_optimize:
+        progress.stage('optimize_game_assets')
+        with span('optimize_game_assets', 'stage'):
+            optimize_game_assets(assets_dir, scenes)
         
     # Save updated data
+    progress.stage('write_game')
     if len(scenes) > 0:
         scenes[0]['player'] = player_data
 
     with open(os.path.join(game_dir, 'game_data.json'), 'w', encoding='utf-8') as f:
         json.dump(scenes, f, ensure_ascii=False, indent=4) # Dump SCENES list to game_data.json
 
+    # Content-hashed copies of everything game.js loads, mapped from the names in
+    # game_data.json by asset_manifest.json; a BGM finished later is added then
+    with span('publish_assets', 'stage'):
+        assets = AssetManifest(game_dir, base_dir)
+        assets.publish_all(scenes)
+    if bgm_track is not None:
+        def publish_bgm(track):
+            if track.ok:
+                assets.publish('bgm.mp3')
+            else:
+                # bgm.mp3 is a copy of default_BGM.mp3, already published to shared/
+                assets.alias('bgm.mp3', 'default_BGM.mp3')
+            assets.save()
+            assets.remove_stale()
+        bgm_track.add_done_callback(publish_bgm)
+
+    # gzip/brotli variants for server.py to send by Accept-Encoding
+    with span('precompress', 'stage'):
+        precompress_game(game_dir)
+
+    # Music never holds up the game: wait only until --bgm-deadline, then leave the
+    # thread to swap bgm.mp3 in when it is done
+    if bgm_track is not None:
+        remaining = args.bgm_deadline - (time.monotonic() - bgm_started)
+        if not bgm_track.wait(max(0.0, remaining)):
+            print("BGM is still being composed; the game plays default_BGM.mp3 until bgm.mp3 is ready.")
+    progress.finish(game_dir)
+    print(f"{READY_MARKER} {game_dir}")
+
+    if client.cache is not None:
+        stats = client.cache.stats()
+        print(f"Generation cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries ({stats['bytes'] / (1024 * 1024):.1f} MB)")
+
+    # Chrome trace (chrome://tracing or ui.perfetto.dev) next to game_data.json
+    if save_trace:
+        trace_path = os.path.join(game_dir, 'trace.json')
+        tracer.save(trace_path, metadata={'story': storyname or story_filename})
+        tracer.print_summary()
+        print(f"Trace written to {trace_path}")
+
+    counts = {}
+    for task in graph.tasks.values():
+        if task.outputs:
+            counts[task.status] = counts.get(task.status, 0) + 1
+    return {
+        'story': storyname or story_filename,
+        'game_dir': game_dir,
+        'assets_built': counts.get('done', 0),
+        'assets_skipped': counts.get('skipped', 0),
+    }
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,206 @@
+import os
+import json
+# Pillow is imported inside the functions that use it, so importing main.py stays fast
+from instrument import traced, annotate
+
+ATLAS_MAX_SIZE = 4096
+ATLAS_PADDING = 2
+# Dialogue avatars are drawn at 140x140 in game.js; keep 2x for HiDPI screens
+AVATAR_SIZE = 280
+BACKGROUND_QUALITY = 85
+# A frame keeps its 256-colour palette version only if the mean RGB RMS error
+# (0-255) stays below this; smooth-shaded portraits band above it and stay RGBA
+PALETTE_MAX_ERROR = 4.0
+
+@traced('optimize')
+def encode_background_webp(png_path, quality=BACKGROUND_QUALITY):
+    """
+    Writes a lossy WebP copy of a background next to the PNG and returns its filename.
+    The PNG is kept: the pipeline (resume checks, describe_image) still uses it.
+    """
+    from PIL import Image
+    webp_path = os.path.splitext(png_path)[0] + '.webp'
+    if not os.path.exists(webp_path) or os.path.getmtime(webp_path) < os.path.getmtime(png_path):
+        img = Image.open(png_path).convert("RGB")
+        img.save(webp_path, 'WEBP', quality=quality, method=6)
+        annotate(bytes=os.path.getsize(webp_path))
+        print(f"Encoded {os.path.basename(webp_path)} ({os.path.getsize(png_path) // 1024} KB -> {os.path.getsize(webp_path) // 1024} KB)")
+    return os.path.basename(webp_path)
+
+def _trim(img):
+    """
+    Crops to the non-transparent area. Returns (cropped, (x, y)) where (x, y) is
+    the offset of the crop inside the original image.
+    """
+    bbox = img.getbbox()
+    if not bbox:
+        return img, (0, 0)
+    return img.crop(bbox), (bbox[0], bbox[1])
+
+def _palette_error(original, quantized):
+    """
+    Mean RGB RMS error (0-255) of a palette version, with both images composited on
+    black so the colour of fully transparent pixels does not count.
+    """
+    from PIL import Image, ImageChops, ImageStat
+    black = Image.new("RGBA", original.size, (0, 0, 0, 255))
+    diff = ImageChops.difference(Image.alpha_composite(black, original),
+                                 Image.alpha_composite(black, quantized.convert("RGBA")))
+    return sum(ImageStat.Stat(diff).rms[:3]) / 3
+
+def _quantize(img):
+    from PIL import Image
+    return img.quantize(colors=256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+
+def _quantize_frame(img, max_error=PALETTE_MAX_ERROR):
+    """
+    Reduces one frame to its own 256-colour palette (alpha kept) when that is
+    visually lossless. Returns (image, quantized): the RGBA result and whether
+    the palette version was used.
+    """
+    quantized = _quantize(img)
+    if _palette_error(img, quantized) > max_error:
+        return img, False
+    return quantized.convert("RGBA"), True
+
+def _frame_box(entry):
+    f = entry['frame']
+    return (f['x'], f['y'], f['x'] + f['w'], f['y'] + f['h'])
+
+def _shelf_pack(sizes, max_width):
+    """
+    Simple shelf packer: tallest first, left to right, new shelf when a row is full.
+    Returns ({index: (x, y)}, width, height) for the items that fit in max_width x max_width.
+    """
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i][1], reverse=True)
+    positions = {}
+    x = y = shelf_h = used_w = 0
+    for i in order:
+        w, h = sizes[i][0] + ATLAS_PADDING, sizes[i][1] + ATLAS_PADDING
+        if x + w > max_width:
+            x, y, shelf_h = 0, y + shelf_h, 0
+        if w > max_width or y + h > max_width:
+            continue
+        positions[i] = (x, y)
+        x += w
+        shelf_h = max(shelf_h, h)
+        used_w = max(used_w, x)
+    return positions, used_w, y + shelf_h
+
+@traced('optimize')
+def build_atlas(assets_dir, entries, atlas_name='atlas', max_size=ATLAS_MAX_SIZE):
+    """
+    Packs images into one PNG plus a Phaser JSON-hash frame map. Frames are
+    palette-quantized on their own when that is visually lossless, and the atlas
+    gets one shared palette if no frame bands under it (PALETTE_MAX_ERROR).
+    entries: list of (filename, options) where options may set 'trim' (default True)
+    and 'max_side' (downscale so the longer side is at most this many pixels).
+    Returns the list of filenames that made it into the atlas (empty if none).
+    """
+    from PIL import Image
+    frames = []
+    for filename, options in entries:
+        path = os.path.join(assets_dir, filename)
+        if not os.path.exists(path):
+            continue
+        img = Image.open(path).convert("RGBA")
+        max_side = options.get('max_side')
+        if max_side and max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        source_size = img.size
+        if options.get('trim', True):
+            img, offset = _trim(img)
+        else:
+            offset = (0, 0)
+        img, quantized = _quantize_frame(img)
+        if not quantized:
+            print(f"Keeping {filename} in full colour in the atlas")
+        frames.append((filename, img, offset, source_size))
+
+    if not frames:
+        return []
+
+    positions, width, height = _shelf_pack([f[1].size for f in frames], max_size)
+    atlas = Image.new("RGBA", (max(width, 1), max(height, 1)), (0, 0, 0, 0))
+    frame_map = {}
+    packed = []
+    for i, (filename, img, offset, source_size) in enumerate(frames):
+        if i not in positions:
+            print(f"Atlas full, keeping {filename} as a separate file")
+            continue
+        x, y = positions[i]
+        atlas.paste(img, (x, y))
+        w, h = img.size
+        frame_map[filename] = {
+            'frame': {'x': x, 'y': y, 'w': w, 'h': h},
+            'rotated': False,
+            'trimmed': (w, h) != source_size,
+            'spriteSourceSize': {'x': offset[0], 'y': offset[1], 'w': w, 'h': h},
+            'sourceSize': {'w': source_size[0], 'h': source_size[1]},
+        }
+        packed.append(filename)
+
+    # One shared palette shrinks the PNG several times, but only if every frame
+    # survives it; otherwise the atlas is saved as RGBA with its per-frame palettes.
+    image_name = f'{atlas_name}.png'
+    quantized = _quantize(atlas)
+    shared = quantized.convert("RGBA")
+    banded = []
+    for filename in packed:
+        box = _frame_box(frame_map[filename])
+        if _palette_error(atlas.crop(box), shared.crop(box)) > PALETTE_MAX_ERROR:
+            banded.append(filename)
+    if banded:
+        print(f"Saving {image_name} as RGBA: a shared palette would band {', '.join(banded)}")
+        quantized = atlas
+    quantized.save(os.path.join(assets_dir, image_name), optimize=True)
+
+    with open(os.path.join(assets_dir, f'{atlas_name}.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'frames': frame_map,
+            'meta': {'image': image_name, 'size': {'w': atlas.width, 'h': atlas.height}, 'format': 'RGBA8888', 'scale': 1},
+        }, f, ensure_ascii=False, indent=4)
+    annotate(bytes=os.path.getsize(os.path.join(assets_dir, image_name)), frames=len(packed))
+    print(f"Packed {len(packed)} images into {image_name} ({atlas.width}x{atlas.height})")
+    return packed
+
+def optimize_game_assets(assets_dir, scenes):
+    """
+    Post-generation web optimization for one game. Encodes backgrounds as WebP and
+    packs the player strips, avatars, NPC and minion sprites into a texture atlas.
+    Updates the scene dicts in place (background_image, scenes[0]['atlas']) so
+    game.js loads the optimized files; originals are left untouched.
+    """
+    if not scenes:
+        return
+
+    for scene in scenes:
+        bg = scene.get('background_image')
+        if bg and bg.endswith('.png') and os.path.exists(os.path.join(assets_dir, bg)):
+            scene['background_image'] = encode_background_webp(os.path.join(assets_dir, bg))
+
+    entries = [
+        ('temp_down.png', {'trim': False}),
+        ('temp_up.png', {'trim': False}),
+        ('temp_right.png', {'trim': False}),
+        ('player_avatar.png', {'max_side': AVATAR_SIZE}),
+    ]
+    seen = set(name for name, _ in entries)
+    for scene in scenes:
+        for npc in scene.get('npc', []):
+            for key, options in (('sprite', {}), ('avatar', {'max_side': AVATAR_SIZE})):
+                name = npc.get(key)
+                if name and name not in seen:
+                    seen.add(name)
+                    entries.append((name, options))
+        for m in scene.get('minions', []):
+            name = m.get('sprite')
+            if name and name not in seen:
+                seen.add(name)
+                entries.append((name, {}))
+
+    packed = build_atlas(assets_dir, entries)
+    if packed:
+        scenes[0]['atlas'] = {'image': 'atlas.png', 'data': 'atlas.json', 'frames': packed}
+    else:
+        scenes[0].pop('atlas', None)
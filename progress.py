@@ -0,0 +1,78 @@
+import os
+import json
+import time
+import threading
+
+# Prefix of the event lines main.py prints with --progress; jobs.py turns them into job events
+PROGRESS_MARKER = '__PROGRESS__'
+# Printed by main.py once game_data.json is written; jobs.py marks the job as done on
+# it even if the background music is still being composed
+READY_MARKER = '__GAME_READY__'
+# Share of a whole run taken by each stage, for the overall percent
+STAGE_WEIGHTS = {
+    'setup': 2,
+    'extract_story': 15,
+    'generate_assets': 73,
+    'build_collision': 2,
+    'optimize_game_assets': 6,
+    'write_game': 2,
+}
+
+class ProgressReporter:
+    """
+    Structured progress of one generate_game run. Each event is printed as
+    PROGRESS_MARKER + one JSON object: the stage, the asset that just finished,
+    the overall percent, an ETA for the asset stage (from the rate assets have been
+    built so far) and the bytes of finished assets. A disabled reporter prints nothing.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.started = time.monotonic()
+        self.current = None
+        self.stage_started = self.started
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def percent(self, stage, fraction):
+        stages = list(STAGE_WEIGHTS)
+        before = sum(STAGE_WEIGHTS[s] for s in stages[:stages.index(stage)]) if stage in STAGE_WEIGHTS else 0
+        total = sum(STAGE_WEIGHTS.values())
+        return round(100 * (before + STAGE_WEIGHTS.get(stage, 0) * fraction) / total, 1)
+
+    def emit(self, **event):
+        if not self.enabled:
+            return
+        event = dict({'stage': self.current, 'bytes': self.bytes}, **event)
+        event['elapsed'] = round(time.monotonic() - self.started, 1)
+        print(PROGRESS_MARKER + json.dumps(event, ensure_ascii=False), flush=True)
+
+    def stage(self, name):
+        with self._lock:
+            self.current = name
+            self.stage_started = time.monotonic()
+        self.emit(stage=name, percent=self.percent(name, 0.0))
+
+    def task_finished(self, task, finished, total, built):
+        """
+        TaskGraph on_finish callback: one event per asset task that completed,
+        was up to date, failed or was cancelled.
+        """
+        if task.status == 'done':
+            self.bytes += sum(os.path.getsize(p) for p in task.outputs if os.path.exists(p))
+        eta = None
+        remaining = total - finished
+        if built and remaining:
+            elapsed = time.monotonic() - self.stage_started
+            eta = round(elapsed / built * remaining, 1)
+        self.emit(
+            asset=task.name,
+            status=task.status,
+            done=finished,
+            total=total,
+            percent=self.percent(self.current, finished / total if total else 1.0),
+            eta=eta if remaining else 0,
+        )
+
+    def finish(self, game_dir):
+        self.bytes = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(game_dir) for f in files)
+        self.emit(stage='ready', percent=100.0, eta=0)
@@ -124,6 +124,18 @@ Background: Pure white background (for transparency).
 Requirment:1.No other objects or text,  2.don't use pure white pixel in character.
 '''
 
+npc_restyle_prompt_template = '''
+Redraw the character in the reference image as a single pixel art character sprite for a 2D RPG game.
+Keep the character's face, build and colours recognizable, but fit them to this story.
+View: Full body, side-view.
+Image size: 128x128 pixels.
+Style:"Semi-realistic anime," "Manhua style," "Digital oil painting," "High-fidelity game splash art."
+Character: {name}
+Outfit: {outfit}
+Background: Pure white background (for transparency).
+Requirment:1.No other objects or text,  2.don't use pure white pixel in character.
+'''
+
 avatar_prompt_template = '''
 Generate a pixel art character portrait/avatar for a dialogue box.
 View: Close-up of the head and shoulders, facing slightly towards the viewer.
@@ -159,4 +171,21 @@ w (Width): How wide the obstacle is in pixels.
 h (Height): How tall the obstacle is in pixels.
 Each obstacle must be inside the world bounds and not overlap outside, no more than 5 buildings.
 No extra text.only json content
-'''
\ No newline at end of file
+'''
+building_coordinates_refine_prompt_template = '''
+These obstacle rectangles were detected automatically on this 2D RPG map background (2560 x 1440):
+{candidates}
+Correct them so they cover the buildings and other large non-walkable areas of the image: adjust, remove or add rectangles. only json content
+output format: a list of {{"x": number, "y": number, "w": number, "h": number}}
+x, y: top-left corner in pixels (0, 0 is the top-left of the map). w, h: width and height in pixels.
+Each obstacle must be inside the world bounds, no more than 8 obstacles.
+No extra text.only json content
+'''
+chunk_prompt_template = '''
+<chunk>
+The story is long, so it is processed in parts. This is part {index} of {total}.
+The text inside <previous_context> is the end of the previous part. It is only there for continuity: do not extract scenes, characters or dialogue from it.
+Extract scenes, NPCs, minions and dialogue only from the text inside <current_part>.
+Keep the same player character for every part of the story.
+</chunk>
+'''
@@ -0,0 +1,188 @@
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from instrument import span
+
+class BuildManifest:
+    """
+    Make-style record of what each task was last built from, saved as JSON.
+    For every task name it stores a fingerprint of the task's inputs (prompt text,
+    options, hashes of reference and upstream images...), its outputs and, for
+    tasks that produce data rather than files, the JSON-serializable result.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f).get('tasks', {})
+            except (json.JSONDecodeError, OSError) as e:
+                print(f"Ignoring unreadable build manifest {path}: {e}")
+
+    @staticmethod
+    def fingerprint(inputs):
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def get(self, name):
+        with self._lock:
+            return self.entries.get(name)
+
+    def record(self, name, fingerprint, outputs=(), result=None):
+        entry = {'inputs': fingerprint, 'outputs': [os.path.basename(p) for p in outputs]}
+        if result is not None:
+            entry['result'] = result
+        with self._lock:
+            self.entries[name] = entry
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'tasks': self.entries}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+class Task:
+    def __init__(self, name, func, deps=(), outputs=(), inputs=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.outputs = list(outputs)
+        self.inputs = inputs
+        self.fingerprint = None
+        self.result = None
+        self.error = None
+        self.status = 'pending'  # pending -> running -> done / skipped / failed
+
+    def is_up_to_date(self, manifest=None):
+        """
+        Without a manifest (or inputs), a task with outputs is considered done when
+        all of them already exist (the resume rule main.py always used).
+        With both, it is done when its recorded input fingerprint still matches and
+        its outputs exist. Called once the dependencies have finished, so inputs
+        that hash upstream files see their rebuilt versions. Existing outputs with no
+        manifest entry (games generated before the manifest) are adopted as built.
+        """
+        outputs_exist = all(os.path.exists(p) for p in self.outputs)
+        if manifest is None or self.inputs is None:
+            return bool(self.outputs) and outputs_exist
+        try:
+            self.fingerprint = manifest.fingerprint(self.inputs())
+        except Exception as e:
+            print(f"Rebuilding {self.name}: could not read its inputs ({e})")
+            return False
+        entry = manifest.get(self.name)
+        if entry is None:
+            if self.outputs and outputs_exist:
+                manifest.record(self.name, self.fingerprint, self.outputs)
+                return True
+            return False
+        if entry['inputs'] != self.fingerprint or not outputs_exist:
+            print(f"Rebuilding {self.name}: inputs changed" if outputs_exist else f"Rebuilding {self.name}: output missing")
+            return False
+        if 'result' in entry:
+            self.result = entry['result']
+        elif not self.outputs:
+            return False
+        return True
+
+class TaskGraph:
+    """
+    Dependency-aware task runner. Independent tasks run concurrently on a thread
+    pool; a task starts only after all of its dependencies have finished.
+    With a BuildManifest, tasks that declare inputs are rebuilt only when those
+    inputs changed since the last successful run (see Task.is_up_to_date).
+    on_finish(task, finished, total, built) is called from run() every time a task
+    is done, skipped, failed or cancelled (see progress.ProgressReporter).
+    """
+    def __init__(self, max_workers=4, manifest=None, on_finish=None):
+        self.max_workers = max(1, int(max_workers))
+        self.manifest = manifest
+        self.on_finish = on_finish
+        self.tasks = {}
+
+    def add(self, name, func, deps=(), outputs=(), inputs=None):
+        """
+        inputs: optional callable returning a JSON-serializable description of
+        everything the task's output depends on; evaluated when the task is ready.
+        """
+        if name in self.tasks:
+            raise ValueError(f"Duplicate task name: {name}")
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dep}")
+        self.tasks[name] = Task(name, func, deps, outputs, inputs)
+        return name
+
+    def _run_task(self, task):
+        task.status = 'running'
+        with span(task.name, 'task'):
+            task.result = task.func()
+        if self.manifest is not None and task.fingerprint is not None:
+            self.manifest.record(task.name, task.fingerprint, task.outputs, task.result)
+        return task.result
+
+    def run(self):
+        """
+        Runs every task and returns {name: result}. Tasks whose dependencies failed
+        are not started. If anything failed, the first error is re-raised after all
+        other runnable tasks have finished.
+        """
+        remaining = dict(self.tasks)
+        running = {}
+        first_error = None
+        counts = {'finished': 0, 'built': 0}
+
+        def report(task):
+            counts['finished'] += 1
+            if task.status == 'done':
+                counts['built'] += 1
+            if self.on_finish is not None:
+                self.on_finish(task, counts['finished'], len(self.tasks), counts['built'])
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while remaining or running:
+                for name in list(remaining):
+                    task = remaining[name]
+                    dep_status = [self.tasks[d].status for d in task.deps]
+                    if any(s in ('failed', 'cancelled') for s in dep_status):
+                        task.status = 'cancelled'
+                        print(f"Skipping {name}: a dependency failed.")
+                        del remaining[name]
+                        report(task)
+                        continue
+                    if not all(s in ('done', 'skipped') for s in dep_status):
+                        continue
+                    del remaining[name]
+                    if task.is_up_to_date(self.manifest):
+                        task.status = 'skipped'
+                        report(task)
+                        continue
+                    running[pool.submit(self._run_task, task)] = task
+
+                if not running:
+                    if remaining:
+                        # Only reachable when tasks are waiting on each other.
+                        raise RuntimeError(f"Unresolvable task dependencies: {sorted(remaining)}")
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = running.pop(future)
+                    try:
+                        future.result()
+                        task.status = 'done'
+                    except Exception as e:
+                        task.status = 'failed'
+                        task.error = e
+                        print(f"Task {task.name} failed: {e}")
+                        if first_error is None:
+                            first_error = e
+                    report(task)
+
+        if first_error is not None:
+            raise first_error
+        return {name: task.result for name, task in self.tasks.items()}
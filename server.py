@@ -2,147 +2,290 @@ import http.server
 import socketserver
 import os
 import json
-import subprocess
-import sys
+import time
+import argparse
+from urllib.parse import urlparse, parse_qs
+from jobs import JobManager, JobConflict, result_payload
+from catalog import GameCatalog
+from uploads import StoryUpload, UploadError, receive
+from static_files import static_response
 
 PORT = 8000
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Maximum number of generation jobs (main.py processes) running at once
+MAX_JOBS = int(os.getenv('RPG_MAX_JOBS', '2'))
+# Comment line sent on idle event streams so proxies keep them open and dead clients are noticed
+SSE_KEEPALIVE_SECONDS = 15
+
+job_manager = JobManager(BASE_DIR, max_workers=MAX_JOBS)
+catalog = GameCatalog(BASE_DIR)
+
+# Route logic shared by the threaded handler below and async_server.
+
+def games_response(url, if_none_match=None):
+    """
+    /api/games from the cached catalog. Supports ?offset=&limit= and If-None-Match.
+    Returns (status, headers, body).
+    """
+    query = parse_qs(url.query)
+    offset = query.get('offset', [None])[0]
+    limit = query.get('limit', [None])[0]
+    return catalog.response(offset, limit, if_none_match)
+
+def on_job_update(job):
+    # Pick up a finished game without waiting for the next directory rescan
+    if job['status'] in ('succeeded', 'failed'):
+        catalog.update_game(job['project_name'])
+
+def new_upload(headers, url):
+    """
+    Starts parsing a POST /api/generate body (see uploads.StoryUpload); the story
+    is streamed into the jobs directory. headers is a {lowercase name: value} dict.
+    """
+    return StoryUpload(headers, parse_qs(url.query), job_manager.jobs_dir)
+
+def submit_generation(project_name, story_path):
+    """
+    Queues a generation job for an uploaded story file. Returns (status, payload);
+    409 if the project is already being generated.
+    """
+    try:
+        job = job_manager.submit(project_name, story_path)
+    except JobConflict as e:
+        if os.path.exists(story_path):
+            os.remove(story_path)
+        print(f"Rejected generation: {e}")
+        return 409, {'error': str(e), 'job_id': e.job_id, 'events_url': f"/api/jobs/{e.job_id}/events"}
+    print(f"Queued generation for {project_name} (job {job['id']})")
+    return 202, {
+        'job_id': job['id'],
+        'status': job['status'],
+        'project_name': project_name,
+        'game_path': job['game_path'],
+        'status_url': f"/api/jobs/{job['id']}",
+        'stream_url': f"/api/jobs/{job['id']}/stream",
+        'events_url': f"/api/jobs/{job['id']}/events",
+    }
+
+def upload_failed(upload, error):
+    """
+    Cleans up after a rejected upload. Returns (status, payload).
+    """
+    if upload is not None:
+        upload.discard()
+    print(f"Rejected story upload: {error}")
+    return getattr(error, 'status', 400), {'error': str(error)}
+
+def route_jobs(url):
+    """
+    Resolves a /api/jobs URL. Returns (route, status, payload); route is 'stream'
+    or 'events' (payload is the job) when the caller should stream the job log or
+    its events, else 'json'.
+    """
+    if url.path == '/api/jobs':
+        return 'json', 200, job_manager.list()
+
+    parts = url.path[len('/api/jobs/'):].split('/')
+    job = job_manager.get(parts[0])
+    if job is None:
+        return 'json', 404, {'error': 'job not found'}
+    if len(parts) == 2 and parts[1] in ('stream', 'events'):
+        return parts[1], 200, job
+    if len(parts) == 1:
+        # Polling: return job state plus any log output after ?offset=N
+        try:
+            offset = max(0, int(parse_qs(url.query).get('offset', ['0'])[0]))
+        except ValueError:
+            offset = 0
+        log, offset = job_manager.read_log(job['id'], offset)
+        return 'json', 200, {'job': job, 'log': log, 'offset': offset}
+    return 'json', 404, {'error': 'not found'}
+
+def job_result(job):
+    # Final line of a plain-text job stream, after the __JSON_RESULT__ marker
+    return "\n__JSON_RESULT__" + json.dumps(result_payload(job))
+
+def last_event_id(url, header):
+    """
+    Where an event stream resumes: the Last-Event-ID header EventSource sends when
+    it reconnects, or ?last_event_id= for a fresh connection (e.g. after a reload).
+    """
+    value = header or parse_qs(url.query).get('last_event_id', ['0'])[0]
+    try:
+        return max(0, int(value))
+    except ValueError:
+        return 0
+
+def job_events(job_id, last_id):
+    """
+    Next part of a job's event stream. Returns (data, last_id, done): the SSE frames
+    after last_id as one bytes object, the id of the last one, and whether the
+    stream is complete (the job's result event has been sent).
+    """
+    events = job_manager.events(job_id)
+    frames, last_id = events.read(last_id)
+    done = events.result_id is not None and last_id >= events.result_id
+    return b''.join(frames), last_id, done
 
 class RPGRequestHandler(http.server.SimpleHTTPRequestHandler):
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def do_GET(self):
         if self.path == '/':
-            self.path = '/home.html'
-            return super().do_GET()
-        
-        if self.path == '/api/games':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
+            return self.send_static('/home.html')
+
+        url = urlparse(self.path)
+        if url.path == '/api/games':
+            status, headers, body = games_response(url, self.headers.get('If-None-Match'))
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            
-            games = []
-            # Scan for folders containing index.html
-            try:
-                for item in os.listdir(BASE_DIR):
-                    item_path = os.path.join(BASE_DIR, item)
-                    if os.path.isdir(item_path):
-                        # Hidden folders or 'game' template
-                        if item == 'game' or item.startswith('.'):
-                            continue
-                        
-                        if os.path.exists(os.path.join(item_path, 'index.html')):
-                            # Use modification time as a sort key
-                            mtime = os.path.getmtime(item_path)
-                            games.append({
-                                'name': item,
-                                'path': f'/{item}/index.html',
-                                'mtime': mtime
-                            })
-            except Exception as e:
-                print(f"Error listing games: {e}")
-
-            # Sort by newest first
-            games.sort(key=lambda x: x['mtime'], reverse=True)
-            
-            self.wfile.write(json.dumps(games).encode())
+            self.wfile.write(body)
             return
 
-        return super().do_GET()
+        if url.path == '/api/jobs' or url.path.startswith('/api/jobs/'):
+            route, status, payload = route_jobs(url)
+            if route == 'stream':
+                return self.stream_job(payload['id'])
+            if route == 'events':
+                return self.stream_events(payload['id'], last_event_id(url, self.headers.get('Last-Event-ID')))
+            return self.send_json(payload, status)
 
-    def do_POST(self):
-        if self.path == '/api/generate':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            
-            try:
-                data = json.loads(post_data.decode('utf-8'))
-                story_text = data.get('story', '')
-                project_name = data.get('name', 'new_story')
-                
-                # Sanitize project name
-                project_name = "".join(x for x in project_name if x.isalnum() or x in ('_', '-'))
-                if not project_name: project_name = "generated_game"
-
-                # Save story
-                story_filename = f"{project_name}.txt"
-                story_path = os.path.join(BASE_DIR, story_filename)
-                with open(story_path, 'w', encoding='utf-8') as f:
-                    f.write(story_text)
-                
-                print(f"Starting generation for {project_name}...")
-                
-                # Send immediate headers for streaming
-                self.send_response(200)
-                self.send_header('Content-type', 'text/plain; charset=utf-8')
-                self.send_header('Transfer-Encoding', 'chunked')
-                self.send_header('X-Content-Type-Options', 'nosniff')
-                self.end_headers()
-
-                # Helper to send chunk
-                def send_chunk(text):
-                    if not text: return
-                    b = text.encode('utf-8')
-                    self.wfile.write(f"{len(b):X}\r\n".encode('utf-8'))
-                    self.wfile.write(b)
-                    self.wfile.write(b"\r\n")
-                    self.wfile.flush()
+        return self.send_static(url.path)
 
-                # Send initial status
-                send_chunk("Initializing generation process...\n")
-                
-                # Padding to force browser buffer flush (some browsers wait for 1KB)
-                send_chunk(" " * 1024 + "\n") 
-
-                cmd = [sys.executable, '-u', 'main.py', '--storyname', project_name]
-                
-                process = subprocess.Popen(
-                    cmd, 
-                    cwd=BASE_DIR, 
-                    stdout=subprocess.PIPE, 
-                    stderr=subprocess.PIPE, 
-                    text=True,
-                    encoding='utf-8',
-                    bufsize=1, 
-                    universal_newlines=True
-                )
-
-                # Stream stdout
-                for line in process.stdout:
-                    print(line, end='') # Console
-                    send_chunk(line)
-                
-                # Read stderr (after stdout closes)
-                stderr_output = process.stderr.read()
-                if stderr_output:
-                    print(stderr_output, file=sys.stderr)
-                    send_chunk(f"\nERROR LOG:\n{stderr_output}")
-
-                process.wait()
-                
-                # Send result metadata as final line
-                result_json = json.dumps({
-                    'success': process.returncode == 0,
-                    'game_path': f'/{project_name}/index.html',
-                    'project_name': project_name
-                })
-                send_chunk(f"\n__JSON_RESULT__{result_json}")
-                
-                # End stream
-                self.wfile.write(b"0\r\n\r\n")
-
-            except Exception as e:
-                print(f"Error in generation: {e}")
-                # If headers not sent yet, send 500. If sent, we just break stream.
-                pass
-            
+    def do_HEAD(self):
+        path = urlparse(self.path).path
+        return self.send_static('/home.html' if path == '/' else path)
+
+    def send_static(self, url_path):
+        """
+        Files go out through static_files.static_response (precompressed variants,
+        cache headers, 304s, byte ranges) with sendfile. Directories without an
+        index.html are left to SimpleHTTPRequestHandler.
+        """
+        fs_path = self.translate_path(url_path)
+        if os.path.isdir(fs_path) and url_path.endswith('/'):
+            fs_path = os.path.join(fs_path, 'index.html')
+        if not os.path.isfile(fs_path):
+            return super().do_GET() if self.command == 'GET' else super().do_HEAD()
+
+        status, headers, path, offset, length = static_response(fs_path, {k.lower(): v for k, v in self.headers.items()})
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        if path is None or self.command == 'HEAD':
             return
+        try:
+            with open(path, 'rb') as f:
+                self.connection.sendfile(f, offset, length)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def stream_job(self, job_id):
+        """
+        Streams a job's log over chunked encoding until it finishes. Disconnecting
+        only stops the stream; the job keeps running in the worker pool.
+        """
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('X-Content-Type-Options', 'nosniff')
+        self.end_headers()
+
+        # Helper to send chunk
+        def send_chunk(text):
+            if not text: return
+            b = text.encode('utf-8')
+            self.wfile.write(f"{len(b):X}\r\n".encode('utf-8'))
+            self.wfile.write(b)
+            self.wfile.write(b"\r\n")
+            self.wfile.flush()
+
+        try:
+            # Padding to force browser buffer flush (some browsers wait for 1KB)
+            send_chunk(" " * 1024 + "\n")
+
+            offset = 0
+            while True:
+                job = job_manager.get(job_id)
+                log, offset = job_manager.read_log(job_id, offset)
+                send_chunk(log)
+                if job['status'] in ('succeeded', 'failed') and not log:
+                    break
+                if not log:
+                    time.sleep(0.5)
+
+            # Send result metadata as final line
+            send_chunk(job_result(job))
+
+            # End stream
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def stream_events(self, job_id, last_id):
+        """
+        Server-Sent Events for a job, starting after last_id. Every watcher reads
+        the same in-memory event log, so following a job costs no work in the job;
+        the stream ends after the result event.
+        """
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.end_headers()
+        self.close_connection = True
+
+        events = job_manager.events(job_id)
+        try:
+            self.wfile.write(b"retry: 2000\n\n")
+            while True:
+                data, last_id, done = job_events(job_id, last_id)
+                if data:
+                    self.wfile.write(data)
+                    self.wfile.flush()
+                if done:
+                    break
+                if not events.wait(last_id, SSE_KEEPALIVE_SECONDS):
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == '/api/generate':
+            upload = None
+            try:
+                upload = new_upload({k.lower(): v for k, v in self.headers.items()}, url)
+                status, payload = submit_generation(*receive(upload, self.rfile.read))
+            except (UploadError, OSError) as e:
+                status, payload = upload_failed(upload, e)
+                # The rest of the body was not read, so the connection can't be reused
+                self.close_connection = True
+            return self.send_json(payload, status)
 
         return super().do_POST()
 
-def run_server():
+def start_jobs():
+    job_manager.add_listener(on_job_update)
+    job_manager.start()
+
+def run_server(port=PORT):
+    start_jobs()
     # Allow address reuse
     socketserver.ThreadingTCPServer.allow_reuse_address = True
-    with socketserver.ThreadingTCPServer(("", PORT), RPGRequestHandler) as httpd:
-        print(f"Serving RPG Maker at http://localhost:{PORT}")
+    with socketserver.ThreadingTCPServer(("", port), RPGRequestHandler) as httpd:
+        print(f"Serving RPG Maker at http://localhost:{port}")
         print(f"Serving from {BASE_DIR}")
         try:
             httpd.serve_forever()
@@ -150,4 +293,12 @@ def run_server():
             print("\nServer stopped.")
 
 if __name__ == "__main__":
-    run_server()
+    parser = argparse.ArgumentParser(description='Serve the RPG Maker home page, API and generated games.')
+    parser.add_argument('--port', type=int, default=PORT, help='Port to listen on.')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='Use the asyncio server (one event loop instead of a thread per connection).')
+    args = parser.parse_args()
+    if args.use_async:
+        from async_server import run_async_server
+        run_async_server(args.port)
+    else:
+        run_server(args.port)
@@ -0,0 +1,218 @@
+import os
+import re
+import gzip
+import shutil
+import tempfile
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from cache import hash_file
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Text formats worth compressing; images and audio already are
+COMPRESSIBLE_EXTENSIONS = ('.js', '.json', '.html', '.css', '.svg', '.txt')
+# Precompressed variants, most preferred first: (Content-Encoding, file suffix)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# A variant is only kept if it saves at least this fraction of the bytes
+MIN_SAVING = 0.1
+# <name>.<hash>.<ext>: the URL changes whenever the content does, so it can be cached for good
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12,64}\.[A-Za-z0-9]+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Revalidated on every use; a 304 costs no body
+REVALIDATE = 'no-cache'
+# Directory (next to main.py) the game.js template and the stock sounds are published
+# to, once for all games
+SHARED_DIR = 'shared'
+
+def hashed_name(filename, digest, length=12):
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.{digest[:length]}{ext}"
+
+def write_atomic(dest, write, mtime_ns=None):
+    """
+    Calls write(f) on a uniquely named temporary file next to dest, then renames it
+    over dest. Threads and processes (batch stories, server jobs) publishing the
+    same file never share a temporary file; the last rename wins.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=os.path.basename(dest) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        # mkstemp creates the file as 0600; the servers may run as another user
+        os.chmod(tmp_path, 0o644)
+        if mtime_ns is not None:
+            os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+        os.replace(tmp_path, dest)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def copy_atomic(src, dest):
+    with open(src, 'rb') as f:
+        write_atomic(dest, lambda out: shutil.copyfileobj(f, out))
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+def precompress(path):
+    """
+    Writes path.br (when the brotli module is installed) and path.gz next to a file,
+    with the file's mtime so a stale variant is recognized and never served.
+    Variants that would not save MIN_SAVING are removed. Returns the bytes written.
+    """
+    st = os.stat(path)
+    data = None
+    written = 0
+    for encoding, suffix in ENCODINGS:
+        variant = path + suffix
+        if encoding == 'br' and brotli is None:
+            continue
+        if os.path.exists(variant) and os.stat(variant).st_mtime_ns == st.st_mtime_ns:
+            continue
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        compressed = _compress(data, encoding)
+        if len(compressed) > len(data) * (1 - MIN_SAVING):
+            if os.path.exists(variant):
+                os.remove(variant)
+            continue
+        write_atomic(variant, lambda f: f.write(compressed), mtime_ns=st.st_mtime_ns)
+        written += len(compressed)
+    return written
+
+def precompress_game(game_dir):
+    """
+    Precompresses what a browser loads from a game folder: index.html,
+    game_data.json and the text files in assets/ (atlas.json...).
+    Returns the number of files looked at.
+    """
+    paths = [os.path.join(game_dir, name) for name in ('index.html', 'game_data.json')]
+    assets_dir = os.path.join(game_dir, 'assets')
+    if os.path.isdir(assets_dir):
+        paths += [os.path.join(assets_dir, name) for name in sorted(os.listdir(assets_dir))]
+    count = 0
+    for path in paths:
+        if os.path.isfile(path) and path.endswith(COMPRESSIBLE_EXTENSIONS):
+            precompress(path)
+            count += 1
+    return count
+
+def publish_shared(base_dir, src, digest=None):
+    """
+    Copies src to shared/<name>.<hash>.<ext> (plus its compressed variants) unless
+    that version is already there, and returns the published filename. Older
+    versions stay, so games built against them keep working.
+    """
+    name = hashed_name(os.path.basename(src), digest or hash_file(src))
+    shared_dir = os.path.join(base_dir, SHARED_DIR)
+    dest = os.path.join(shared_dir, name)
+    # The name is the content hash: a file of the right size there is this version
+    if not (os.path.isfile(dest) and os.path.getsize(dest) == os.path.getsize(src)):
+        os.makedirs(shared_dir, exist_ok=True)
+        copy_atomic(src, dest)
+    if dest.endswith(COMPRESSIBLE_EXTENSIONS):
+        precompress(dest)
+    return name
+
+def publish_template(base_dir, template='game.js'):
+    """
+    Publishes game/<template> to shared/ (see publish_shared).
+    """
+    return publish_shared(base_dir, os.path.join(base_dir, 'game', template))
+
+def write_index(template_path, dest_path, script_url):
+    """
+    Writes a game's index.html from the template, loading game.js from script_url.
+    """
+    with open(template_path, 'r', encoding='utf-8') as f:
+        html = f.read()
+    # Also matches a template that already points to a published copy
+    html = re.sub(rf'src="(?:\.\./{SHARED_DIR}/)?game(?:\.[0-9a-f]+)?\.js[^"]*"', f'src="{script_url}"', html)
+    write_atomic(dest_path, lambda f: f.write(html.encode('utf-8')))
+
+def accepted_encodings(header):
+    accepted = set()
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+def cache_control(path):
+    return IMMUTABLE if HASHED_NAME.search(os.path.basename(path)) else REVALIDATE
+
+def static_response(fs_path, headers):
+    """
+    Response for a static file, honouring Accept-Encoding (precompressed variants),
+    If-None-Match / If-Modified-Since and single byte ranges. headers is a
+    {lowercase name: value} dict. Returns (status, response headers, path, offset,
+    length): the byte range of path to send as the body (path is None for no body).
+    """
+    st = os.stat(fs_path)
+    send_path, encoding = fs_path, None
+    compressible = fs_path.endswith(COMPRESSIBLE_EXTENSIONS)
+    if compressible:
+        accepted = accepted_encodings(headers.get('accept-encoding'))
+        for name, suffix in ENCODINGS:
+            variant = fs_path + suffix
+            if name in accepted and os.path.exists(variant) and os.stat(variant).st_mtime_ns == st.st_mtime_ns:
+                send_path, encoding = variant, name
+                break
+    size = os.path.getsize(send_path)
+    etag = f'"{size:x}-{st.st_mtime_ns:x}' + (f'-{encoding}"' if encoding else '"')
+
+    resp = {
+        'Content-type': mimetypes.guess_type(fs_path)[0] or 'application/octet-stream',
+        'ETag': etag,
+        'Last-Modified': formatdate(st.st_mtime, usegmt=True),
+        'Cache-Control': cache_control(fs_path),
+    }
+    if compressible:
+        resp['Vary'] = 'Accept-Encoding'
+    if encoding:
+        resp['Content-Encoding'] = encoding
+    else:
+        resp['Accept-Ranges'] = 'bytes'
+
+    if_none_match = headers.get('if-none-match')
+    if if_none_match:
+        if if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]:
+            return 304, resp, None, 0, 0
+    elif headers.get('if-modified-since'):
+        try:
+            if int(st.st_mtime) <= parsedate_to_datetime(headers['if-modified-since']).timestamp():
+                return 304, resp, None, 0, 0
+        except (TypeError, ValueError):
+            pass
+
+    byte_range = headers.get('range')
+    if byte_range and encoding is None and headers.get('if-range', etag) == etag:
+        m = re.fullmatch(r'bytes=(\d*)-(\d*)', byte_range.strip())
+        if m and (m.group(1) or m.group(2)):
+            if m.group(1):
+                start = int(m.group(1))
+                end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+            else:
+                start, end = max(0, size - int(m.group(2))), size - 1
+            if start > end:
+                resp['Content-Range'] = f'bytes */{size}'
+                resp['Content-Length'] = '0'
+                return 416, resp, None, 0, 0
+            resp['Content-Range'] = f'bytes {start}-{end}/{size}'
+            resp['Content-Length'] = str(end - start + 1)
+            return 206, resp, send_path, start, end - start + 1
+
+    resp['Content-Length'] = str(size)
+    return 200, resp, send_path, 0, size
@@ -0,0 +1,136 @@
+from concurrent.futures import ThreadPoolExecutor
+import prompt_hub
+
+def split_story(story, chunk_chars=12000, overlap_chars=1000):
+    """
+    Splits a story into segments of at most chunk_chars characters, preferring to
+    break at a line end. Returns a list of (context, segment) where context is the
+    last overlap_chars characters before the segment (empty for the first one).
+    """
+    if chunk_chars <= 0 or len(story) <= chunk_chars:
+        return [('', story)]
+
+    chunks = []
+    start = 0
+    while start < len(story):
+        end = min(start + chunk_chars, len(story))
+        if end < len(story):
+            # Break at a newline in the last 20% of the window if there is one
+            cut = story.rfind('\n', start + int(chunk_chars * 0.8), end)
+            if cut > start:
+                end = cut + 1
+        context = story[max(0, start - overlap_chars):start]
+        chunks.append((context, story[start:end]))
+        start = end
+    return chunks
+
+def dedupe_scene_npcs(scenes):
+    """
+    Deduplicate NPCs within scenes (merge dialogues of repeated names).
+    """
+    for scene in scenes:
+        if 'npc' in scene:
+            merged_npcs = {}
+            new_npc_list = []
+            for npc in scene['npc']:
+                name = npc.get('name')
+                if not name:
+                    continue
+                
+                if name in merged_npcs:
+                    # Already exists, merge dialogue
+                    existing_npc = merged_npcs[name]
+                    if 'dialogue' in npc:
+                        existing_npc.setdefault('dialogue', []).extend(npc['dialogue'])
+                else:
+                    # New NPC for this scene
+                    merged_npcs[name] = npc
+                    new_npc_list.append(npc)
+            scene['npc'] = new_npc_list
+
+def apply_npc_stats(scenes, npc_list):
+    """
+    Apply NPC stats from npc_list to scene NPCs.
+    """
+    npc_stats_map = {}
+    for npc_def in npc_list:
+        name = npc_def.get('name')
+        if name:
+            npc_stats_map[name] = {
+                'hp': npc_def.get('hp'),
+                'attack': npc_def.get('attack'),
+                'defense': npc_def.get('defense')
+            }
+
+    for scene in scenes:
+        for npc in scene.get('npc', []):
+            name = npc.get('name')
+            if name in npc_stats_map:
+                stats = npc_stats_map[name]
+                if stats.get('hp') is not None:
+                    npc['hp'] = stats['hp']
+                if stats.get('attack') is not None:
+                    npc['attack'] = stats['attack']
+                if stats.get('defense') is not None:
+                    npc['defense'] = stats['defense']
+
+def merge_extractions(parts):
+    """
+    Merges per-segment extraction results (in story order) into one output.json dict.
+    NPC definitions are unioned by name (first outfit wins, missing stats are filled
+    from later parts); scenes are concatenated and their NPCs deduplicated.
+    """
+    merged = {'bgm': '', 'player': {}, 'npc_list': [], 'minions': [], 'scenes': []}
+    npc_defs = {}
+    for part in parts:
+        if not isinstance(part, dict):
+            continue
+        if not merged['bgm'] and part.get('bgm'):
+            merged['bgm'] = part['bgm']
+        if not merged['player'] and part.get('player'):
+            merged['player'] = part['player']
+        for npc_def in part.get('npc_list', []):
+            name = npc_def.get('name')
+            if not name:
+                continue
+            if name not in npc_defs:
+                npc_defs[name] = dict(npc_def)
+                merged['npc_list'].append(npc_defs[name])
+            else:
+                for key, value in npc_def.items():
+                    npc_defs[name].setdefault(key, value)
+        # The prompt asks for a single minion type
+        if not merged['minions'] and part.get('minions'):
+            merged['minions'] = part['minions'][:1]
+        merged['scenes'].extend(part.get('scenes', []))
+
+    # The player is not an NPC, even if a later part listed them as one
+    player_name = merged['player'].get('name')
+    merged['npc_list'] = [n for n in merged['npc_list'] if n.get('name') != player_name]
+    dedupe_scene_npcs(merged['scenes'])
+    apply_npc_stats(merged['scenes'], merged['npc_list'])
+    return merged
+
+def extract_story(client, story, prompt, chunk_chars=12000, overlap_chars=1000, max_workers=4):
+    """
+    Extracts the output.json data for a story. Short stories are sent in one request
+    as before; long ones are split into overlapping segments that are extracted in
+    parallel and merged.
+    """
+    chunks = split_story(story, chunk_chars, overlap_chars)
+    if len(chunks) == 1:
+        return client.generate_json(story, prompt)
+
+    print(f"Story is {len(story)} characters, extracting in {len(chunks)} parts...")
+
+    def extract(index):
+        context, segment = chunks[index]
+        chunk_prompt = prompt + prompt_hub.chunk_prompt_template.format(index=index + 1, total=len(chunks))
+        text = f"<previous_context>\n{context}\n</previous_context>\n<current_part>\n{segment}\n</current_part>"
+        result = client.generate_json(text, chunk_prompt)
+        print(f"Extracted part {index + 1}/{len(chunks)}")
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        parts = list(pool.map(extract, range(len(chunks))))
+    return merge_extractions(parts)
@@ -0,0 +1,244 @@
+import os
+import re
+import json
+import uuid
+import codecs
+
+# Largest accepted /api/generate body; override with RPG_MAX_UPLOAD_MB
+MAX_UPLOAD_BYTES = int(float(os.getenv('RPG_MAX_UPLOAD_MB', '16')) * 1024 * 1024)
+CHUNK_SIZE = 64 * 1024
+# Multipart part headers and small form fields (the project name) are buffered up to this size
+MAX_FIELD_BYTES = 4096
+DEFAULT_PROJECT_NAME = 'new_story'
+
+class UploadError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def sanitize_name(name):
+    name = "".join(x for x in (name or '') if x.isalnum() or x in ('_', '-'))
+    return name or "generated_game"
+
+def header_params(value):
+    """
+    'multipart/form-data; boundary="x"' -> ('multipart/form-data', {'boundary': 'x'})
+    """
+    kind, _, rest = (value or '').partition(';')
+    params = {}
+    for key, quoted, plain in re.findall(r'([\w-]+)\s*=\s*(?:"((?:[^"\\]|\\.)*)"|([^;\s]*))', rest):
+        params[key.lower()] = quoted.replace('\\"', '"') if quoted else plain
+    return kind.strip().lower(), params
+
+class StorySink:
+    """
+    Writes the story to path as UTF-8, a chunk at a time, transcoding from charset
+    and rejecting bytes that are not valid in it.
+    """
+    def __init__(self, path, charset='utf-8'):
+        try:
+            self.decoder = codecs.getincrementaldecoder(charset or 'utf-8')()
+        except LookupError:
+            raise UploadError(415, f"Unsupported charset: {charset}")
+        self.utf8 = codecs.lookup(charset or 'utf-8').name == 'utf-8'
+        self.file = open(path, 'wb')
+        self.bytes = 0
+
+    def write(self, data, final=False):
+        try:
+            text = self.decoder.decode(data, final)
+        except UnicodeDecodeError as e:
+            raise UploadError(400, f"Story is not valid text: {e.reason}")
+        out = data if self.utf8 else text.encode('utf-8')
+        self.file.write(out)
+        self.bytes += len(out)
+
+    def close(self):
+        self.write(b'', final=True)
+        self.file.close()
+
+class StoryUpload:
+    """
+    Incremental parser for a POST /api/generate body. feed() it the body as it is
+    read from the socket: the story goes straight to a file in upload_dir, so memory
+    use does not depend on the story length. Accepted bodies:
+    - text/plain: the body is the story; the project name comes from ?name=
+    - multipart/form-data: a "story" field or file, and a "name" field
+    - application/json: {"story": ..., "name": ...}. The JSON is parsed as a whole,
+      so this is only meant for small stories; it is still capped at max_bytes.
+    """
+    def __init__(self, headers, query, upload_dir, max_bytes=MAX_UPLOAD_BYTES):
+        if 'chunked' in headers.get('transfer-encoding', '').lower() or headers.get('content-length') is None:
+            raise UploadError(411, "Content-Length required")
+        try:
+            self.content_length = int(headers['content-length'])
+        except ValueError:
+            raise UploadError(400, "Invalid Content-Length")
+        if self.content_length < 0:
+            raise UploadError(400, "Invalid Content-Length")
+        if self.content_length > max_bytes:
+            raise UploadError(413, f"Story upload is larger than {max_bytes // (1024 * 1024)} MB")
+
+        self.kind, params = header_params(headers.get('content-type', 'text/plain'))
+        self.name = query.get('name', [None])[0]
+        self.path = os.path.join(upload_dir, f"upload-{uuid.uuid4().hex}.part")
+        self.received = 0
+        self.sink = None
+        self.buffer = b''
+
+        if self.kind == 'multipart/form-data':
+            if not params.get('boundary'):
+                raise UploadError(400, "Multipart body without boundary")
+            self.delimiter = b'--' + params['boundary'].encode('latin-1')
+            self.state = 'preamble'
+            self.field = None
+        elif self.kind == 'application/json':
+            self.state = 'json'
+            self.buffer = bytearray()
+        elif self.kind.startswith('text/') or self.kind == 'application/octet-stream':
+            self.state = 'raw'
+            self.sink = StorySink(self.path, params.get('charset'))
+        else:
+            raise UploadError(415, f"Unsupported Content-Type: {self.kind}")
+
+    def feed(self, data):
+        self.received += len(data)
+        if self.received > self.content_length:
+            raise UploadError(400, "Body longer than Content-Length")
+        if self.state == 'raw':
+            self.sink.write(data)
+        elif self.state == 'json':
+            self.buffer += data
+        else:
+            self.buffer += data
+            self._parse_multipart()
+
+    def _parse_multipart(self):
+        while True:
+            if self.state == 'preamble':
+                i = self.buffer.find(self.delimiter)
+                if i < 0:
+                    # Keep enough to recognize a delimiter split across chunks
+                    self.buffer = self.buffer[-len(self.delimiter):]
+                    return
+                self.buffer = self.buffer[i + len(self.delimiter):]
+                self.state = 'boundary'
+            elif self.state == 'boundary':
+                if len(self.buffer) < 2:
+                    return
+                if self.buffer.startswith(b'--'):
+                    self.state = 'epilogue'
+                elif self.buffer.startswith(b'\r\n'):
+                    self.buffer = self.buffer[2:]
+                    self.state = 'headers'
+                else:
+                    raise UploadError(400, "Malformed multipart boundary")
+            elif self.state == 'headers':
+                i = self.buffer.find(b'\r\n\r\n')
+                if i < 0:
+                    if len(self.buffer) > MAX_FIELD_BYTES:
+                        raise UploadError(400, "Multipart headers too long")
+                    return
+                self._start_part(self.buffer[:i].decode('utf-8', errors='replace'))
+                self.buffer = self.buffer[i + 4:]
+                self.state = 'body'
+            elif self.state == 'body':
+                marker = b'\r\n' + self.delimiter
+                i = self.buffer.find(marker)
+                if i < 0:
+                    keep = len(marker) - 1
+                    if len(self.buffer) > keep:
+                        self._part_data(self.buffer[:-keep])
+                        self.buffer = self.buffer[-keep:]
+                    return
+                self._part_data(self.buffer[:i])
+                self._end_part()
+                self.buffer = self.buffer[i + len(marker):]
+                self.state = 'boundary'
+            else:
+                # Epilogue after the closing delimiter is ignored
+                self.buffer = b''
+                return
+
+    def _start_part(self, header_text):
+        disposition, content_type = '', ''
+        for line in header_text.split('\r\n'):
+            key, _, value = line.partition(':')
+            if key.strip().lower() == 'content-disposition':
+                disposition = value
+            elif key.strip().lower() == 'content-type':
+                content_type = value
+        self.field = header_params(disposition)[1].get('name')
+        self.value = b''
+        if self.field == 'story':
+            if self.sink is not None:
+                raise UploadError(400, "More than one story in the upload")
+            self.sink = StorySink(self.path, header_params(content_type)[1].get('charset'))
+
+    def _part_data(self, data):
+        if self.field == 'story':
+            self.sink.write(data)
+        elif self.field == 'name':
+            self.value += data
+            if len(self.value) > MAX_FIELD_BYTES:
+                raise UploadError(400, "Project name too long")
+
+    def _end_part(self):
+        if self.field == 'name':
+            self.name = self.value.decode('utf-8', errors='replace')
+        self.field = None
+
+    def finish(self):
+        """
+        Completes the upload. Returns (project_name, story_path); the caller owns
+        the story file from then on.
+        """
+        if self.received < self.content_length:
+            raise UploadError(400, "Body shorter than Content-Length")
+        if self.state == 'json':
+            try:
+                data = json.loads(self.buffer.decode('utf-8'))
+                story = data.get('story', '')
+                self.name = data.get('name', self.name)
+            except (UnicodeDecodeError, json.JSONDecodeError, AttributeError) as e:
+                raise UploadError(400, f"Invalid JSON body: {e}")
+            if not isinstance(story, str):
+                raise UploadError(400, "'story' must be a string")
+            if self.name is not None and not isinstance(self.name, str):
+                raise UploadError(400, "'name' must be a string")
+            self.buffer = b''
+            self.sink = StorySink(self.path)
+            self.sink.write(story.encode('utf-8'))
+        elif self.state not in ('raw', 'epilogue'):
+            raise UploadError(400, "Incomplete multipart body")
+        if self.sink is None:
+            raise UploadError(400, "No story in the upload")
+        self.sink.close()
+        if self.sink.bytes == 0:
+            raise UploadError(400, "Story is empty")
+        return sanitize_name(self.name or DEFAULT_PROJECT_NAME), self.path
+
+    def discard(self):
+        """
+        Removes the partial story file after a failed or aborted upload.
+        """
+        if self.sink is not None and not self.sink.file.closed:
+            self.sink.file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def receive(upload, read):
+    """
+    Feeds upload from read(n) (e.g. rfile.read) until Content-Length bytes arrived,
+    CHUNK_SIZE at a time. Returns the result of upload.finish().
+    """
+    remaining = upload.content_length
+    while remaining > 0:
+        data = read(min(CHUNK_SIZE, remaining))
+        if not data:
+            raise UploadError(400, "Connection closed during upload")
+        upload.feed(data)
+        remaining -= len(data)
+    return upload.finish()